@@ -336,14 +336,13 @@ def build_dependencies(project):
     project.build_depends_on('pytest-xdist')
     
     # pybuilder test lib (TODO)
-    #project.build_depends_on('plumbum')
+    project.build_depends_on('plumbum')
     project.build_depends_on('vex')
     
 @init()
 def dependencies(project):
-    project.depends_on('pip-tools', '~=1.7')
-    project.depends_on('plumbum')
-    project.depends_on('attrs')
+    project.depends_on('pip-tools', '>=1.8')  # --upgrade-package
+    project.depends_on('packaging', '>=22')  # InvalidVersion on legacy versions, parse_wheel_filename
     
 @init()
 def initialize(project):
@@ -358,6 +357,7 @@ def initialize(project):
 
     # setup.py
     project.set_property('distutils_console_scripts', [  # entry points
+        'pybuilder-pip-tools-workspace = pybuilder_pip_tools.workspace:main',
     ])
     project.set_property('distutils_setup_keywords', 'pybuilder plugin pip-tools requirements.txt')
     project.set_property('distutils_classifiers', [  # https://pypi.python.org/pypi?%3Aaction=list_classifiers
@@ -367,7 +367,9 @@ def initialize(project):
         'License :: OSI Approved :: GNU Lesser General Public License v3 (LGPLv3)',
         'Natural Language :: English',
         'Operating System :: OS Independent',
-        'Programming Language :: Python :: 3.4',  # pip-tools does not support 2.6, 3.2, 3.3.  2.7 lacks textwrap.indent
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.8',  # importlib.metadata
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Topic :: Software Development :: Build Tools',
     ])
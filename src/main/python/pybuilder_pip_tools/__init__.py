@@ -19,12 +19,21 @@ __version__ = '$version'
 
 from pybuilder.core import init, task, depends
 from pybuilder.errors import BuildFailedException
-from tempfile import NamedTemporaryFile
+from pybuilder_pip_tools.lock_cache import LockCache, lock_key, default_cache_dir, prune, pip_tools_version
+from pybuilder_pip_tools import process, sync, engine, instrumentation, requirement, watch, hashes, graph, bundle, history
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from tempfile import TemporaryDirectory
+from contextlib import contextmanager, nullcontext
+from functools import partial
 from glob import glob
-import re
+import traceback
+import datetime
+import json
+import threading
+import shutil
+import uuid
 import os
 import sys
-from urllib.parse import urlparse, parse_qs
 
 # Assumptions
 # - when referring to extras, a user does so in `name`, e.g. depends_on('pkg[opt1,opt2]')
@@ -33,30 +42,862 @@ from urllib.parse import urlparse, parse_qs
 def init(project):
     project.set_property_if_unset('pybuilder_pip_tools_urls', [])  
     project.set_property_if_unset('pybuilder_pip_tools_build_urls', [])
+    project.set_property_if_unset('pybuilder_pip_tools_lock_cache_dir', os.path.join(default_cache_dir(), 'locks'))
+    project.set_property_if_unset('pybuilder_pip_tools_lock_cache_size', 256)
+    project.set_property_if_unset('pybuilder_pip_tools_lock_cache_max_age', 3600)
+    project.set_property_if_unset('pybuilder_pip_tools_jobs', 4)
+    project.set_property_if_unset('pybuilder_pip_tools_derive_requirements', False)
+    project.set_property_if_unset('pybuilder_pip_tools_engine', 'subprocess')
+    project.set_property_if_unset('pybuilder_pip_tools_daemon_socket', None)
+    project.set_property_if_unset('pybuilder_pip_tools_cache_dir', None)
+    project.set_property_if_unset('pybuilder_pip_tools_cache_prewarm', False)
+    project.set_property_if_unset('pybuilder_pip_tools_cache_max_age', None)
+    project.set_property_if_unset('pybuilder_pip_tools_cache_max_size', None)
+    project.set_property_if_unset('pybuilder_pip_tools_upgrade_packages', [])
+    project.set_property_if_unset('pybuilder_pip_tools_wheelhouse', None)
+    project.set_property_if_unset('pybuilder_pip_tools_constrain_build', False)
+    project.set_property_if_unset('pybuilder_pip_tools_watch_interval', 1)
+    project.set_property_if_unset('pybuilder_pip_tools_sync_mode', 'pip-sync')
+    project.set_property_if_unset('pybuilder_pip_tools_hashes', False)
+    project.set_property_if_unset('pybuilder_pip_tools_hash_store', os.path.join(default_cache_dir(), 'hashes.sqlite'))
+    project.set_property_if_unset('pybuilder_pip_tools_graph', False)
+    project.set_property_if_unset('pybuilder_pip_tools_compile_timeout', None)
+    project.set_property_if_unset('pybuilder_pip_tools_sync_timeout', None)
+    project.set_property_if_unset('pybuilder_pip_tools_bundle_dir', '$dir_target/pip_bundle')
+    project.set_property_if_unset('pybuilder_pip_tools_history', os.path.join(default_cache_dir(), 'history.sqlite'))
+    project.set_property_if_unset('pybuilder_pip_tools_stats_days', 30)
+    project.set_property_if_unset('pybuilder_pip_tools_history_days', 90)
 
 @task(description='Update `*requirements*.txt` with pip-compile and pip-sync `*requirements_development.txt`')
 @depends('prepare')  # Note: plugin dependencies are installed during 'prepare'
-def pip_sync(project):
-    import plumbum as pb
-    _pip_compile(project.dependencies, project.get_property('pybuilder_pip_tools_urls'), 'requirements', 'depends_on')
-    _pip_compile(_merged_dependencies(project), project.get_property('pybuilder_pip_tools_build_urls'), 'build_requirements', 'build_depends_on or plugin_depends_on')
-    pb.local['pip-sync'](*glob('*requirements_development.txt'))
+def pip_sync(project, logger):
+    _compile_and_sync(project, logger, 'pip_sync')
+    
+@task(description='Update `*requirements*.txt` with pip-compile, unless up to date')
+def pip_compile(project, logger):
+    _compile_stems(project, logger, 'pip_compile', _STEMS)
+    
+@task(description='Update `requirements*.txt` with pip-compile, unless up to date')
+def pip_compile_runtime(project, logger):
+    _compile_stems(project, logger, 'pip_compile_runtime', ['requirements'])
+    
+@task(description='Update `build_requirements*.txt` with pip-compile, unless up to date')
+def pip_compile_build(project, logger):
+    _compile_stems(project, logger, 'pip_compile_build', ['build_requirements'])
+    
+@task(description='pip-sync `*requirements_development.txt` as they are, unless already in sync')
+@depends('prepare')  # run compile tasks before it by listing them first, e.g. pyb pip_compile pip_sync_env
+def pip_sync_env(project, logger):
+    with _reported(project, logger, 'pip_sync_env') as report:
+        with report.phase('Syncing'):
+            _pip_sync(project, logger, report)
+    
+@task(description='Show trends of the runs in $pybuilder_pip_tools_history of the last $pybuilder_pip_tools_stats_days days')
+def pip_sync_stats(project, logger):
+    path = project.get_property('pybuilder_pip_tools_history')
+    if not path:
+        raise BuildFailedException('Cannot show stats, pybuilder_pip_tools_history is not set')
+    days = project.get_property('pybuilder_pip_tools_stats_days')
+    try:
+        days = float(days)
+    except (TypeError, ValueError):
+        days = None
+    if days is None or days <= 0:
+        raise BuildFailedException(
+            'pybuilder_pip_tools_stats_days must be a positive number of days, got: {!r}'
+            .format(project.get_property('pybuilder_pip_tools_stats_days'))
+        )
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+    runs = history.History(path).runs(project.basedir, since.isoformat())
+    if not runs:
+        logger.info('No runs of {} in {} in the last {:g} days'.format(project.basedir, path, days))
+        return
+    for line in history.format_stats(history.stats(runs)):
+        logger.info(line)
+    
+@task(description='Upgrade $pybuilder_pip_tools_upgrade_packages in `*requirements*.txt`, keeping other pins, and pip-sync')
+@depends('prepare')
+def pip_upgrade(project, logger):
+    packages = project.get_property('pybuilder_pip_tools_upgrade_packages')
+    if isinstance(packages, str):  # e.g. pyb -P pybuilder_pip_tools_upgrade_packages=pkg1,pkg2
+        packages = packages.split(',')
+    packages = [package.strip() for package in packages if package.strip()]
+    if not packages:
+        raise BuildFailedException(
+            'No packages to upgrade. '
+            'Set pybuilder_pip_tools_upgrade_packages, '
+            'e.g. pyb pip_upgrade -P pybuilder_pip_tools_upgrade_packages=pkg1,pkg2'
+        )
+    
+    # Warn about packages not pinned anywhere
+    from packaging.utils import canonicalize_name
+    lock_file = sync.read_lock_files(sorted(glob('*requirements*.txt')))
+    pinned = set(lock_file.pins) | set(lock_file.editables)
+    for package in packages:
+        if canonicalize_name(package) not in pinned:
+            logger.warn('Cannot upgrade {!r}, it is not pinned in any requirements file'.format(package))
+            
+    _compile_and_sync(project, logger, 'pip_upgrade', upgrade_packages=packages)
+    
+@task(description='Watch build.py, pip_sync whenever it changes. Stop with Ctrl+C')
+@depends('prepare')
+def pip_sync_watch(project, logger):
+    build_py = os.path.join(project.basedir, 'build.py')
+    if project.get_property('pybuilder_pip_tools_engine') == 'subprocess':
+        logger.info(
+            'Compiling with the subprocess engine, set pybuilder_pip_tools_engine to in_process or daemon '
+            'to keep the resolver warm between runs'
+        )
+    engines = {}
+    inputs = {}
+    _compile_and_sync(project, logger, 'pip_sync_watch', engines=engines, inputs=inputs)
+    with watch.Watcher([build_py], float(project.get_property('pybuilder_pip_tools_watch_interval'))) as watcher:
+        logger.info('Watching {} ({}), press Ctrl+C to stop'.format(build_py, 'inotify' if watcher.uses_inotify else 'polling'))
+        try:
+            while True:
+                watcher.wait()
+                logger.info('{} changed'.format(build_py))
+                try:
+                    _compile_and_sync(_reload_project(project, logger), logger, 'pip_sync_watch', engines=engines, inputs=inputs)
+                except BuildFailedException as ex:
+                    logger.error(str(ex))
+                except Exception:
+                    logger.error(traceback.format_exc())
+        except KeyboardInterrupt:
+            logger.info('Stopped watching {}'.format(build_py))
+            
+def _reload_project(project, logger):
+    '''
+    Load build.py of project again
+    
+    Properties which are not set by the reloaded build.py, nor by the plugins
+    it loads for the first time, keep their current value.
+    
+    Returns
+    -------
+    pybuilder.core.Project
+    '''
+    from pybuilder.reactor import Reactor
+    from pybuilder.execution import ExecutionManager
+    current_reactor = Reactor.current_instance()
+    reactor = Reactor(logger, ExecutionManager(logger))
+    def reuse_plugin_environment(*args, **kwargs):  # PyBuilder>=0.12, instead of setting it up again
+        reactor.python_env_registry['pybuilder'] = current_reactor.python_env_registry['pybuilder']
+    reactor._setup_plugin_directory = reuse_plugin_environment
+    try:
+        reactor.prepare_build(project_directory=project.basedir)
+        reactor.execution_manager.execute_initializers([], logger=logger, project=reactor.project, reactor=reactor)
+    finally:
+        Reactor._current_instance = current_reactor
+    reloaded = reactor.project
+    
+    # Initializers of plugins imported earlier are not run again
+    for name, value in project.properties.items():
+        if not reloaded.has_property(name):
+            reloaded.set_property(name, value)
+    return reloaded
+    
+_STEMS = ('requirements', 'build_requirements')
+
+def _compile_stems(project, logger, task, stems):
+    '''
+    Compile the requirements files of stems, unless up to date
+    
+    The state of each stem is kept in $dir_target/pip_compile.json, see the
+    inputs parameter of `_compile`.
+    '''
+    state_file = project.expand_path('$dir_target', 'pip_compile.json')
+    try:
+        with open(state_file) as f:
+            inputs = json.load(f)
+    except (FileNotFoundError, ValueError):
+        inputs = {}
+    with _reported(project, logger, task) as report:
+        _compile(project, logger, report, inputs=inputs, stems=stems)
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with open(state_file, 'w') as f:
+        json.dump(inputs, f, indent=2, sort_keys=True)
+        
+def _compile_and_sync(project, logger, task, upgrade_packages=(), engines=None, inputs=None):
+    '''
+    Compile `*requirements*.txt` and pip-sync `*requirements_development.txt`
+    
+    Parameters
+    ----------
+    task : str
+        Name of the task, for the history.
+    upgrade_packages : iterable(str)
+        Packages to upgrade. Pins of other packages are reused where possible.
+    engines : {tuple => engine} or None
+        If set, reuse the engine of a previous call with the same engine
+        properties and environment. Keeps the resolver of the in_process
+        engine warm.
+    inputs : {str => dict} or None
+        If set, the state of each stem at the previous call, see `_compile`.
+    '''
+    with _reported(project, logger, task) as report:
+        _compile(project, logger, report, upgrade_packages, engines, inputs)
+        with report.phase('Syncing'):
+            _pip_sync(project, logger, report)
+    
+@contextmanager
+def _reported(project, logger, task):
+    '''
+    Yield a report of the run of a task, written when the body exits
+    
+    The report is written to $dir_reports/pybuilder_pip_tools.json and
+    appended to $pybuilder_pip_tools_history, from which runs older than
+    $pybuilder_pip_tools_history_days are removed. Any failure to write or
+    append, e.g. a missing property, is logged, not raised, so it neither
+    fails a successful run nor replaces the exception of a failed one.
+    '''
+    report = instrumentation.Report(logger)
+    try:
+        yield report
+    except BaseException:
+        report.failed = True
+        raise
+    finally:
+        try:
+            report.write(project.expand_path('$dir_reports', 'pybuilder_pip_tools.json'))
+        except Exception as ex:
+            logger.warn('Failed to write report $dir_reports/pybuilder_pip_tools.json: {}'.format(ex))
+        try:
+            path = project.get_property('pybuilder_pip_tools_history')
+            if path:
+                history_ = history.History(path)
+                history_.add(project.basedir, task, report.to_dict())
+                days = project.get_property('pybuilder_pip_tools_history_days')
+                if days is not None:
+                    before = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=float(days))
+                    history_.prune(before.isoformat())
+        except Exception as ex:
+            logger.warn('Failed to append run to $pybuilder_pip_tools_history: {}'.format(ex))
+        
+def _compile(project, logger, report, upgrade_packages=(), engines=None, inputs=None, stems=_STEMS):
+    '''
+    Compile `*requirements*.txt` of project
+    
+    Must be called from the project directory. See `_compile_and_sync` for
+    the other parameters.
+    
+    Parameters
+    ----------
+    inputs : {str => dict} or None
+        If set, the inputs and outputs of each stem when it was last compiled.
+        Stems whose inputs are unchanged and whose outputs were not modified
+        are not compiled again. Updated in place.
+    stems : iterable(str)
+        Stems to compile, a subset of `_STEMS`. The files of other stems are
+        used as they are, e.g. as constraints.
+    '''
+    env = _pip_tools_env(project)
+    if engines is None:
+        engine_ = _engine(project, env)
+    else:
+        key = tuple(
+            [project.get_property(name) for name in ('pybuilder_pip_tools_engine', 'pybuilder_pip_tools_daemon_socket', 'pybuilder_pip_tools_compile_timeout')]
+            + sorted(env.items())
+        )
+        if key not in engines:
+            engines[key] = _engine(project, env)
+        engine_ = engines[key]
+    compilation = _Compilation(
+        engine_, _lock_cache(project), logger, env, upgrade_packages, report, _hash_store(project),
+        graph=project.get_property('pybuilder_pip_tools_graph'),
+        timeout=_timeout(project, 'pybuilder_pip_tools_sync_timeout'),
+        hash_development=not any(project.get_property(name) for name in ('pybuilder_pip_tools_urls', 'pybuilder_pip_tools_build_urls')),
+    )
+    derive = project.get_property('pybuilder_pip_tools_derive_requirements')
+    constraints_stem = 'requirements' if project.get_property('pybuilder_pip_tools_constrain_build') else None
+    with report.phase('Merging build and plugin dependencies'):
+        build_dependencies = _merged_dependencies(project)
+    with report.phase('Validating and merging urls'):
+        all_stems = (  # build jobs wait for the runtime jobs they are constrained by, so those must be submitted first
+            ('requirements', _requirements(project.dependencies, 'depends_on'), project.get_property('pybuilder_pip_tools_urls'), 'depends_on', None),
+            ('build_requirements', build_dependencies, project.get_property('pybuilder_pip_tools_build_urls'), 'build_depends_on or plugin_depends_on', constraints_stem),
+        )
+        jobs = []
+        new_inputs = {}
+        constraints_stems = {}
+        compiled_stems = set()
+        for stem, dependencies, urls, depends_on, stem_constraints in all_stems:
+            stem_jobs = _pip_compile(dependencies, urls, stem, depends_on, derive, stem_constraints)
+            files = [stem + '_development.txt', stem + '.txt']
+            if inputs is not None:
+                new_inputs[stem] = [
+                    _requirements_in_lines(dependencies, True), _requirements_in_lines(dependencies, False),
+                    derive, env,
+                    compilation.graphs is not None, compilation.hash_store is not None, compilation.hash_development,
+                    [sys.executable, sys.version, pip_tools_version()],
+                ]
+                constraints_stems[stem] = stem_constraints
+            if stem not in stems:
+                for file in files:
+                    if os.path.exists(file):
+                        compilation.written(file).set()
+                continue
+            report.add_stem(stem, {key for key, _ in dependencies}, len(urls))
+            if stem_constraints and stem_constraints not in stems:
+                constraints_files = [stem_constraints + '_development.txt', stem_constraints + '.txt']
+                if not all(map(os.path.exists, constraints_files)):
+                    raise BuildFailedException(
+                        'Cannot compile {}*.txt, pybuilder_pip_tools_constrain_build requires {} which do not exist. '
+                        'Compile them first, e.g. with pip_compile_runtime.'
+                        .format(stem, ' and '.join(constraints_files))
+                    )
+            # The constraints files are final unless their stem is compiled in this run
+            if (
+                inputs is not None and stem_constraints not in compiled_stems and
+                inputs.get(stem) == _stem_state(project, stem, new_inputs[stem], compilation, stem_constraints)
+            ):
+                logger.info('Skipped compiling {}*.txt, it is up to date'.format(stem))
+                for file in files:
+                    compilation.written(file).set()
+                continue
+            jobs.extend(stem_jobs)
+            compiled_stems.add(stem)
+    if project.get_property('pybuilder_pip_tools_cache_prewarm'):
+        jobs.append(partial(_prewarm_cache, sorted(glob('*requirements.txt'))))
+    max_workers = int(project.get_property('pybuilder_pip_tools_jobs'))
+    if not engine_.concurrent:
+        max_workers = min(max_workers, 1)  # other jobs' log output would be captured as pip-compile output
+    with report.phase('Compiling'):
+        _run_jobs(jobs, max_workers, compilation)
+    changed_files = report.changed_files()
+    if changed_files:
+        logger.info('Changed {}'.format(', '.join(changed_files)))
+    else:
+        logger.info('Requirements files unchanged')
+    if compilation.graphs:
+        for stem in stems:
+            _write_graph(project, stem, compilation.graphs)
+    if inputs is not None:
+        for stem in stems:
+            inputs[stem] = _stem_state(project, stem, new_inputs[stem], compilation, constraints_stems[stem])
+            
+def _stem_state(project, stem, stem_inputs, compilation, constraints_stem=None):
+    '''
+    Get the inputs, a digest of the constraints files and a digest of the outputs of compiling stem
+    
+    A digest is None when one of its files does not exist, or when there are
+    no constraints files.
+    '''
+    def digest(files):
+        return sync.digest(files) if all(map(os.path.exists, files)) else None
+    outputs = [stem + '_development.txt', stem + '.txt']
+    if compilation.graphs is not None:
+        outputs.append(_graph_path(project, stem))
+    constraints = None
+    if constraints_stem:
+        constraints = digest([constraints_stem + '_development.txt', constraints_stem + '.txt'])
+    return {'inputs': stem_inputs, 'constraints': constraints, 'outputs': digest(outputs)}
+    
+@task(description='Remove old files from $pybuilder_pip_tools_cache_dir')
+def pip_cache_prune(project, logger):
+    cache_dir = project.get_property('pybuilder_pip_tools_cache_dir')
+    if not cache_dir:
+        raise BuildFailedException('Cannot prune cache, pybuilder_pip_tools_cache_dir is not set')
+    max_age = project.get_property('pybuilder_pip_tools_cache_max_age')
+    max_size = project.get_property('pybuilder_pip_tools_cache_max_size')
+    if max_age is None and max_size is None:
+        raise BuildFailedException(
+            'Cannot prune cache, set pybuilder_pip_tools_cache_max_age (days) '
+            'and/or pybuilder_pip_tools_cache_max_size (MB)'
+        )
+    count, size = prune(
+        cache_dir,
+        max_age=None if max_age is None else float(max_age) * 24 * 60 * 60,
+        max_size=None if max_size is None else int(float(max_size) * 1024 * 1024),
+    )
+    logger.info('Removed {} files ({:.1f} MB) from {}'.format(count, size / 1024 / 1024, cache_dir))
+    
+@task(description='Download the pins of `*requirements*.txt` into $pybuilder_pip_tools_wheelhouse')
+def pip_wheelhouse(project, logger):
+    wheelhouse = project.get_property('pybuilder_pip_tools_wheelhouse')
+    if not wheelhouse:
+        raise BuildFailedException('Cannot fill wheelhouse, pybuilder_pip_tools_wheelhouse is not set')
+    wheelhouse = os.path.abspath(wheelhouse)
+    os.makedirs(wheelhouse, exist_ok=True)
+    
+    lock_file = sync.read_lock_files(sorted(glob('*requirements*.txt')))
+    for line in sorted(lock_file.editables.values()):
+        logger.warn('Skipped url requirement, it is not installed from the wheelhouse: {}'.format(line))
+    requirements = sorted(set(
+        '{}=={}'.format(name, version) for name, version in lock_file.pins.items()
+    ))
+    
+    # Download in batches, one pip process per worker
+    max_workers = int(project.get_property('pybuilder_pip_tools_jobs'))
+    batches = [requirements[i::max_workers] for i in range(max_workers)]
+    env = _pip_tools_env(project, wheelhouse=False)
+    jobs = [
+        partial(_pip_download, batch, wheelhouse, env)
+        for batch in batches if batch
+    ]
+    compilation = _Compilation(None, None, logger, env, timeout=_timeout(project, 'pybuilder_pip_tools_sync_timeout'))
+    _run_jobs(jobs, max_workers, compilation, 'pip download')
+    logger.info('Downloaded {} packages to {}'.format(len(requirements), wheelhouse))
+    
+def _pip_download(requirements, directory, env, compilation, options=()):
+    '''
+    Download requirements into directory, without their dependencies
+    
+    Parameters
+    ----------
+    requirements : [str]
+        Requirement lines, e.g. pins with ``--hash`` options, which pip checks.
+    options : iterable(str)
+        Option lines of the requirements files, e.g. ``--index-url``.
+    '''
+    with TemporaryDirectory() as temporary_directory:
+        requirements_txt = os.path.join(temporary_directory, 'requirements.txt')
+        with open(requirements_txt, 'w') as f:
+            f.write(''.join(line + '\n' for line in list(options) + requirements))
+        completed = process.run(
+            [sys.executable, '-m', 'pip', 'download', '--no-deps', '--dest', directory, '-r', requirements_txt],
+            compilation.cancel, env, compilation.timeout, _log_lines(compilation.logger, 'pip download')
+        )
+    compilation.report.add_process('pip download', completed)
+    
+@task(description='Bundle wheels of requirements.txt and build_requirements.txt into $pybuilder_pip_tools_bundle_dir')
+def pip_bundle(project, logger):
+    requirements_files = ['requirements.txt', 'build_requirements.txt']
+    missing_files = [name for name in requirements_files if not os.path.exists(name)]
+    if missing_files:
+        raise BuildFailedException('Cannot bundle, {} not found. Run pip_sync first.'.format(', '.join(missing_files)))
+    directory = project.expand_path('$pybuilder_pip_tools_bundle_dir')
+    wheel_dir = os.path.join(directory, 'wheels')
+    os.makedirs(wheel_dir, exist_ok=True)
+    
+    # Wheels of pins are kept in wheel_dir between runs, so each is built
+    # once. Wheels of other requirements, e.g. urls, are kept in url_wheel_dir
+    # by bundle.wheel_cache_key, those without key are built every run
+    pins, others = bundle.read_build_requirements(requirements_files)
+    wheels, missing = bundle.find_wheels(wheel_dir, pins)
+    wheels = set(wheels.values())
+    url_wheel_dir = os.path.join(directory, 'url_wheels')
+    os.makedirs(url_wheel_dir, exist_ok=True)
+    url_keys = set()
+    unbuilt = []
+    for line in others:
+        key = bundle.wheel_cache_key(line)
+        if key is not None:
+            url_keys.add(key)
+            cached_dir = os.path.join(url_wheel_dir, key)
+            if os.path.isdir(cached_dir):
+                wheels.update(os.path.join(cached_dir, filename) for filename in os.listdir(cached_dir))
+                continue
+        unbuilt.append((line, key))
+    
+    # Build in batches, one pip process per worker, each into its own
+    # directory. Other requirements are built one per process, so their
+    # wheels can be cached by key
+    max_workers = int(project.get_property('pybuilder_pip_tools_jobs'))
+    pinned = sorted('{}=={}'.format(name, version) for name, version in missing.items())
+    batches = [(pinned[i::max_workers], False, None) for i in range(max_workers)] + [([line], True, key) for line, key in unbuilt]
+    batches = [(batch, is_other, key) for batch, is_other, key in batches if batch]
+    env = _pip_tools_env(project)
+    compilation = _Compilation(None, None, logger, env, timeout=_timeout(project, 'pybuilder_pip_tools_sync_timeout'))
+    with TemporaryDirectory(dir=directory) as build_dir:
+        batch_dirs = [os.path.join(build_dir, str(i)) for i in range(len(batches))]
+        for batch_dir in batch_dirs:
+            os.mkdir(batch_dir)
+        jobs = [partial(_pip_wheel, batch, batch_dir, env) for (batch, _, _), batch_dir in zip(batches, batch_dirs)]
+        _run_jobs(jobs, max_workers, compilation, 'pip wheel')
+        for (_, is_other, key), batch_dir in zip(batches, batch_dirs):
+            if key is not None:
+                cached_dir = os.path.join(url_wheel_dir, key)
+                os.replace(batch_dir, cached_dir)
+                wheels.update(os.path.join(cached_dir, filename) for filename in os.listdir(cached_dir))
+                continue
+            for filename in os.listdir(batch_dir):
+                os.replace(os.path.join(batch_dir, filename), os.path.join(wheel_dir, filename))
+                if is_other:
+                    wheels.add(os.path.join(wheel_dir, filename))
+    built, missing = bundle.find_wheels(wheel_dir, missing)
+    if missing:
+        raise BuildFailedException(
+            'pip wheel built no wheel compatible with this interpreter for: {}'
+            .format(', '.join('{}=={}'.format(name, version) for name, version in sorted(missing.items())))
+        )
+    wheels.update(built.values())
+    
+    # Remove wheels of old pins and urls
+    for filename in os.listdir(wheel_dir):
+        path = os.path.join(wheel_dir, filename)
+        if path not in wheels:
+            os.remove(path)
+    for key in os.listdir(url_wheel_dir):
+        if key not in url_keys:
+            shutil.rmtree(os.path.join(url_wheel_dir, key))
+    
+    path, written = bundle.create(
+        directory, wheels, {name: bundle.read_requirements(name) for name in requirements_files}
+    )
+    logger.info('{} {} with {} wheels, {} built'.format(
+        'Wrote' if written else 'Unchanged', path, len(wheels), len(pinned) + len(unbuilt)
+    ))
+    
+def _pip_wheel(requirements, directory, env, compilation):
+    process.run(
+        [sys.executable, '-m', 'pip', 'wheel', '--no-deps', '--wheel-dir', directory] + requirements,
+        compilation.cancel, env, compilation.timeout, _log_lines(compilation.logger, 'pip wheel')
+    )
+    
+def _pip_tools_env(project, wheelhouse=True):
+    '''
+    Get environment variables to run pip-compile and pip-sync with
+    
+    Parameters
+    ----------
+    wheelhouse : bool
+        If True and $pybuilder_pip_tools_wheelhouse is set, install from the
+        wheelhouse instead of an index.
+    '''
+    env = {}
+    cache_dir = project.get_property('pybuilder_pip_tools_cache_dir')
+    if cache_dir:
+        cache_dir = os.path.abspath(cache_dir)
+        env.update({
+            'PIP_CACHE_DIR': os.path.join(cache_dir, 'pip'),
+            'PIP_TOOLS_CACHE_DIR': os.path.join(cache_dir, 'pip-tools'),
+            'XDG_CACHE_HOME': cache_dir,  # pip-tools<5 has no PIP_TOOLS_CACHE_DIR
+        })
+    wheelhouse_dir = project.get_property('pybuilder_pip_tools_wheelhouse')
+    if wheelhouse and wheelhouse_dir:
+        # Environment variables rather than options as older pip-compile lacks --no-index
+        env.update({
+            'PIP_NO_INDEX': '1',
+            'PIP_FIND_LINKS': wheelhouse_dir,  # as is, pip-compile writes it to the requirements files
+        })
+    return env
+    
+def _prewarm_cache(requirements_files, compilation):
+    '''
+    Download the pins of requirements files into pip's cache
+    
+    Runs alongside the compile jobs such that pip-sync can install from cache
+    afterwards. Failure is logged, not raised.
+    '''
+    with TemporaryDirectory() as download_dir:
+        for requirements_file in requirements_files:
+            try:
+                completed = process.run(
+                    [sys.executable, '-m', 'pip', 'download', '--no-deps', '--dest', download_dir, '-r', requirements_file],
+                    compilation.cancel, compilation.env, compilation.timeout, _log_lines(compilation.logger, 'pip download')
+                )
+                compilation.report.add_process('pip download', completed, requirements_file)
+            except process.ProcessFailed as ex:
+                compilation.logger.warn('Failed to pre-warm cache with {}: {}'.format(requirements_file, _format_process_failed(ex)))
+    
+class _Compilation(object):
+    
+    '''
+    State shared by the compile jobs of a run
+    
+    Parameters
+    ----------
+    engine
+        Engine to run pip-compile with, see `pybuilder_pip_tools.engine`.
+    lock_cache : LockCache or None
+    logger : pybuilder.core.Logger
+    env : {str => str}
+        Environment variables pip-tools is run with, see `_pip_tools_env`.
+    upgrade_packages : iterable(str)
+        Packages to pass to ``pip-compile --upgrade-package``.
+    report : instrumentation.Report or None
+        Report to record timings in. If None, a new report is created.
+    hash_store : hashes.HashStore or None
+        Store of hashes to add to the requirements files, or None to not add
+        hashes.
+    graph : bool
+        If True, compile with annotations and collect the resolved graph of
+        each requirements file in `graphs`. Else, `graphs` is None.
+    timeout : float or None
+        Seconds after which pip processes run by jobs are killed. The timeout
+        of pip-compile is up to the engine.
+    hash_development : bool
+        If False, do not add hashes to ``*requirements_development.txt``, see
+        `_add_hashes`.
+    '''
+    
+    def __init__(self, engine, lock_cache, logger, env, upgrade_packages=(), report=None, hash_store=None, graph=False, timeout=None, hash_development=True):
+        from packaging.utils import canonicalize_name
+        self.engine = engine
+        self.lock_cache = lock_cache
+        self.logger = logger
+        self.env = env
+        self.upgrade_packages = {canonicalize_name(package): package for package in upgrade_packages}
+        self.report = report or instrumentation.Report(logger)
+        self.hash_store = hash_store
+        self.graphs = {} if graph else None  # requirements file => graph.to_dict
+        self.timeout = timeout
+        self.hash_development = hash_development
+        self.cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._written = {}
+        
+    def written(self, requirements_file):
+        '''
+        Get event which is set once requirements_file has been written
+        '''
+        with self._lock:
+            return self._written.setdefault(requirements_file, threading.Event())
+        
+    def add_graph(self, requirements_file, graph_):
+        '''
+        Record the resolved graph of requirements_file
+        '''
+        with self._lock:
+            self.graphs[requirements_file] = graph_
+        
+    def wait_written(self, requirements_file):
+        '''
+        Wait until requirements_file has been written
+        
+        Raises
+        ------
+        process.Cancelled
+            If the run is cancelled while waiting.
+        '''
+        written = self.written(requirements_file)
+        while not written.wait(0.1):
+            if self.cancel.is_set():
+                raise process.Cancelled()
+    
+_SYNC_MODES = ('pip-sync', 'minimal')
+
+def _pip_sync(project, logger, report):
+    '''
+    pip-sync `*requirements_development.txt`, unless already in sync
+    '''
+    requirements_files = sorted(glob('*requirements_development.txt'))
+    stamp_file = project.expand_path('$dir_target', 'pip_sync.stamp')
+    lock_digest = sync.digest(requirements_files)
+    try:
+        with open(stamp_file) as f:
+            synced_digest = f.read().strip()
+    except FileNotFoundError:
+        synced_digest = None
+    lock_file = sync.read_lock_files(requirements_files)
+    mode = project.get_property('pybuilder_pip_tools_sync_mode')
+    if mode not in _SYNC_MODES:
+        raise BuildFailedException(
+            'Invalid pybuilder_pip_tools_sync_mode {!r}, expected one of: {}'
+            .format(mode, ', '.join(_SYNC_MODES))
+        )
+    
+    # Installed packages can only be compared when pip-sync targets the
+    # environment pyb runs in
+    if not sync.is_current_environment('pip-sync'):
+        logger.debug('pip-sync runs in another environment than pyb, not checking whether it is in sync')
+        if mode == 'minimal':
+            logger.warn('Cannot sync minimally, pip-sync runs in another environment than pyb. Running pip-sync instead.')
+        installed = None
+    else:
+        installed = sync.installed_distributions()
+    if installed is not None and sync.is_in_sync(lock_file, installed, synced_digest, lock_digest):
+        logger.info(
+            'Skipped pip-sync, environment already matches {} ({} packages)'
+            .format(', '.join(requirements_files), len(lock_file.pins) + len(lock_file.editables))
+        )
+        return
+    
+    plan = sync.plan(lock_file, installed) if mode == 'minimal' and installed is not None else None
+    if mode == 'minimal' and installed is not None and plan is None:
+        logger.warn('Cannot sync minimally, requirements files contain unpinned requirements. Running pip-sync instead.')
+    if plan is None:
+        completed = _run_pip_tool(['pip-sync'] + requirements_files, _pip_tools_env(project), _timeout(project, 'pybuilder_pip_tools_sync_timeout'), logger)
+        report.add_process('pip-sync', completed)
+    else:
+        _apply_sync_plan(plan, project, logger, report)
+    os.makedirs(os.path.dirname(stamp_file), exist_ok=True)
+    with open(stamp_file, 'w') as f:
+        f.write(lock_digest)
+    
+def _apply_sync_plan(plan, project, logger, report):
+    '''
+    Make the changes of a sync plan with pip
+    
+    Extraneous packages are uninstalled with a single pip process. Pins are
+    downloaded with up to $pybuilder_pip_tools_jobs pip processes, which
+    check their hashes, if any, and the downloads are then installed without
+    dependencies by a single pip process: concurrent installs into the same
+    environment would race on shared files. Url requirements are installed
+    last, all at once. The option lines of the requirements files, e.g.
+    ``--index-url``, are passed to the pip processes which download.
+    '''
+    logger.info('Syncing minimally: uninstalling {} and installing {} packages'.format(len(plan.uninstall), len(plan.install)))
+    env = _pip_tools_env(project)
+    timeout = _timeout(project, 'pybuilder_pip_tools_sync_timeout')
+    pip = [sys.executable, '-m', 'pip']
+    if plan.uninstall:
+        completed = _run_pip_tool(pip + ['uninstall', '-y'] + plan.uninstall, env, timeout, logger)
+        report.add_process('pip uninstall', completed)
+    pins = [line for line in plan.install if not line.startswith('-e')]
+    if pins:
+        max_workers = int(project.get_property('pybuilder_pip_tools_jobs'))
+        batches = [pins[i::max_workers] for i in range(max_workers)]
+        compilation = _Compilation(None, None, logger, env, report=report, timeout=timeout)
+        with TemporaryDirectory() as download_directory:
+            jobs = [
+                partial(_pip_download, batch, download_directory, env, options=plan.options)
+                for batch in batches if batch
+            ]
+            _run_jobs(jobs, max_workers, compilation, 'pip download')
+            downloads = sorted(os.path.join(download_directory, name) for name in os.listdir(download_directory))
+            completed = _run_pip_tool(pip + ['install', '--no-deps'] + downloads, env, timeout, logger)
+        report.add_process('pip install', completed)
+    urls = [line for line in plan.install if line.startswith('-e')]
+    if urls:
+        with TemporaryDirectory() as temporary_directory:
+            requirements_txt = os.path.join(temporary_directory, 'requirements.txt')
+            with open(requirements_txt, 'w') as f:
+                f.write(''.join(line + '\n' for line in plan.options + urls))
+            completed = _run_pip_tool(pip + ['install', '--no-deps', '-r', requirements_txt], env, timeout, logger)
+        report.add_process('pip install', completed)
+    
+def _run_pip_tool(args, env=None, timeout=None, logger=None):
+    '''
+    Run pip-tools command, raise BuildFailedException on failure
+    
+    Its output is logged at debug level as it is written, if a logger is given.
+    '''
+    on_line = None
+    if logger is not None:
+        label = 'pip ' + args[3] if args[1:3] == ['-m', 'pip'] else os.path.basename(args[0])
+        on_line = _log_lines(logger, label)
+    try:
+        return process.run(args, env=env, timeout=timeout, on_line=on_line)
+    except process.ProcessFailed as ex:
+        raise BuildFailedException(_format_process_failed(ex)) from ex
+        
+def _log_lines(logger, label):
+    '''
+    Get function which logs a line of output of a process at debug level
+    '''
+    return lambda line: logger.debug('{}: {}'.format(label, line))
+    
+def _timeout(project, name):
+    '''
+    Get timeout property in seconds, or None if unset
+    '''
+    timeout = project.get_property(name)
+    if timeout is None or timeout == '':
+        return None
+    try:
+        timeout = float(timeout)
+    except ValueError:
+        timeout = None
+    if timeout is None or timeout <= 0:
+        raise BuildFailedException(
+            '{} must be a positive number of seconds, got: {!r}'
+            .format(name, project.get_property(name))
+        )
+    return timeout
+    
+
+def _format_process_failed(ex):
+    return '{}\n{}'.format(ex, ex.stderr.rstrip())
+    
+def _engine(project, env):
+    '''
+    Get engine configured by project
+    '''
+    try:
+        return engine.create(
+            project.get_property('pybuilder_pip_tools_engine'), env,
+            socket_path=project.get_property('pybuilder_pip_tools_daemon_socket'),
+            timeout=_timeout(project, 'pybuilder_pip_tools_compile_timeout'),
+        )
+    except ValueError as ex:
+        raise BuildFailedException('Invalid pybuilder_pip_tools_engine: {}'.format(ex)) from ex
+    
+def _lock_cache(project):
+    '''
+    Get lock cache configured by project, or None if disabled
+    '''
+    directory = project.get_property('pybuilder_pip_tools_lock_cache_dir')
+    if not directory:
+        return None
+    max_age = project.get_property('pybuilder_pip_tools_lock_cache_max_age')
+    if max_age is None or max_age == '':
+        max_age = None
+    else:
+        try:
+            max_age = float(max_age)
+        except ValueError:
+            max_age = -1
+        if max_age < 0:
+            raise BuildFailedException(
+                'pybuilder_pip_tools_lock_cache_max_age must be a non-negative number of seconds, got: {!r}'
+                .format(project.get_property('pybuilder_pip_tools_lock_cache_max_age'))
+            )
+    return LockCache(directory, int(project.get_property('pybuilder_pip_tools_lock_cache_size')), max_age)
+    
+def _hash_store(project):
+    '''
+    Get hash store configured by project, or None if hashes are disabled
+    '''
+    if not project.get_property('pybuilder_pip_tools_hashes'):
+        return None
+    return hashes.HashStore(project.get_property('pybuilder_pip_tools_hash_store'))
     
 def _merged_dependencies(project):
     '''
     Get plugin and build dependencies, merged together
     
     Compatible version constraints are merged through intersection.
+    Dependencies with different environment markers are kept separate, they
+    apply to different environments.
+    
+    Returns
+    -------
+    {(str, str or None) => requirement.Requirement}
+        Requirements by canonical name and environment marker.
+    
+    Raises
+    ------
+    pybuilder.errors.BuildFailedException
+        If the version constraints on a package plainly conflict.
     '''
-    plugin_dependencies = {dependency.name : dependency for dependency in project.plugin_dependencies}
-    build_dependency_names = set(dependency.name for dependency in project.build_dependencies)
-    plugin_dependency_only_names = plugin_dependencies.keys() - build_dependency_names
-    return project.build_dependencies + [plugin_dependencies[name] for name in plugin_dependency_only_names]
+    depends_on = 'build_depends_on or plugin_depends_on'
+    merged = _requirements(project.build_dependencies, depends_on, 'build_depends_on')
+    for key, plugin_requirement in _requirements(project.plugin_dependencies, depends_on, 'plugin_depends_on').items():
+        build_requirement = merged.get(key)
+        if build_requirement is None:
+            merged[key] = plugin_requirement
+            continue
+        merged_requirement = requirement.merge(build_requirement, plugin_requirement)
+        if not requirement.is_satisfiable(merged_requirement.version):
+            raise BuildFailedException(
+                'Conflicting version constraints on {!r}: build_depends_on requires {!r}, '
+                'plugin_depends_on requires {!r}. No version satisfies both.'
+                .format(build_requirement.name, build_requirement.line(), plugin_requirement.line())
+            )
+        merged[key] = merged_requirement
+    return merged
     
-def _pip_compile(dependencies, urls, requirements_stem, depends_on):
-    import attr
+def _requirements(dependencies, depends_on, origin=None):
+    '''
+    Get requirements of PyBuilder dependencies
     
-    # Validate dependencies
+    Parameters
+    ----------
+    dependencies : [pybuilder.core.Dependency]
+    depends_on : str
+        How the dependencies were added, for error messages.
+    origin : str or None
+        How the dependencies were added, as recorded in
+        `requirement.Requirement.origins`. Defaults to depends_on.
+    
+    Returns
+    -------
+    {(str, str or None) => requirement.Requirement}
+        Requirements by canonical name and environment marker, see
+        `requirement.index`.
+    '''
     for dependency in dependencies:
         if dependency.url is not None:
             raise BuildFailedException(
@@ -68,57 +909,75 @@ def _pip_compile(dependencies, urls, requirements_stem, depends_on):
                 'index.'
                 .format(dependency.name, depends_on=depends_on)
             )
+    requirements = requirement.index(map(requirement.from_dependency, dependencies))
+    for requirement_ in requirements.values():
+        requirement_.origins = (origin or depends_on,)
+    return requirements
     
+def _pip_compile(dependencies, urls, requirements_stem, depends_on, derive=False, constraints_stem=None):
+    '''
+    Get jobs that compile the requirements files of a stem
+    
+    Parameters
+    ----------
+    dependencies : {(str, str or None) => requirement.Requirement}
+        Requirements by canonical name and environment marker, as returned
+        by `_requirements`. Modified in place.
+    derive : bool
+        If True, compile only ``{stem}_development.txt`` and derive
+        ``{stem}.txt`` from it. Else, compile both.
+    constraints_stem : str or None
+        If set, use the pins of ``{constraints_stem}_development.txt`` and
+        ``{constraints_stem}.txt`` as constraints when compiling
+        ``{stem}_development.txt`` and ``{stem}.txt`` respectively. The jobs
+        wait for those files to be written first.
+    
+    Returns
+    -------
+    [callable]
+        Jobs to pass to `_run_jobs`.
+    '''
     # Merge urls and dependencies
-    Dependency = attr.make_class('Dependency', ('name', 'options', 'version', 'url'))  # TODO consider instead using https://packaging.pypa.io/en/latest/ or http://setuptools.readthedocs.io/en/latest/pkg_resources.html#requirement-methods-and-attributes
-    def split_dependency(dependency):
-        match = re.fullmatch(r'([^[]*)(\[.*\])?', dependency.name)
-        if not match:
-            raise BuildFailedException( 
-                'Invalid dependency name {!r}. '
-                'Examples of valid names: pkg, pkg[extra1,extra2].'
-                .format(dependency.name)
-            )
-        name, options = match.groups()
-        return Dependency(name, options, dependency.version, url=None)
-    dependencies = [split_dependency(dependency) for dependency in dependencies]
-    dependencies = {dependency.name: dependency for dependency in dependencies}
+    _merge_urls(dependencies, urls, depends_on)
+    
+    # Compile requirements.txt with a temporary requirements.in file
+    development_constraints = constraints = None
+    if constraints_stem:
+        development_constraints = constraints_stem + '_development.txt'
+        constraints = constraints_stem + '.txt'
+    if derive:
+        return [partial(
+            _write_derived_requirements_txt, dependencies, requirements_stem + '_development.txt', requirements_stem + '.txt',
+            constraints_file=development_constraints
+        )]
+    return [
+        partial(_write_requirements_txt, dependencies, requirements_stem + '_development.txt', True, constraints_file=development_constraints),
+        partial(_write_requirements_txt, dependencies, requirements_stem + '.txt', False, constraints_file=constraints),
+    ]
+    
+def _merge_urls(dependencies, urls, depends_on):
+    '''
+    Set url of dependencies overridden by a url
+    
+    Parameters
+    ----------
+    dependencies : {(str, str or None) => requirement.Requirement}
+        Requirements by canonical name and environment marker, as returned by
+        `requirement.index`. Modified in place.
+    urls : [str]
+    depends_on : str
+        How the dependencies were added, for error messages.
+    '''
+    from packaging.utils import canonicalize_name
+    by_name = {}
+    for (key, _), dependency in dependencies.items():
+        by_name.setdefault(key, []).append(dependency)
     for url in urls:
-        url = url.strip()
-        
-        # Prepend -e if missing. pip-compile only supports -e urls
-        if url.startswith('-e'):
-            url = url[3:].strip()
-        
-        # Split url
-        url_parts = urlparse(url)
-        if not url_parts.scheme:
-            raise BuildFailedException( 
-                "Dependency url must start with '{{scheme}}://', got: {!r}."
-                .format(url)
-            )
-            
-        # Get egg parameter from fragment
-        query_parameters = parse_qs(url_parts.fragment)
-        if not 'egg' in query_parameters:
-            raise BuildFailedException( 
-                "Missing '#egg=pkg-name-version' fragment in url {!r}."
-                .format(url)
-            )
-        egg = query_parameters['egg'][0]
-        
-        # Get name from egg parameter
-        parts = egg.split('-')
-        if len(parts) == 1:
-            raise BuildFailedException( 
-                "Missing version in 'egg' parameter of url {!r}. "
-                "Please add version such that: 'egg={{pkg-name}}-{{version}}'."
-                .format(url)
-            )
-        name = '-'.join(parts[:-1])
+        url, name = requirement.parse_url(url)
         
         # Raise if package is not a dependency
-        if name not in dependencies:
+        matches = by_name.get(canonicalize_name(name), [])
+        if not matches:
             raise BuildFailedException( 
                 "Dependency url references dependency {name!r}, but {name!r} is not registered "
                 "as a dependency via {depends_on}. "
@@ -128,43 +987,288 @@ def _pip_compile(dependencies, urls, requirements_stem, depends_on):
                 "3) forgot to specify version in '#egg={{pkg-name}}-{{version}}' fragment."
                 .format(name=name, depends_on=depends_on)
             )
+        if len(matches) > 1:
+            raise BuildFailedException(
+                'Dependency url overrides {!r}, which is declared with different environment markers: {}. '
+                'A url can only override a single declaration.'
+                .format(name, ', '.join(repr(dependency.line()) for dependency in matches))
+            )
+        dependency = matches[0]
         
         # Append options, version and update dependency with url
-        dependency = dependencies[name]
         if dependency.options:
             url += dependency.options
         if dependency.version:
             url += dependency.version
         dependency.url = url
     
-    # Compile requirements.txt with a temporary requirements.in file
-    _write_requirements_txt(dependencies, requirements_stem + '_development.txt', use_urls=True)
-    _write_requirements_txt(dependencies, requirements_stem + '.txt', use_urls=False)
+def _run_jobs(jobs, max_workers, compilation, description='pip-compile'):
+    '''
+    Run compile jobs concurrently
     
-def _write_requirements_txt(dependencies, requirements_file, use_urls):
-    import plumbum as pb
-    requirements_in = NamedTemporaryFile('w', delete=False)
-    try:
-        # Write a requirements.in file
-        with requirements_in:
-            for dependency in dependencies.values():
-                if dependency.url is not None and use_urls:
-                    line = dependency.url
-                    if not line.startswith('-e'):  # pip-compile only supports -e urls, so prefix -e if missing
-                        line = '-e ' + line
-                else:
-                    line = dependency.name
-                    if dependency.options:
-                        line += dependency.options
-                    if dependency.version:
-                        line += dependency.version
-                requirements_in.write(line + '\n')
-                
-        # Compile it to .txt
-        pb.local['pip-compile'](requirements_in.name, '-o', requirements_file,
-            '--no-header', '--no-annotate'  # make output more deterministic, handy when file is tracked (changes less often)
+    When a job fails, the jobs still running are cancelled and the errors of
+    all failed jobs are reported together. On KeyboardInterrupt, the jobs are
+    cancelled as well: their processes run in their own process group, so they
+    do not get the SIGINT of Ctrl+C themselves.
+    
+    Parameters
+    ----------
+    jobs : [callable]
+        Jobs returned by `_pip_compile`.
+    max_workers : int
+        Maximum number of jobs to run at the same time.
+    compilation : _Compilation
+    description : str
+        What the jobs run, for the error message.
+    '''
+    if max_workers < 1:
+        raise BuildFailedException(
+            'pybuilder_pip_tools_jobs must be at least 1, got: {}'
+            .format(max_workers)
         )
-        
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(job, compilation) for job in jobs]
+        def cancel():
+            compilation.cancel.set()
+            for future in futures:
+                future.cancel()
+        try:
+            wait(futures, return_when=FIRST_EXCEPTION)
+            if any(future.done() and future.exception() for future in futures):
+                cancel()
+            wait(futures)
+        except BaseException:  # KeyboardInterrupt, the executor waits for the running jobs on exit
+            cancel()
+            raise
+    
+    # Report the output of each failed job separately
+    errors = []
+    for future in futures:
+        if future.cancelled():
+            continue
+        ex = future.exception()
+        if isinstance(ex, process.ProcessFailed):
+            errors.append(_format_process_failed(ex))
+        elif ex is not None and not isinstance(ex, process.Cancelled):
+            raise ex
+    if errors:
+        raise BuildFailedException('{} failed:\n\n'.format(description) + '\n\n'.join(errors))
+    
+def _requirements_in_lines(dependencies, use_urls):
+    '''
+    Get lines of the requirements.in file to compile
+    '''
+    lines = []
+    for dependency in dependencies.values():
+        if dependency.url is not None and use_urls:
+            line = dependency.url
+            if not line.startswith('-e'):  # pip-compile only supports -e urls, so prefix -e if missing
+                line = '-e ' + line
+        else:
+            line = dependency.line()
+        lines.append(line)
+    return lines
+    
+def _write_derived_requirements_txt(dependencies, development_file, requirements_file, compilation, constraints_file=None):
+    '''
+    Compile development_file and derive requirements_file from it
+    
+    The url lines of development_file are replaced by the requirement lines
+    they override, all other pins are kept. As a result, both files agree on
+    all transitive pins.
+    '''
+    _write_requirements_txt(dependencies, development_file, True, compilation, constraints_file)
+    
+    replacements = {
+        line: dependency.line()
+        for line, dependency in zip(_requirements_in_lines(dependencies, use_urls=True), dependencies.values())
+        if dependency.url is not None
+    }
+    with open(development_file) as f:
+        lines = f.read().splitlines()
+    derived = []
+    for line in lines:
+        if line.startswith('-e'):
+            if line not in replacements:
+                raise BuildFailedException(
+                    'Cannot derive {} from unexpected url line in {}: {!r}. '
+                    'Set pybuilder_pip_tools_derive_requirements to False.'
+                    .format(requirements_file, development_file, line)
+                )
+            line = replacements[line]
+        derived.append(line)
+    with _staged(requirements_file, compilation) as staged_file:
+        with open(staged_file, 'w') as f:
+            f.write(''.join(line + '\n' for line in derived))
+        _add_hashes(staged_file, compilation, requirements_file)
+    if compilation.graphs is not None:
+        compilation.add_graph(requirements_file, graph.without_urls(compilation.graphs[development_file]))
+    compilation.written(requirements_file).set()
+    
+def _write_requirements_txt(dependencies, requirements_file, use_urls, compilation, constraints_file=None):
+    '''
+    Compile requirements_file
+    
+    Parameters
+    ----------
+    constraints_file : str or None
+        Requirements file whose pins to use as constraints. Waits for it to be
+        written first.
+    '''
+    lines = _requirements_in_lines(dependencies, use_urls)
+    options = [
+        '--no-header', '--no-annotate'  # make output more deterministic, handy when file is tracked (changes less often)
+    ]
+    if compilation.graphs is not None:
+        options[1] = '--annotate'  # the graph, stripped from the output again by _split_graph
+    
+    # Upgrade only the packages pinned in this file, other files can then be
+    # restored from cache
+    if compilation.upgrade_packages and os.path.exists(requirements_file):
+        lock_file = sync.read_lock_files([requirements_file])
+        for name, package in sorted(compilation.upgrade_packages.items()):
+            if name in lock_file.pins or name in lock_file.editables:
+                options.extend(['--upgrade-package', package])
+                
+    # Constrain by the pins of another file. pip does not allow url
+    # requirements as constraints, so only the pins are used
+    constraint_lines = []
+    if constraints_file:
+        compilation.wait_written(constraints_file)
+        pins = sync.read_lock_files([constraints_file]).pins
+        constraint_lines = ['{}=={}'.format(name, version) for name, version in sorted(pins.items())]
+    
+    with _staged(requirements_file, compilation) as staged_file:
+        # Restore from cache if inputs are unchanged. Upgrades resolve against
+        # the index as it is now, so their output is neither restored nor stored
+        lock_cache = compilation.lock_cache
+        key = None
+        if lock_cache and '--upgrade-package' not in options:
+            try:
+                with open(requirements_file) as f:
+                    existing_output = f.read()
+            except FileNotFoundError:
+                existing_output = None
+            env = ['{}={}'.format(name, value) for name, value in sorted(compilation.env.items())]  # e.g. index options affect output
+            key = lock_key(lines + ['-c ' + line for line in constraint_lines], options + env, existing_output)
+        with lock_cache.lock(key) if key else nullcontext():  # wait for concurrent compilations of the same inputs
+            hit = False
+            if key:
+                hit = lock_cache.get(key, staged_file, expires=existing_output is None)  # fresh resolutions pick up index changes
+                compilation.report.add_lock_cache_result(requirements_file, hit)
+                if hit:
+                    compilation.logger.info('Restored {} from lock cache'.format(requirements_file))
+            
+            if not hit:
+                with TemporaryDirectory() as temporary_directory:
+                    # Write a requirements.in file
+                    requirements_in = os.path.join(temporary_directory, 'requirements.in')
+                    if constraint_lines:
+                        constraints_txt = os.path.join(temporary_directory, 'constraints.txt')
+                        with open(constraints_txt, 'w') as f:
+                            f.write(''.join(line + '\n' for line in constraint_lines))
+                        lines = lines + ['-c ' + constraints_txt]
+                    with open(requirements_in, 'w') as f:
+                        f.write(''.join(line + '\n' for line in lines))
+                            
+                    # Compile it to .txt
+                    completed = compilation.engine.compile(
+                        [requirements_in, '-o', staged_file] + options, compilation.cancel,
+                        _log_lines(compilation.logger, 'pip-compile ' + requirements_file),
+                    )
+                    compilation.report.add_process('pip-compile', completed, requirements_file)
+                if key:
+                    lock_cache.put(key, staged_file)
+                
+        if compilation.graphs is not None:
+            _split_graph(staged_file, dependencies, compilation, requirements_file)
+        _add_hashes(staged_file, compilation, requirements_file)
+    compilation.written(requirements_file).set()
+    
+@contextmanager
+def _staged(requirements_file, compilation):
+    '''
+    Stage the new content of requirements_file in a temporary file
+    
+    Yields the path of a temporary file next to requirements_file, a copy of
+    requirements_file if it exists. When the body of the with statement
+    succeeds, the temporary file atomically replaces requirements_file, but
+    only if their content differs, such that unchanged files keep their
+    modification time. Whether the file changed is recorded in the report.
+    '''
+    directory, name = os.path.split(os.path.abspath(requirements_file))
+    staged_file = os.path.join(directory, '.{}.{}.tmp'.format(name, uuid.uuid4().hex))
+    try:
+        try:
+            shutil.copyfile(requirements_file, staged_file)  # pip-compile reuses its pins
+        except FileNotFoundError:
+            pass
+        yield staged_file
+        with open(staged_file, 'rb') as f:
+            content = f.read()
+        try:
+            with open(requirements_file, 'rb') as f:
+                changed = f.read() != content
+            shutil.copymode(requirements_file, staged_file)
+        except FileNotFoundError:
+            changed = True
+        if changed:
+            os.replace(staged_file, requirements_file)
+        compilation.report.add_file_result(requirements_file, changed)
     finally:
-        os.unlink(requirements_in.name)
-        
\ No newline at end of file
+        if os.path.exists(staged_file):
+            os.remove(staged_file)
+    
+def _split_graph(path, dependencies, compilation, requirements_file):
+    '''
+    Remove the annotations from the staged content of requirements_file and collect its graph
+    '''
+    with open(path) as f:
+        content, nodes = graph.parse(f.read())
+    with open(path, 'w') as f:
+        f.write(content)
+    compilation.add_graph(requirements_file, graph.to_dict(nodes, dependencies.values()))
+    
+def _write_graph(project, stem, graphs):
+    '''
+    Write the graphs of the requirements files of stem to $dir_reports/pybuilder_pip_tools_graph/{stem}.json
+    
+    Nothing is written when the stem was not compiled.
+    '''
+    files = {file: graphs[file] for file in (stem + '_development.txt', stem + '.txt') if file in graphs}
+    if not files:
+        return
+    path = _graph_path(project, stem)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'stem': stem, 'files': files}, f, indent=2, sort_keys=True)
+        f.write('\n')
+    
+def _graph_path(project, stem):
+    return project.expand_path('$dir_reports', 'pybuilder_pip_tools_graph', stem + '.json')
+    
+def _add_hashes(path, compilation, requirements_file):
+    '''
+    Add hashes to the staged content of requirements_file, if enabled
+    
+    pip refuses hashes when there are url requirements, so files with url
+    requirements are left without hashes. pip-sync installs all
+    `*requirements_development.txt` at once and pip requires hashes for all
+    or none of them, so if any has url requirements, none gets hashes.
+    '''
+    if compilation.hash_store is None:
+        return
+    if sync.read_lock_files([path]).editables:
+        compilation.logger.warn('Not adding hashes to {}, pip does not support hashes for url requirements'.format(requirements_file))
+        return
+    if requirements_file.endswith('_development.txt') and not compilation.hash_development:
+        compilation.logger.warn(
+            'Not adding hashes to {}, it is synced together with url requirements, for which pip does not support hashes'
+            .format(requirements_file)
+        )
+        return
+    try:
+        looked_up = hashes.add_hashes(path, compilation.hash_store, compilation.env)
+    except hashes.HashesNotFound as ex:
+        raise BuildFailedException('Cannot add hashes to {}: {}'.format(requirements_file, ex)) from ex
+    compilation.logger.debug('Added hashes to {}, looked up hashes of {} pins'.format(requirements_file, looked_up))
@@ -0,0 +1,451 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Bundles of the wheels of compiled requirements files, installable offline
+
+A bundle is an uncompressed tar archive containing:
+
+``manifest.json``
+    The sha256 and size of each wheel and of the installer and the
+    requirements of each bundled requirements file.
+``install.py``
+    This module, which installs the bundle with nothing but Python and pip.
+``requirements/{name}``
+    The bundled requirements files, without options such as ``--hash``.
+``wheels/{filename}``
+    A wheel of each requirement.
+
+It is named ``bundle-{digest}.tar`` with digest the sha256 of its manifest,
+which covers its entire content. Install it with::
+
+    tar -xf bundle-{digest}.tar install.py
+    python install.py install bundle-{digest}.tar
+
+or, where pybuilder_pip_tools is installed, with::
+
+    python -m pybuilder_pip_tools.bundle install bundle-{digest}.tar
+
+The installer only uses the standard library, so this module must not import
+other modules of pybuilder_pip_tools at module level: the package imports
+PyBuilder.
+'''
+
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from urllib.parse import urlsplit, urlunsplit, urldefrag
+import subprocess
+import sysconfig
+import argparse
+import tarfile
+import hashlib
+import json
+import sys
+import io
+import os
+import re
+
+FORMAT = 1
+
+_NAME = re.compile(r'bundle-([0-9a-f]{64})\.tar')
+
+# Schemes of git urls, whose wheels are cached by commit
+_GIT_SCHEMES = ('git+https', 'git+http', 'git+ssh', 'git+git', 'git+file')
+
+class InvalidBundle(Exception):
+
+    '''
+    Bundle is corrupt, was modified or has an unsupported format
+    '''
+
+def read_requirements(path):
+    '''
+    Get the requirement lines of a compiled requirements file, to install from a bundle
+
+    Options such as ``--hash`` and ``--find-links`` are dropped: wheels are
+    checked against the manifest instead and installed from the bundle. Url
+    requirements are replaced by their name, they are installed from the wheel
+    built from them.
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    [str]
+    '''
+    from pybuilder_pip_tools import sync
+    lines = []
+    for line in sync.requirement_lines(path):
+        if line.startswith('-e'):
+            line = sync.egg_name(line)
+        elif line.startswith('-'):
+            continue
+        lines.append(line)
+    return lines
+
+def read_build_requirements(paths):
+    '''
+    Get the requirements of compiled requirements files to build wheels of
+
+    Requirements whose environment marker does not match the current
+    interpreter are left out.
+
+    Parameters
+    ----------
+    paths : iterable(str)
+
+    Returns
+    -------
+    ({str => str}, [str])
+        Versions of pins by canonical name, and the other requirements, e.g.
+        urls, sorted.
+    '''
+    from packaging.requirements import Requirement, InvalidRequirement
+    from packaging.utils import canonicalize_name
+    from pybuilder_pip_tools import sync
+    pins = {}
+    others = set()
+    for path in paths:
+        for line in sync.requirement_lines(path):
+            if line.startswith('-e'):
+                others.add(line[2:].strip())
+                continue
+            if line.startswith('-'):
+                continue
+            try:
+                requirement = Requirement(line)
+            except InvalidRequirement:
+                others.add(line)
+                continue
+            if requirement.marker and not requirement.marker.evaluate():
+                continue
+            specifiers = list(requirement.specifier)
+            if requirement.url is None and len(specifiers) == 1 and specifiers[0].operator == '==' and '*' not in specifiers[0].version:
+                pins[canonicalize_name(requirement.name)] = specifiers[0].version
+            else:
+                others.add(line)
+    return pins, sorted(others)
+
+def find_wheels(directory, pins):
+    '''
+    Find wheels of pins which can be installed on the current interpreter
+
+    Parameters
+    ----------
+    directory : str
+    pins : {str => str}
+        Versions by canonical name.
+
+    Returns
+    -------
+    ({str => str}, {str => str})
+        Path to the most specific compatible wheel of each pin which has one,
+        by canonical name, and the pins which have none.
+    '''
+    from packaging.utils import parse_wheel_filename, InvalidWheelFilename
+    from packaging.version import Version, InvalidVersion
+    from packaging.tags import sys_tags
+    priorities = {tag: priority for priority, tag in enumerate(sys_tags())}
+    best = {}
+    for filename in os.listdir(directory):
+        if not filename.endswith('.whl'):
+            continue
+        try:
+            name, version, _, tags = parse_wheel_filename(filename)
+        except InvalidWheelFilename:
+            continue
+        priority = min((priorities[tag] for tag in tags if tag in priorities), default=None)
+        if priority is not None and ((name, version) not in best or priority < best[name, version][0]):
+            best[name, version] = (priority, filename)
+    found = {}
+    missing = {}
+    for name, version in pins.items():
+        try:
+            match = best.get((name, Version(version)))
+        except InvalidVersion:
+            match = None
+        if match:
+            found[name] = os.path.join(directory, match[1])
+        else:
+            missing[name] = version
+    return found, missing
+
+def wheel_cache_key(requirement):
+    '''
+    Get the key to cache the wheel built from a non-pin requirement under
+
+    The wheel of an archive url is cached by its requirement line. The wheel
+    of a git url is cached by its requirement line and the commit its ref, or
+    ``HEAD``, points to, looked up with ``git ls-remote``. Local paths and
+    urls of other version control systems can change without their
+    requirement line changing, so their wheels are not cached.
+
+    Parameters
+    ----------
+    requirement : str
+        Requirement line, as returned by `read_build_requirements`.
+
+    Returns
+    -------
+    str or None
+        Key usable as file name, or None if the wheel must not be cached,
+        e.g. when the commit cannot be looked up.
+    '''
+    url = requirement.split(' @ ', 1)[-1].split(';', 1)[0].strip()
+    scheme = urlsplit(url).scheme
+    if scheme in ('http', 'https'):
+        commit = ''
+    elif scheme in _GIT_SCHEMES:
+        commit = _git_commit(url[len('git+'):])
+        if commit is None:
+            return None
+    else:
+        return None
+    return hashlib.sha256('{}\n{}'.format(requirement, commit).encode()).hexdigest()
+
+def _git_commit(url):
+    '''
+    Get the commit a git url, without ``git+``, points to, or None if it cannot be looked up
+    '''
+    parts = urlsplit(urldefrag(url)[0])
+    if '@' in parts.path:
+        path, _, ref = parts.path.rpartition('@')
+    else:
+        path, ref = parts.path, 'HEAD'
+    if re.fullmatch(r'[0-9a-f]{40}|[0-9a-f]{64}', ref):
+        return ref
+    try:
+        completed = subprocess.run(
+            ['git', 'ls-remote', urlunsplit(parts._replace(path=path, query='')), ref],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True, timeout=60, check=True,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    fields = completed.stdout.split()
+    return fields[0] if fields else None
+
+def create(directory, wheels, requirements):
+    '''
+    Write a bundle, unless it already exists
+
+    Bundles of the same wheels and requirements, written by the same version
+    of this module, are identical, byte for byte. Other bundles in directory
+    are removed, as this one supersedes them.
+
+    Parameters
+    ----------
+    directory : str
+        Directory to write the bundle to.
+    wheels : iterable(str)
+        Paths of the wheels to bundle. Their file names must be unique.
+    requirements : {str => [str]}
+        Requirement lines by requirements file name, see `read_requirements`.
+
+    Returns
+    -------
+    (str, bool)
+        Path of the bundle and whether it was written, False if it already
+        existed.
+    '''
+    wheels = {os.path.basename(path): path for path in wheels}
+    with open(__file__, 'rb') as f:
+        installer = f.read()
+    manifest = {
+        'format': FORMAT,
+        'python': '{}{}.{}'.format(sys.implementation.name, *sys.version_info[:2]),
+        'platform': sysconfig.get_platform(),
+        'installer': {'sha256': hashlib.sha256(installer).hexdigest(), 'size': len(installer)},
+        'requirements': {name: list(lines) for name, lines in requirements.items()},
+        'wheels': {
+            filename: {'sha256': _sha256(path), 'size': os.path.getsize(path)}
+            for filename, path in sorted(wheels.items())
+        },
+    }
+    manifest_content = _dumps(manifest)
+    path = os.path.join(directory, 'bundle-{}.tar'.format(hashlib.sha256(manifest_content).hexdigest()))
+    if os.path.exists(path):
+        _remove_superseded(directory, path)
+        return path, False
+    with NamedTemporaryFile(dir=directory, prefix='.bundle-', suffix='.tmp', delete=False) as f:
+        try:
+            with tarfile.open(fileobj=f, mode='w', format=tarfile.PAX_FORMAT) as tar:
+                _add(tar, 'manifest.json', io.BytesIO(manifest_content), len(manifest_content))
+                _add(tar, 'install.py', io.BytesIO(installer), len(installer))
+                for name, lines in sorted(requirements.items()):
+                    content = ''.join(line + '\n' for line in lines).encode()
+                    _add(tar, 'requirements/' + name, io.BytesIO(content), len(content))
+                for filename, path_ in sorted(wheels.items()):
+                    with open(path_, 'rb') as wheel:
+                        _add(tar, 'wheels/' + filename, wheel, os.path.getsize(path_))
+        except BaseException:
+            os.remove(f.name)
+            raise
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+    _remove_superseded(directory, path)
+    return path, True
+
+def _remove_superseded(directory, path):
+    for filename in os.listdir(directory):
+        if _NAME.fullmatch(filename) and filename != os.path.basename(path):
+            os.remove(os.path.join(directory, filename))
+
+def _dumps(manifest):
+    return json.dumps(manifest, indent=2, sort_keys=True).encode() + b'\n'
+
+def _add(tar, name, f, size):
+    info = tarfile.TarInfo(name)  # mtime, owner default to 0, for reproducible archives
+    info.size = size
+    info.mode = 0o644
+    tar.addfile(info, f)
+
+def _sha256(path):
+    hash_ = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hash_.update(block)
+    return hash_.hexdigest()
+
+def extract(path, directory):
+    '''
+    Verify bundle and extract its wheels and requirements files
+
+    Parameters
+    ----------
+    path : str
+        Path to the bundle.
+    directory : str
+        Directory to extract to. Its ``wheels`` and ``requirements``
+        subdirectories are created.
+
+    Returns
+    -------
+    dict
+        The manifest.
+
+    Raises
+    ------
+    InvalidBundle
+        If the manifest does not match the digest in the name of the bundle,
+        a wheel does not match the manifest or the format is not supported.
+    '''
+    try:
+        with tarfile.open(path) as tar:
+            manifest_content = tar.extractfile('manifest.json').read()
+            match = _NAME.fullmatch(os.path.basename(path))
+            if match and hashlib.sha256(manifest_content).hexdigest() != match.group(1):
+                raise InvalidBundle('Manifest of {} does not match the digest in its name'.format(path))
+            manifest = json.loads(manifest_content.decode())
+            if manifest.get('format') != FORMAT:
+                raise InvalidBundle('Unsupported format of {}: {!r}'.format(path, manifest.get('format')))
+
+            # Write requirements files from the manifest, the files in the archive are for manual installs
+            os.makedirs(os.path.join(directory, 'requirements'))
+            for name, lines in manifest['requirements'].items():
+                _check_name(path, name)
+                with open(os.path.join(directory, 'requirements', name), 'w') as f:
+                    f.write(''.join(line + '\n' for line in lines))
+
+            # Extract wheels, checking their hash
+            os.makedirs(os.path.join(directory, 'wheels'))
+            for filename, expected in manifest['wheels'].items():
+                _check_name(path, filename)
+                hash_ = hashlib.sha256()
+                size = 0
+                with tar.extractfile('wheels/' + filename) as source, open(os.path.join(directory, 'wheels', filename), 'wb') as f:
+                    for block in iter(lambda: source.read(1024 * 1024), b''):
+                        hash_.update(block)
+                        size += len(block)
+                        f.write(block)
+                if hash_.hexdigest() != expected['sha256'] or size != expected['size']:
+                    raise InvalidBundle('{} of {} does not match the manifest'.format(filename, path))
+    except (tarfile.TarError, KeyError, ValueError) as ex:
+        raise InvalidBundle('Invalid bundle {}: {}'.format(path, ex)) from ex
+    return manifest
+
+def _check_name(path, name):
+    if not name or name != os.path.basename(name) or name.startswith('.'):
+        raise InvalidBundle('Invalid file name in manifest of {}: {!r}'.format(path, name))
+
+def install(path, requirements_files=('requirements.txt',), python=sys.executable, pip_args=()):
+    '''
+    Install requirements files of a bundle, without accessing an index
+
+    Packages are installed with ``pip install --no-index --no-deps`` from the
+    wheels of the bundle, after checking them against its manifest.
+
+    Parameters
+    ----------
+    path : str
+        Path to the bundle.
+    requirements_files : iterable(str)
+        Names of the bundled requirements files to install.
+    python : str
+        Interpreter whose environment to install into.
+    pip_args : iterable(str)
+        Additional arguments to ``pip install``.
+
+    Returns
+    -------
+    int
+        Exit status of pip.
+
+    Raises
+    ------
+    InvalidBundle
+        See `extract`, or if a requirements file is not in the bundle.
+    '''
+    with TemporaryDirectory() as directory:
+        manifest = extract(path, directory)
+        args = [
+            python, '-m', 'pip', 'install', '--no-index', '--no-deps',
+            '--find-links', os.path.join(directory, 'wheels'),
+        ]
+        for name in requirements_files:
+            if name not in manifest['requirements']:
+                raise InvalidBundle(
+                    '{} is not in {}, it contains: {}'
+                    .format(name, path, ', '.join(sorted(manifest['requirements'])))
+                )
+            args.extend(['-r', os.path.join(directory, 'requirements', name)])
+        return subprocess.call(args + list(pip_args))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Install packages from a bundle written by the pip_bundle task, without accessing an index.',
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    install_parser = subparsers.add_parser('install', help='Install bundled requirements files')
+    install_parser.add_argument('bundle', help='Path to the bundle')
+    install_parser.add_argument(
+        '-r', '--requirements', action='append', dest='requirements_files', metavar='NAME',
+        help='Bundled requirements file to install, may be repeated. Default: requirements.txt'
+    )
+    install_parser.add_argument(
+        '--python', default=sys.executable,
+        help='Interpreter whose environment to install into. Default: %(default)s'
+    )
+    args, pip_args = parser.parse_known_args(argv)
+    try:
+        status = install(args.bundle, args.requirements_files or ['requirements.txt'], args.python, pip_args)
+    except (InvalidBundle, OSError) as ex:
+        parser.exit(1, '{}\n'.format(ex))
+    sys.exit(status)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Long-lived pip-compile process which builds send their compilations to
+
+Start it with::
+
+    python -m pybuilder_pip_tools.daemon
+
+and set ``pybuilder_pip_tools_engine`` to ``daemon``. The daemon compiles
+with an `pybuilder_pip_tools.engine.InProcessEngine`, so builds no longer pay
+for starting pip-compile and its package metadata stays in memory between
+builds.
+
+Clients connect to a Unix socket, send a request as a single line of JSON and
+receive a single line of JSON in response. The socket is only accessible to
+the user running the daemon.
+'''
+
+from pybuilder_pip_tools.lock_cache import default_cache_dir
+from pybuilder_pip_tools import process, engine
+from tempfile import TemporaryDirectory
+import socketserver
+import threading
+import argparse
+import signal
+import socket
+import json
+import time
+import sys
+import os
+
+PROTOCOL_VERSION = 1
+
+class Unavailable(Exception):
+
+    '''
+    No daemon is listening on the socket
+    '''
+
+def default_socket_path():
+    '''
+    Get the default socket path, in ``$XDG_RUNTIME_DIR`` if set
+    '''
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'pybuilder_pip_tools.sock')
+    return os.path.join(default_cache_dir(), 'daemon.sock')
+
+def compile_remote(socket_path, args, env=None, cancel=None, timeout=None, on_line=None):
+    '''
+    Run pip-compile in the daemon
+
+    The input file is sent along, the output file is written by the caller.
+    Other paths, e.g. of ``-c`` lines, are passed as is, so the daemon must
+    run on the same machine.
+
+    Parameters
+    ----------
+    socket_path : str
+    args : [str]
+        pip-compile arguments: the input file, ``-o`` and the output file,
+        followed by options.
+    env : {str => str} or None
+        Environment variables to set while running pip-compile.
+    cancel : threading.Event or None
+        When set, stop waiting for the response.
+    timeout : float or None
+        Seconds after which to stop waiting for the response, raising
+        `pybuilder_pip_tools.process.TimedOut`.
+    on_line : callable or None
+        Called with each line of pip-compile's output once it is received.
+
+    Returns
+    -------
+    pybuilder_pip_tools.process.Completed
+
+    Raises
+    ------
+    Unavailable
+        If no daemon is listening on the socket.
+    pybuilder_pip_tools.process.ProcessFailed
+    pybuilder_pip_tools.process.TimedOut
+    pybuilder_pip_tools.process.Cancelled
+    '''
+    args = list(args)
+    command = ['pip-compile'] + args
+    output_file = args[args.index('-o') + 1]
+    with open(args[0]) as f:
+        requirements_in = f.read()
+    try:
+        with open(output_file) as f:
+            existing_output = f.read()  # pip-compile keeps its pins
+    except FileNotFoundError:
+        existing_output = None
+    request = {
+        'version': PROTOCOL_VERSION,
+        'args': args[1:],
+        'requirements_in': requirements_in,
+        'existing_output': existing_output,
+        'env': env or {},
+        'cwd': os.getcwd(),
+    }
+    start = time.perf_counter()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as ex:
+            raise Unavailable('No daemon listening on {}'.format(socket_path)) from ex
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        deadline = None if timeout is None else start + timeout
+        try:
+            response = json.loads(_receive_line(client, cancel, deadline).decode('utf-8'))
+        except TimeoutError:
+            raise process.TimedOut(command, None, '', '', timeout) from None
+    if on_line is not None:
+        for line in (response.get('stdout', '') + response.get('stderr', '')).splitlines():
+            on_line(line)
+    if 'error' in response:
+        raise process.ProcessFailed(command, 1, '', 'pybuilder_pip_tools daemon: ' + response['error'])
+    if response['returncode']:
+        raise process.ProcessFailed(command, response['returncode'], response['stdout'], response['stderr'])
+    with open(output_file, 'w') as f:
+        f.write(response['output'])
+    return process.Completed(
+        command, response['stdout'], response['stderr'],
+        wall_time=time.perf_counter() - start,
+        cpu_time=response['cpu_time'],
+    )
+
+def _receive_line(client, cancel, deadline=None):
+    client.settimeout(0.1)  # to check for cancellation
+    chunks = []
+    while True:
+        if cancel is not None and cancel.is_set():
+            raise process.Cancelled()
+        if deadline is not None and time.perf_counter() > deadline:
+            raise TimeoutError()
+        try:
+            chunk = client.recv(65536)
+        except socket.timeout:
+            continue
+        if not chunk:
+            raise process.ProcessFailed(['pip-compile'], 1, '', 'pybuilder_pip_tools daemon closed the connection')
+        chunks.append(chunk)
+        if chunk.endswith(b'\n'):
+            return b''.join(chunks)
+
+class Server(socketserver.ThreadingUnixStreamServer):
+
+    '''
+    Daemon server
+
+    Each connection is handled in its own thread. Compilations are run one at
+    a time, as the engine requires and as each one changes the working
+    directory.
+
+    Parameters
+    ----------
+    socket_path : str
+    engine_
+        Engine to compile with. Its ``compile`` method must accept an ``env``
+        argument, like `pybuilder_pip_tools.engine.InProcessEngine`.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, engine_):
+        self.engine = engine_
+        self._lock = threading.Lock()
+        super().__init__(socket_path, _Handler)
+
+    def server_bind(self):
+        umask = os.umask(0o177)  # clients can make the daemon read files
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def compile(self, request):
+        '''
+        Handle a request, return the response
+        '''
+        if request.get('version') != PROTOCOL_VERSION:
+            return {'error': 'Unsupported protocol version {!r}, expected {}'.format(request.get('version'), PROTOCOL_VERSION)}
+        args = list(request['args'])
+        with TemporaryDirectory() as temporary_directory:
+            requirements_in = os.path.join(temporary_directory, 'requirements.in')
+            with open(requirements_in, 'w') as f:
+                f.write(request['requirements_in'])
+            requirements_txt = os.path.join(temporary_directory, 'requirements.txt')
+            if request['existing_output'] is not None:
+                with open(requirements_txt, 'w') as f:
+                    f.write(request['existing_output'])
+            args[args.index('-o') + 1] = requirements_txt
+            with self._lock:
+                original_cwd = os.getcwd()
+                os.chdir(request['cwd'])
+                try:
+                    completed = self.engine.compile([requirements_in] + args, env=request['env'])
+                except process.ProcessFailed as ex:
+                    return {'returncode': ex.returncode, 'stdout': ex.stdout, 'stderr': ex.stderr}
+                finally:
+                    os.chdir(original_cwd)
+            with open(requirements_txt) as f:
+                output = f.read()
+        return {
+            'returncode': 0,
+            'stdout': completed.stdout,
+            'stderr': completed.stderr,
+            'output': output,
+            'cpu_time': completed.cpu_time,
+        }
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            response = self.server.compile(request)
+        except Exception as ex:
+            response = {'error': '{}: {}'.format(type(ex).__name__, ex)}
+        try:
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+        except BrokenPipeError:  # client cancelled
+            pass
+
+def serve(socket_path, max_repositories=8, max_cache_entries=10000):
+    '''
+    Create daemon server listening on socket_path
+
+    A stale socket of a daemon which is no longer running is removed.
+
+    Raises
+    ------
+    RuntimeError
+        If a daemon is already listening on the socket.
+    '''
+    if os.path.exists(socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            try:
+                client.connect(socket_path)
+            except ConnectionRefusedError:
+                os.remove(socket_path)
+            else:
+                raise RuntimeError('A daemon is already listening on {}'.format(socket_path))
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    engine_ = engine.InProcessEngine(max_repositories=max_repositories, max_cache_entries=max_cache_entries)
+    return Server(socket_path, engine_)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pybuilder_pip_tools.daemon',
+        description='Run pip-compile for pybuilder_pip_tools builds, keeping package metadata in memory.',
+    )
+    parser.add_argument('--socket', default=default_socket_path(), help='Unix socket to listen on. Default: %(default)s')
+    parser.add_argument(
+        '--max-repositories', type=int, default=8,
+        help='Maximum number of package indices and pip configurations to keep metadata of. Default: %(default)s'
+    )
+    parser.add_argument(
+        '--max-cache-entries', type=int, default=10000,
+        help='Maximum number of packages to keep metadata of, per repository. Default: %(default)s'
+    )
+    args = parser.parse_args(argv)
+
+    # pip is configured by the $PIP_* variables of each build instead
+    for name in list(os.environ):
+        if name.startswith('PIP_'):
+            del os.environ[name]
+
+    try:
+        server = serve(args.socket, args.max_repositories, args.max_cache_entries)
+    except RuntimeError as ex:
+        parser.exit(1, '{}\n'.format(ex))
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))  # remove the socket on kill as well
+    print('Listening on {}'.format(args.socket), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Engines which run pip-compile
+
+An engine has a ``compile(args, cancel=None, on_line=None)`` method which
+runs pip-compile with the given arguments, returns a
+`pybuilder_pip_tools.process.Completed` and raises
+`pybuilder_pip_tools.process.ProcessFailed` or
+`pybuilder_pip_tools.process.Cancelled` like `pybuilder_pip_tools.process.run`.
+``on_line`` is called with each line of pip-compile's output; engines which
+do not run a subprocess call it once pip-compile is done. Its ``concurrent``
+attribute is whether it benefits from compiling in several threads at once.
+'''
+
+from pybuilder_pip_tools import process
+from contextlib import redirect_stdout, redirect_stderr
+from collections import OrderedDict
+import itertools
+import traceback
+import sys
+import os
+import threading
+import time
+import io
+
+ENGINES = ('subprocess', 'in_process', 'daemon')
+
+def create(name, env=None, socket_path=None, timeout=None):
+    '''
+    Create engine by name
+
+    Parameters
+    ----------
+    name : str
+        One of `ENGINES`.
+    env : {str => str} or None
+        Environment variables to set while running pip-compile.
+    socket_path : str or None
+        Socket of the daemon engine. Defaults to
+        `pybuilder_pip_tools.daemon.default_socket_path`.
+    timeout : float or None
+        Seconds after which a compilation is killed, raising
+        `pybuilder_pip_tools.process.TimedOut`. Not supported by the
+        in_process engine.
+
+    Raises
+    ------
+    ValueError
+        If name is not a known engine, or a timeout is given for the
+        in_process engine.
+    '''
+    if name == 'subprocess':
+        return SubprocessEngine(env, timeout)
+    elif name == 'in_process':
+        if timeout is not None:
+            raise ValueError(
+                'the in_process engine cannot enforce a compile timeout, '
+                'unset pybuilder_pip_tools_compile_timeout or use another engine'
+            )
+        return InProcessEngine(env)
+    elif name == 'daemon':
+        return DaemonEngine(socket_path, env, timeout)
+    else:
+        raise ValueError('Unknown engine {!r}, expected one of: {}'.format(name, ', '.join(ENGINES)))
+
+class SubprocessEngine(object):
+
+    '''
+    Runs each compilation in a new pip-compile process
+    '''
+
+    concurrent = True
+
+    def __init__(self, env=None, timeout=None):
+        self._env = env
+        self._timeout = timeout
+
+    def compile(self, args, cancel=None, on_line=None):
+        return process.run(['pip-compile'] + list(args), cancel, self._env, self._timeout, on_line)
+
+class InProcessEngine(object):
+
+    '''
+    Runs pip-compile's command line interface in the current process
+
+    All compilations share a repository per set of pip options, and thus its
+    HTTP session and its cache of package metadata. The output is written by
+    pip-compile itself, so it is identical to that of `SubprocessEngine`.
+
+    Compilations are run one at a time, also across engines, as pip-tools is
+    not thread safe and its environment variables and output redirection
+    apply to the whole process. Output which other threads write to stdout
+    or stderr meanwhile ends up in the output of the compilation, so callers
+    should not run other work concurrently (see `concurrent`). Cancellation
+    is only checked before a compilation starts.
+
+    Parameters
+    ----------
+    env : {str => str} or None
+        Environment variables to set while running pip-compile.
+    max_repositories : int or None
+        Maximum number of repositories to keep, least recently used ones are
+        dropped first. Unbounded if None.
+    max_cache_entries : int or None
+        Maximum number of entries to keep in each of a repository's caches
+        of candidates and dependencies, oldest ones are dropped first.
+        Unbounded if None.
+    '''
+
+    concurrent = False
+    _lock = threading.Lock()  # os.environ, sys.stdout and sys.stderr are process-global
+
+    def __init__(self, env=None, max_repositories=None, max_cache_entries=None):
+        self._env = env or {}
+        self._max_repositories = max_repositories
+        self._max_cache_entries = max_cache_entries
+        self._repositories = OrderedDict()
+
+    def compile(self, args, cancel=None, on_line=None, env=None):
+        '''
+        Parameters
+        ----------
+        env : {str => str} or None
+            Environment variables to set instead of those given to the
+            constructor.
+        '''
+        env = self._env if env is None else env
+        compile_module = _import_compile_module()
+        with self._lock:
+            if cancel is not None and cancel.is_set():
+                raise process.Cancelled()
+            create_repository = compile_module.PyPIRepository
+            def shared_repository(*repository_args, **repository_kwargs):
+                key = _freeze((sorted(env.items()), repository_args, repository_kwargs))  # pip reads $PIP_* as well
+                if key in self._repositories:
+                    self._repositories.move_to_end(key)
+                else:
+                    self._repositories[key] = create_repository(*repository_args, **repository_kwargs)
+                    if self._max_repositories is not None:
+                        while len(self._repositories) > self._max_repositories:
+                            self._repositories.popitem(last=False)
+                return self._repositories[key]
+            compile_module.PyPIRepository = shared_repository
+            stdout = io.StringIO()
+            stderr = io.StringIO()
+            original_env = {name: os.environ.get(name) for name in env}
+            os.environ.update(env)
+            start = time.perf_counter()
+            start_cpu_time = time.process_time()
+            try:
+                with redirect_stdout(stdout), redirect_stderr(stderr):
+                    returncode = _main(compile_module.cli, list(args))
+            finally:
+                compile_module.PyPIRepository = create_repository
+                for name, value in original_env.items():
+                    if value is None:
+                        del os.environ[name]
+                    else:
+                        os.environ[name] = value
+                self._trim_caches()
+            command = ['pip-compile'] + list(args)
+            if on_line is not None:
+                for line in (stdout.getvalue() + stderr.getvalue()).splitlines():
+                    on_line(line)
+            if returncode:
+                raise process.ProcessFailed(command, returncode, stdout.getvalue(), stderr.getvalue())
+            return process.Completed(
+                command, stdout.getvalue(), stderr.getvalue(),
+                wall_time=time.perf_counter() - start,
+                cpu_time=time.process_time() - start_cpu_time,  # includes other threads of the process
+            )
+
+    def _trim_caches(self):
+        if self._max_cache_entries is None:
+            return
+        for repository in self._repositories.values():
+            for name in ('_available_candidates_cache', '_dependencies_cache'):
+                cache = getattr(repository, name, None)
+                if isinstance(cache, dict) and len(cache) > self._max_cache_entries:
+                    for key in list(itertools.islice(cache, len(cache) - self._max_cache_entries)):
+                        del cache[key]
+
+class DaemonEngine(object):
+
+    '''
+    Runs compilations in a daemon, see `pybuilder_pip_tools.daemon`
+
+    Falls back to `SubprocessEngine` when no daemon is listening on the
+    socket, connecting again after `retry_interval` seconds. The ``$PIP_*`` environment variables of the current process are
+    passed to the daemon, as a pip-compile subprocess would inherit them.
+
+    Parameters
+    ----------
+    socket_path : str or None
+        Socket the daemon listens on. Defaults to
+        `pybuilder_pip_tools.daemon.default_socket_path`.
+    env : {str => str} or None
+        Environment variables to set while running pip-compile.
+    timeout : float or None
+        Seconds after which to stop waiting for a compilation. The daemon
+        finishes the compilation regardless.
+    '''
+
+    concurrent = True  # the daemon compiles one at a time, its fallback does not
+    retry_interval = 30.0  # seconds after a failed connect before connecting again, e.g. to a daemon started since
+
+    def __init__(self, socket_path=None, env=None, timeout=None):
+        from pybuilder_pip_tools import daemon
+        self._socket_path = socket_path or daemon.default_socket_path()
+        self._env = env or {}
+        self._timeout = timeout
+        self._fallback = SubprocessEngine(env, timeout)
+        self._retry_at = 0.0  # time.monotonic() after which to connect again
+
+    @property
+    def available(self):
+        '''
+        False during `retry_interval` after failing to connect
+        '''
+        return time.monotonic() >= self._retry_at
+
+    def compile(self, args, cancel=None, on_line=None):
+        from pybuilder_pip_tools import daemon
+        if self.available:
+            env = {name: value for name, value in os.environ.items() if name.startswith('PIP_')}
+            env.update(self._env)
+            try:
+                return daemon.compile_remote(self._socket_path, args, env, cancel, self._timeout, on_line)
+            except daemon.Unavailable:
+                self._retry_at = time.monotonic() + self.retry_interval
+        return self._fallback.compile(args, cancel, on_line)
+
+def _import_compile_module():
+    '''
+    Import the module of the pip-compile script
+    
+    PyBuilder imports build.py as module ``build``, which shadows the ``build``
+    package pip-tools imports. The project module is set aside while
+    importing.
+    '''
+    project_module = sys.modules.get('build')
+    if project_module is None or hasattr(project_module, '__path__'):  # not imported or a package
+        from piptools.scripts import compile as compile_module
+        return compile_module
+    project_directory = os.path.dirname(os.path.abspath(project_module.__file__))
+    original_path = list(sys.path)
+    del sys.modules['build']
+    sys.path[:] = [path for path in sys.path if os.path.abspath(path or '.') != project_directory]
+    try:
+        from piptools.scripts import compile as compile_module
+        return compile_module
+    finally:
+        sys.path[:] = original_path
+        sys.modules['build'] = project_module
+    
+def _main(cli, args):
+    '''
+    Run click command like its script would, return exit code
+    '''
+    import click
+    try:
+        returncode = cli.main(args=args, prog_name='pip-compile', standalone_mode=False)
+        if isinstance(returncode, int):  # click>=8 returns the code passed to ctx.exit
+            return returncode
+    except SystemExit as ex:
+        if ex.code is None or isinstance(ex.code, int):
+            return ex.code or 0
+        click.echo(ex.code, err=True)
+        return 1
+    except click.exceptions.Exit as ex:
+        return ex.exit_code
+    except click.ClickException as ex:
+        ex.show()
+        return ex.exit_code
+    except click.Abort:
+        click.echo('Aborted!', err=True)
+        return 1
+    except Exception:  # the script would exit with a traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+def _freeze(value):
+    '''
+    Get hashable key of repository arguments
+
+    Sessions are left out, such that a repository is shared regardless of the
+    session it was first created with.
+    '''
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items() if key != 'session'))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value if not _is_session(item))
+    elif isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    elif hasattr(value, '__dict__'):  # e.g. optparse.Values of pip options
+        return (type(value).__name__, _freeze(vars(value)))
+    else:
+        return repr(value)
+
+def _is_session(value):
+    return type(value).__name__.endswith('Session')
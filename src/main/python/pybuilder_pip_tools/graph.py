@@ -0,0 +1,158 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Resolved dependency graph, from the ``# via`` annotations of pip-compile
+'''
+
+from pybuilder_pip_tools import sync
+import re
+
+_PIN = re.compile(r'([A-Za-z0-9._-]+)(?:\[([^]]*)\])?==([^\s;]+)')
+_INLINE_VIA = re.compile(r'\s+#\s*via\b(.*)$')  # --annotation-style line
+
+def parse(content):
+    '''
+    Split annotated pip-compile output into graph and output without annotations
+
+    Both annotation styles of pip-compile are supported.
+
+    Parameters
+    ----------
+    content : str
+        Output of ``pip-compile --annotate``.
+
+    Returns
+    -------
+    (str, {str => dict})
+        Output as ``pip-compile --no-annotate`` would have written it, and
+        nodes by canonical name. Each node has a ``name``, ``version`` (None
+        for url requirements), ``url``, ``extras``, ``direct`` (whether it is
+        required by the requirements.in file) and ``parents``, the canonical
+        names of the packages which require it.
+    '''
+    from packaging.utils import canonicalize_name
+    lines = []
+    nodes = {}
+    node = None
+    in_via = False
+    for line in content.splitlines():
+        stripped = line.strip()
+        if node is not None and line[:1].isspace() and stripped.startswith('#'):  # --annotation-style split
+            text = stripped[1:].strip()
+            if re.match(r'via\b', text):
+                in_via = True
+                _add_via(node, text[3:])
+            elif in_via:
+                _add_via(node, text)
+            continue
+        in_via = False
+        node = None
+        match = _INLINE_VIA.search(line)
+        via = ''
+        if match and not stripped.startswith('#'):
+            via = match.group(1)
+            line = line[:match.start()].rstrip()
+        lines.append(line)
+        if line.startswith('-e'):
+            node = _node(sync.egg_name(line), None, line[2:].strip(), [])
+        else:
+            match = _PIN.fullmatch(line.split(';')[0].strip())
+            if match:
+                extras = [extra.strip() for extra in match.group(2).split(',')] if match.group(2) else []
+                node = _node(match.group(1), match.group(3), None, extras)
+        if node is not None:
+            nodes[canonicalize_name(node['name'])] = node
+            _add_via(node, via)
+    return ''.join(line + '\n' for line in lines), nodes
+
+def _node(name, version, url, extras):
+    return {'name': name, 'version': version, 'url': url, 'extras': sorted(extras), 'direct': False, 'parents': []}
+
+def _add_via(node, text):
+    from packaging.utils import canonicalize_name
+    for via in text.split(','):
+        via = via.strip()
+        if not via:
+            continue
+        if via.startswith('-r'):
+            node['direct'] = True
+        elif not via.startswith('-c'):  # constraints files do not require anything
+            parent = canonicalize_name(re.split(r'[\[\s]', via, 1)[0])
+            if parent not in node['parents']:
+                node['parents'].append(parent)
+
+def to_dict(nodes, requirements):
+    '''
+    Get JSON serializable graph
+
+    Parameters
+    ----------
+    nodes : {str => dict}
+        As returned by `parse`.
+    requirements : iterable(pybuilder_pip_tools.requirement.Requirement)
+        Requirements of the requirements.in file. A package may have several,
+        e.g. with different environment markers.
+
+    Returns
+    -------
+    dict
+        ``nodes``, sorted by key, and ``edges`` from a package to each
+        package it requires. A node's ``origin`` lists how it was required:
+        ``depends_on``, ``build_depends_on``, ``plugin_depends_on`` and/or
+        ``url`` when overridden by a url. Transitive dependencies have no
+        origin.
+    '''
+    origins = {}
+    options = {}
+    for requirement in requirements:
+        origins_ = origins.setdefault(requirement.key, [])
+        origins_.extend(origin for origin in requirement.origins if origin not in origins_)
+        if requirement.options:
+            options.setdefault(requirement.key, set()).update(requirement.options[1:-1].split(','))
+    graph = {'nodes': [], 'edges': []}
+    for key, node in sorted(nodes.items()):
+        origin = list(origins.get(key, [])) if node['direct'] else []
+        extras = set(node['extras']) | options.get(key, set())
+        if node['url']:
+            origin.append('url')
+        graph['nodes'].append({
+            'key': key,
+            'name': node['name'],
+            'version': node['version'],
+            'url': node['url'],
+            'extras': sorted(extras),
+            'origin': origin,
+        })
+        graph['edges'].extend({'from': parent, 'to': key} for parent in node['parents'])
+    graph['edges'].sort(key=lambda edge: (edge['from'], edge['to']))
+    return graph
+
+def without_urls(graph):
+    '''
+    Get graph of a file derived from this graph's file, with urls replaced by their requirement
+
+    Parameters
+    ----------
+    graph : dict
+        As returned by `to_dict`.
+    '''
+    nodes = [
+        dict(node, url=None, origin=[origin for origin in node['origin'] if origin != 'url'])
+        for node in graph['nodes']
+    ]
+    return {'nodes': nodes, 'edges': list(graph['edges'])}
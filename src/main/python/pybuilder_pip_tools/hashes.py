@@ -0,0 +1,451 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Adding ``--hash`` options to compiled requirements files
+
+Like ``pip-compile --generate-hashes``, each pin gets the sha256 hashes of
+all distribution files of its version. Hashes are taken from the index pages,
+which list them for each file, or computed from the files of local
+``--find-links`` directories, and are stored such that they are only looked up
+again when the sources change, a local directory gains a file of the version or
+the stored hashes are older than `MAX_AGE`. Pages and files are fetched with
+pip's HTTP session, so pip's credentials, proxies and certificates apply.
+'''
+
+from urllib.parse import urljoin, urldefrag, urlparse
+from urllib.request import url2pathname
+from html.parser import HTMLParser
+from pathlib import Path
+import threading
+import hashlib
+import time
+import sqlite3
+import json
+import re
+import os
+
+DEFAULT_INDEX_URL = 'https://pypi.org/simple'
+
+# Seconds after which the hashes of a version are looked up again, to add files
+# uploaded after it was first hashed, e.g. wheels for a new platform
+MAX_AGE = 7 * 24 * 60 * 60
+
+_PIN = re.compile(r'([A-Za-z0-9._-]+)(\[[^]]*\])?==([^\s;\\]+)')
+
+class HashesNotFound(Exception):
+
+    '''
+    No distribution files were found for a pin
+    '''
+
+class HashStore(object):
+
+    '''
+    Persistent store of the sha256 hashes of distribution files
+
+    Hashes of a version are stored all at once, together with the sources they
+    were looked up in and when. A version is only found in the sources it was
+    looked up in, or a subset, so hashes found in fewer sources are not mistaken
+    for a complete set. Safe to use from multiple threads and processes.
+
+    Parameters
+    ----------
+    path : str
+        SQLite database file, created if missing.
+    '''
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS hashes '
+                '(name TEXT, version TEXT, filename TEXT, sha256 TEXT, PRIMARY KEY (name, version, filename))'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS versions '
+                '(name TEXT, version TEXT, sources TEXT, checked REAL, PRIMARY KEY (name, version))'
+            )
+
+    def get(self, name, version, sources, max_age=None):
+        '''
+        Get hashes of the files of a version
+
+        Parameters
+        ----------
+        name : str
+            Canonical name.
+        version : str
+        sources : iterable(str)
+            Index urls and find-links the hashes must have been looked up in.
+        max_age : float or None
+            If set, hashes looked up longer than this many seconds ago are not
+            returned.
+
+        Returns
+        -------
+        {str => str} or None
+            sha256 hex digest by file name, or None if not stored, looked up
+            in other sources or expired.
+        '''
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT sources, checked FROM versions WHERE name = ? AND version = ?', (name, version)
+        ).fetchone()
+        if row is None:  # not looked up, or stored without marker by an older version
+            return None
+        stored_sources, checked = row
+        if not set(sources) <= set(json.loads(stored_sources)):
+            return None
+        if max_age is not None and time.time() - checked > max_age:
+            return None
+        rows = connection.execute(
+            'SELECT filename, sha256 FROM hashes WHERE name = ? AND version = ?', (name, version)
+        ).fetchall()
+        return dict(rows)
+
+    def put(self, name, version, hashes, sources):
+        '''
+        Store hashes of the files of a version, replacing those stored before
+
+        Parameters
+        ----------
+        name : str
+            Canonical name.
+        version : str
+        hashes : {str => str}
+            sha256 hex digest by file name, of all files found in sources.
+        sources : iterable(str)
+            Index urls and find-links the files were looked up in.
+        '''
+        with self._connection() as connection:
+            connection.execute('DELETE FROM hashes WHERE name = ? AND version = ?', (name, version))
+            connection.executemany(
+                'INSERT INTO hashes VALUES (?, ?, ?, ?)',
+                [(name, version, filename, sha256) for filename, sha256 in hashes.items()]
+            )
+            connection.execute(
+                'INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?)',
+                (name, version, json.dumps(sorted(set(sources))), time.time())
+            )
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=60)
+            self._local.connection = connection
+        return connection
+
+def add_hashes(path, store, env=None):
+    '''
+    Add ``--hash`` options to the pins of a compiled requirements file
+
+    Existing ``--hash`` options are replaced. Other lines are kept as is.
+
+    Files are looked up in the ``--index-url``, ``--extra-index-url`` and
+    ``--find-links`` options of the file, as pip-compile writes them, and of
+    their ``$PIP_*`` environment variables, or in `DEFAULT_INDEX_URL` if no
+    index url is given. Indices are skipped when ``$PIP_NO_INDEX`` is set.
+    They are fetched with pip's session, configured by ``$PIP_*`` and pip's
+    configuration files like pip-compile's, e.g. ``$PIP_CERT``,
+    ``$PIP_TRUSTED_HOST``, proxies and netrc or keyring credentials.
+
+    Parameters
+    ----------
+    path : str
+        Requirements file without url requirements; pip does not support
+        hashes for those.
+    store : HashStore
+    env : {str => str} or None
+        Environment variables pip-compile was run with, in addition to
+        ``os.environ``.
+
+    Returns
+    -------
+    int
+        Number of pins whose hashes were not in the store.
+
+    Raises
+    ------
+    HashesNotFound
+        If no files were found for a pin, or pip is configured with an index
+        url which the file does not name.
+    '''
+    from packaging.utils import canonicalize_name
+    env = dict(os.environ, **(env or {}))
+    with open(path) as f:
+        entries = _entries(f.read())
+    sources = _sources([entry for entry in entries if not entry.startswith('#')], env)
+    source_names = [('index ' if is_index else 'find-links ') + source for is_index, source in sources]
+    looked_up = 0
+    session = None  # created on the first lookup, cached hashes need none
+    lines = []
+    for entry in entries:
+        requirement = re.sub(r'\s*--hash[=\s]\S+', '', entry.replace('\\\n', ' ')).strip()
+        match = _PIN.match(requirement)
+        if not match or requirement.startswith('-'):
+            lines.append(entry)
+            continue
+        name = canonicalize_name(match.group(1))
+        version = match.group(3)
+        hashes = store.get(name, version, source_names, MAX_AGE)
+        if hashes is not None and not set(_local_files(name, version, sources)) <= set(hashes):
+            hashes = None  # a file was added to a find-links directory
+        if hashes is None:
+            if session is None:
+                session = _session(sources)
+            hashes = _find_hashes(name, version, sources, session)
+            if not hashes:
+                raise HashesNotFound(
+                    'No distribution files found of {}=={} to hash, looked in: {}'
+                    .format(name, version, ', '.join(source for _, source in sources) or 'nowhere, $PIP_NO_INDEX is set')
+                )
+            store.put(name, version, hashes, source_names)
+            looked_up += 1
+        lines.append(' \\\n'.join(
+            [requirement] + ['    --hash=sha256:' + sha256 for sha256 in sorted(set(hashes.values()))]
+        ))
+    with open(path, 'w') as f:
+        f.write(''.join(line + '\n' for line in lines))
+    return looked_up
+
+def _entries(content):
+    '''
+    Get lines of a requirements file, continued lines joined with their continuation
+    '''
+    entries = []
+    continued = False
+    for line in content.splitlines():
+        if continued:
+            entries[-1] += '\n' + line
+        else:
+            entries.append(line)
+        continued = line.endswith('\\') and not line.lstrip().startswith('#')
+    return entries
+
+def _sources(lines, env):
+    '''
+    Get index urls and find-links of a requirements file
+
+    Returns
+    -------
+    [(bool, str)]
+        Whether it is an index, and the index url or find-links directory or url.
+    '''
+    options = []
+    for line in lines:
+        match = re.match(r'(--index-url|-i|--extra-index-url|--find-links|-f)[=\s]+(\S+)', line.strip())
+        if match:
+            options.append((match.group(1), match.group(2)))
+    for option, name in (('--index-url', 'PIP_INDEX_URL'), ('--extra-index-url', 'PIP_EXTRA_INDEX_URL'), ('--find-links', 'PIP_FIND_LINKS')):
+        options.extend((option, value) for value in env.get(name, '').split())
+    if not any(option in ('--index-url', '-i') for option, _ in options):
+        options.insert(0, ('--index-url', DEFAULT_INDEX_URL))
+    no_index = env.get('PIP_NO_INDEX') or any(line.strip() == '--no-index' for line in lines)
+    sources = []
+    for option, value in options:
+        source = (option not in ('--find-links', '-f'), value)
+        if source not in sources and not (source[0] and no_index):
+            sources.append(source)
+    return sources
+
+def _session(sources):
+    '''
+    Get pip's HTTP session, configured like pip-compile's
+
+    pip-tools' repository parses the pip options of the sources along with
+    ``$PIP_*`` and pip's configuration files, and creates the session with
+    the credentials, proxies, certificates and trusted hosts they give.
+
+    Parameters
+    ----------
+    sources : [(bool, str)]
+        As returned by `_sources`.
+
+    Returns
+    -------
+    pip._internal.network.session.PipSession
+
+    Raises
+    ------
+    HashesNotFound
+        If `DEFAULT_INDEX_URL` was assumed, but pip is configured with
+        another index url, e.g. in pip.conf.
+    '''
+    from piptools.repositories import PyPIRepository  # unlike piptools.scripts, does not import build
+    from piptools.locations import CACHE_DIR
+    indices = [source for is_index, source in sources if is_index]
+    args = []
+    if indices and indices[0] != DEFAULT_INDEX_URL:
+        args.extend(['--index-url', indices[0]])
+    args.extend(arg for index in indices[1:] for arg in ('--extra-index-url', index))
+    args.extend(arg for is_index, source in sources if not is_index for arg in ('--find-links', source))
+    repository = PyPIRepository(args, CACHE_DIR)
+    index_url = repository.finder.index_urls[0] if repository.finder.index_urls else None
+    if indices and indices[0] == DEFAULT_INDEX_URL and index_url and index_url.rstrip('/') != DEFAULT_INDEX_URL:
+        raise HashesNotFound(
+            'pip is configured with index url {}, but the requirements file names none, so {} '
+            'would be used to look up hashes. Set $PIP_INDEX_URL, or let pip-compile write the '
+            'index url to the requirements file.'
+            .format(index_url, DEFAULT_INDEX_URL)
+        )
+    return repository.session
+
+def _find_hashes(name, version, sources, session):
+    '''
+    Get sha256 of each distribution file of a version, by file name
+    '''
+    hashes = {}
+    for is_index, source in sources:
+        location = _location(is_index, source, name)
+        local = os.path.isdir(location)
+        if local:
+            files = [(filename, os.path.join(location, filename), None) for filename in sorted(os.listdir(location))]
+        elif location.startswith(('http://', 'https://')):
+            files = _list_files(location, session)
+        elif os.path.isfile(location):  # a find-links page
+            files = _list_files(Path(os.path.abspath(location)).as_uri(), session)
+        else:
+            continue
+        for filename, file_location, sha256 in files:
+            if filename not in hashes and _is_distribution_of(filename, name, version):
+                if sha256 is None:
+                    sha256 = _sha256_file(file_location) if local else _sha256_url(file_location, session)
+                hashes[filename] = sha256
+    return hashes
+
+def _local_files(name, version, sources):
+    '''
+    Get names of the distribution files of a version in local directories
+    '''
+    for is_index, source in sources:
+        location = _location(is_index, source, name)
+        if os.path.isdir(location):
+            for filename in os.listdir(location):
+                if _is_distribution_of(filename, name, version):
+                    yield filename
+
+def _location(is_index, source, name):
+    '''
+    Get url or path to list the files of a package in
+    '''
+    location = source.rstrip('/') + '/' + name + '/' if is_index else source
+    if location.startswith('file:'):
+        location = url2pathname(urlparse(location).path)
+    return location
+
+def _list_files(url, session):
+    '''
+    Get files listed on an index page, or nothing if the page does not exist
+
+    Parameters
+    ----------
+    url : str
+    session : pip._internal.network.session.PipSession
+
+    Returns
+    -------
+    [(str, str, str or None)]
+        File name, url and sha256, if listed, of each file.
+    '''
+    try:
+        response = session.get(url, headers={
+            'Accept': 'application/vnd.pypi.simple.v1+json, text/html;q=0.1',  # PEP 691, falls back to PEP 503
+        })
+        if response.status_code == 404:
+            return []
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        content = response.content.decode('utf-8')
+        url = response.url  # after redirects
+    except OSError as ex:  # requests' exceptions included
+        raise HashesNotFound('Cannot list files of {}: {}'.format(url, ex)) from ex
+    if 'json' in content_type:
+        return [
+            (file['filename'], urljoin(url, file['url']), file.get('hashes', {}).get('sha256'))
+            for file in json.loads(content)['files']
+        ]
+    parser = _LinkParser()
+    parser.feed(content)
+    files = []
+    for href, text in parser.links:
+        file_url, fragment = urldefrag(urljoin(url, href))
+        match = re.fullmatch(r'sha256=([0-9a-fA-F]{64})', fragment)
+        files.append((text.strip() or file_url.rsplit('/', 1)[-1], file_url, match.group(1).lower() if match else None))
+    return files
+
+class _LinkParser(HTMLParser):
+
+    def __init__(self):
+        super().__init__()
+        self.links = []
+        self._href = None
+        self._text = ''
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self._href = dict(attrs).get('href')
+            self._text = ''
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self._text += data
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._href is not None:
+            self.links.append((self._href, self._text))
+            self._href = None
+
+def _is_distribution_of(filename, name, version):
+    '''
+    Get whether filename is a wheel or sdist of a version of a package
+    '''
+    from packaging.utils import (
+        parse_wheel_filename, parse_sdist_filename, canonicalize_name, InvalidWheelFilename, InvalidSdistFilename
+    )
+    from packaging.version import Version, InvalidVersion
+    try:
+        if filename.endswith('.whl'):
+            file_name, file_version = parse_wheel_filename(filename)[:2]
+        else:
+            file_name, file_version = parse_sdist_filename(filename)
+    except (InvalidWheelFilename, InvalidSdistFilename, InvalidVersion):
+        return False
+    try:
+        return canonicalize_name(file_name) == name and file_version == Version(version)
+    except InvalidVersion:
+        return False
+
+def _sha256_file(path):
+    hash_ = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            hash_.update(chunk)
+    return hash_.hexdigest()
+
+def _sha256_url(url, session):
+    hash_ = hashlib.sha256()
+    try:
+        with session.get(url, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(65536):
+                hash_.update(chunk)
+    except OSError as ex:
+        raise HashesNotFound('Cannot download {}: {}'.format(url, ex)) from ex
+    return hash_.hexdigest()
@@ -0,0 +1,342 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+History of runs, to show how their timings change over time
+'''
+
+from contextlib import closing
+import sqlite3
+import os
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS runs ('
+    'id INTEGER PRIMARY KEY, project TEXT, task TEXT, start TEXT, seconds REAL, failed INTEGER, '
+    'lock_cache_hits INTEGER, lock_cache_misses INTEGER)',
+    'CREATE INDEX IF NOT EXISTS runs_project_start ON runs (project, start)',
+    'CREATE INDEX IF NOT EXISTS runs_start ON runs (start)',
+    'CREATE TABLE IF NOT EXISTS phases (run INTEGER, name TEXT, seconds REAL)',
+    'CREATE TABLE IF NOT EXISTS processes (run INTEGER, name TEXT, file TEXT, wall_seconds REAL, cpu_seconds REAL, max_rss_kib INTEGER)',
+    'CREATE TABLE IF NOT EXISTS stems (run INTEGER, stem TEXT, urls INTEGER)',
+    'CREATE TABLE IF NOT EXISTS dependencies (run INTEGER, stem TEXT, name TEXT)',
+    'CREATE INDEX IF NOT EXISTS phases_run ON phases (run)',
+    'CREATE INDEX IF NOT EXISTS processes_run ON processes (run)',
+    'CREATE INDEX IF NOT EXISTS stems_run ON stems (run)',
+    'CREATE INDEX IF NOT EXISTS dependencies_run ON dependencies (run)',
+)
+
+# Tables with a row per run, besides runs
+_RUN_TABLES = ('phases', 'processes', 'stems', 'dependencies')
+
+class History(object):
+
+    '''
+    Persistent history of the reports of runs
+
+    Safe to use from multiple processes.
+
+    Parameters
+    ----------
+    path : str
+        SQLite database file, created if missing.
+    '''
+
+    def __init__(self, path):
+        self._path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connection() as connection, connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+
+    def add(self, project, task, report):
+        '''
+        Append a run
+
+        Parameters
+        ----------
+        project : str
+            Project directory.
+        task : str
+            Task that was run, e.g. pip_sync.
+        report : dict
+            Report of the run, see
+            `pybuilder_pip_tools.instrumentation.Report.to_dict`.
+        '''
+        with self._connection() as connection, connection:
+            run = connection.execute(
+                'INSERT INTO runs (project, task, start, seconds, failed, lock_cache_hits, lock_cache_misses) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    project, task, report['start'], report['seconds'], report['failed'],
+                    report['lock_cache']['hits'], report['lock_cache']['misses'],
+                )
+            ).lastrowid
+            connection.executemany(
+                'INSERT INTO phases VALUES (?, ?, ?)',
+                [(run, phase['name'], phase['seconds']) for phase in report['phases']]
+            )
+            connection.executemany(
+                'INSERT INTO processes VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (run, process['name'], process['file'], process['wall_seconds'], process['cpu_seconds'], process['max_rss_kib'])
+                    for process in report['processes']
+                ]
+            )
+            connection.executemany(
+                'INSERT INTO stems VALUES (?, ?, ?)',
+                [(run, stem, inputs['urls']) for stem, inputs in report['stems'].items()]
+            )
+            connection.executemany(
+                'INSERT INTO dependencies VALUES (?, ?, ?)',
+                [(run, stem, name) for stem, inputs in report['stems'].items() for name in inputs['dependencies']]
+            )
+
+    def prune(self, before):
+        '''
+        Remove the runs of all projects which started before a time
+
+        Freed space is reused by later runs, the file does not shrink.
+
+        Parameters
+        ----------
+        before : str
+            ISO 8601 UTC time.
+
+        Returns
+        -------
+        int
+            Number of runs removed.
+        '''
+        with self._connection() as connection, connection:
+            runs = [(run,) for run, in connection.execute('SELECT id FROM runs WHERE start < ?', (before,))]
+            for table in _RUN_TABLES:
+                connection.executemany('DELETE FROM {} WHERE run = ?'.format(table), runs)
+            connection.executemany('DELETE FROM runs WHERE id = ?', runs)
+        return len(runs)
+
+    def runs(self, project, since=None):
+        '''
+        Get the runs of a project
+
+        Parameters
+        ----------
+        project : str
+            Project directory.
+        since : str or None
+            If set, only runs which started at or after this ISO 8601 UTC
+            time.
+
+        Returns
+        -------
+        [dict]
+            Runs, oldest first. Each has the ``task``, ``start``, ``seconds``,
+            ``failed``, ``lock_cache_hits`` and ``lock_cache_misses`` of the
+            run, its ``phases``, a list of name and seconds, its
+            ``processes`` as in a report, and its ``stems``, the
+            ``dependencies`` and number of ``urls`` by stem.
+        '''
+        with self._connection() as connection:
+            connection.row_factory = sqlite3.Row
+            runs = {
+                row['id']: dict(row, failed=bool(row['failed']), phases=[], processes=[], stems={})
+                for row in connection.execute(
+                    'SELECT * FROM runs WHERE project = ? AND start >= ? ORDER BY start, id',
+                    (project, since or '')
+                )
+            }
+            selection = 'run IN (SELECT id FROM runs WHERE project = ? AND start >= ?)'
+            arguments = (project, since or '')
+            for row in connection.execute('SELECT * FROM phases WHERE ' + selection + ' ORDER BY rowid', arguments):
+                runs[row['run']]['phases'].append({'name': row['name'], 'seconds': row['seconds']})
+            for row in connection.execute('SELECT * FROM processes WHERE ' + selection + ' ORDER BY rowid', arguments):
+                process = dict(row)
+                del process['run']
+                runs[row['run']]['processes'].append(process)
+            for row in connection.execute('SELECT * FROM stems WHERE ' + selection, arguments):
+                runs[row['run']]['stems'][row['stem']] = {'dependencies': [], 'urls': row['urls']}
+            for row in connection.execute('SELECT * FROM dependencies WHERE ' + selection + ' ORDER BY name', arguments):
+                runs[row['run']]['stems'][row['stem']]['dependencies'].append(row['name'])
+        for run in runs.values():
+            del run['id']
+            del run['project']
+        return list(runs.values())
+
+    def _connection(self):
+        return closing(sqlite3.connect(self._path, timeout=60))
+
+def stats(runs, top=5):
+    '''
+    Get statistics of runs
+
+    Parameters
+    ----------
+    runs : [dict]
+        As returned by `History.runs`, oldest first.
+    top : int
+        Number of compile time increases to include.
+
+    Returns
+    -------
+    dict
+        ``runs``, ``failed``, ``first`` and ``last`` start, and
+        ``lock_cache_hit_rate`` (None when no file was looked up) of the runs.
+        ``phases`` and ``stems`` have the ``count``, percentiles ``p50``,
+        ``p90``, ``max`` and ``trend`` of the seconds of each phase and of the
+        pip-compile runs of each stem. The trend is the relative change of the
+        median of the newer half of the samples to the older half, None when
+        there are less than 4 samples or the older median is below 10ms.
+        Stems are sorted slowest first and also have their ``dependencies``
+        and ``urls`` count in the first and last run. ``increases`` are the
+        largest increases of the compile time of a stem between consecutive
+        compiles, with the ``added`` and ``removed`` dependencies in between.
+    '''
+    hits = sum(run['lock_cache_hits'] for run in runs)
+    lookups = hits + sum(run['lock_cache_misses'] for run in runs)
+
+    # Phases, in order of first appearance
+    phases = {}
+    for run in runs:
+        for phase in run['phases']:
+            phases.setdefault(phase['name'], []).append(phase['seconds'])
+
+    # Compile time of each stem, in runs in which it was compiled
+    compiles = {}
+    for run in runs:
+        seconds = {}
+        for process in run['processes']:
+            stem = _stem(process['file']) if process['name'] == 'pip-compile' else None
+            if stem:
+                seconds[stem] = seconds.get(stem, 0) + process['wall_seconds']
+        for stem, seconds_ in seconds.items():
+            inputs = run['stems'].get(stem, {'dependencies': [], 'urls': 0})
+            compiles.setdefault(stem, []).append((run['start'], seconds_, inputs))
+    stems = []
+    increases = []
+    for stem, samples in compiles.items():
+        stems.append(dict(
+            _summary([seconds for _, seconds, _ in samples]),
+            stem=stem,
+            dependencies=[len(samples[0][2]['dependencies']), len(samples[-1][2]['dependencies'])],
+            urls=[samples[0][2]['urls'], samples[-1][2]['urls']],
+        ))
+        for (_, before, before_inputs), (start, after, after_inputs) in zip(samples, samples[1:]):
+            if after > before:
+                increases.append({
+                    'stem': stem,
+                    'start': start,
+                    'seconds': [before, after],
+                    'added': sorted(set(after_inputs['dependencies']) - set(before_inputs['dependencies'])),
+                    'removed': sorted(set(before_inputs['dependencies']) - set(after_inputs['dependencies'])),
+                })
+    stems.sort(key=lambda stem: (-stem['p90'], stem['stem']))
+    increases.sort(key=lambda increase: increase['seconds'][0] - increase['seconds'][1])
+    return {
+        'runs': len(runs),
+        'failed': sum(1 for run in runs if run['failed']),
+        'first': runs[0]['start'] if runs else None,
+        'last': runs[-1]['start'] if runs else None,
+        'lock_cache_hit_rate': hits / lookups if lookups else None,
+        'phases': [dict(_summary(seconds), name=name) for name, seconds in phases.items()],
+        'stems': stems,
+        'increases': increases[:top],
+    }
+
+def _stem(file):
+    for suffix in ('_development.txt', '.txt'):
+        if file and file.endswith(suffix):
+            return file[:-len(suffix)]
+    return None
+
+def _summary(values):
+    ordered = sorted(values)
+    trend = None
+    if len(values) >= 4:
+        half = len(values) // 2
+        older = percentile(sorted(values[:half]), 50)
+        newer = percentile(sorted(values[-half:]), 50)
+        if older >= 0.01:  # relative changes of shorter durations are noise
+            trend = newer / older - 1
+    return {
+        'count': len(values),
+        'p50': percentile(ordered, 50),
+        'p90': percentile(ordered, 90),
+        'max': ordered[-1],
+        'trend': trend,
+    }
+
+def percentile(ordered, q):
+    '''
+    Get percentile of sorted values, linearly interpolated
+
+    Parameters
+    ----------
+    ordered : [float]
+        Sorted values, at least one.
+    q : float
+        Percentile, 0 to 100.
+    '''
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def format_stats(stats_):
+    '''
+    Format statistics as lines of text
+
+    Parameters
+    ----------
+    stats_ : dict
+        As returned by `stats`.
+
+    Returns
+    -------
+    [str]
+    '''
+    hit_rate = stats_['lock_cache_hit_rate']
+    lines = ['{} runs from {} to {}, {} failed, lock cache hit rate: {}'.format(
+        stats_['runs'], stats_['first'][:19], stats_['last'][:19], stats_['failed'],
+        'n/a' if hit_rate is None else '{:.0%}'.format(hit_rate),
+    )]
+    row = '{:<40} {:>5} {:>8} {:>8} {:>8} {:>6}'
+    lines.append(row.format('Phase', 'runs', 'p50', 'p90', 'max', 'trend'))
+    for phase in stats_['phases']:
+        lines.append(row.format(phase['name'][:40], phase['count'], *_format_summary(phase)))
+    if stats_['stems']:
+        row_ = row + ' {:>12} {:>8}'
+        lines.append(row_.format('Stem, slowest first', 'runs', 'p50', 'p90', 'max', 'trend', 'dependencies', 'urls'))
+        for stem in stats_['stems']:
+            lines.append(row_.format(
+                stem['stem'][:40], stem['count'], *_format_summary(stem),
+                '{} -> {}'.format(*stem['dependencies']), '{} -> {}'.format(*stem['urls']),
+            ))
+    if stats_['increases']:
+        lines.append('Largest compile time increases:')
+        for increase in stats_['increases']:
+            lines.append('  {} at {}: {:.2f}s -> {:.2f}s, added: {}, removed: {}'.format(
+                increase['stem'], increase['start'][:19], *increase['seconds'],
+                ', '.join(increase['added']) or '-', ', '.join(increase['removed']) or '-',
+            ))
+    return lines
+
+def _format_summary(summary):
+    return (
+        '{:.2f}s'.format(summary['p50']),
+        '{:.2f}s'.format(summary['p90']),
+        '{:.2f}s'.format(summary['max']),
+        '-' if summary['trend'] is None else '{:+.0%}'.format(summary['trend']),
+    )
@@ -0,0 +1,163 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Timing of the phases of a run
+'''
+
+from contextlib import contextmanager
+import threading
+import datetime
+import time
+import json
+import os
+
+class Report(object):
+
+    '''
+    Timings and resource usage of a run
+
+    Thread safe.
+
+    Parameters
+    ----------
+    logger : pybuilder.core.Logger
+        Logger to log timings to.
+    '''
+
+    def __init__(self, logger):
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._start = datetime.datetime.now(datetime.timezone.utc)
+        self._start_counter = time.perf_counter()
+        self.failed = False
+        self.phases = []
+        self.processes = []
+        self.lock_cache = {}
+        self.files = {}
+        self.stems = {}
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        Time the body of the with statement as a phase
+
+        The phase is recorded even when the body raises.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.phases.append({'name': name, 'seconds': seconds})
+            self._logger.info('{} took {:.2f}s'.format(name, seconds))
+
+    def add_process(self, name, completed, file=None):
+        '''
+        Record resource usage of a process
+
+        Parameters
+        ----------
+        name : str
+            What was run, e.g. pip-compile.
+        completed : pybuilder_pip_tools.process.Completed
+        file : str or None
+            Requirements file the process wrote, if any.
+        '''
+        process = {
+            'name': name,
+            'file': file,
+            'wall_seconds': completed.wall_time,
+            'cpu_seconds': completed.cpu_time,
+            'max_rss_kib': completed.max_rss,
+        }
+        with self._lock:
+            self.processes.append(process)
+        usage = ['{:.2f}s wall'.format(completed.wall_time)]
+        if completed.cpu_time is not None:
+            usage.append('{:.2f}s CPU'.format(completed.cpu_time))
+        if completed.max_rss is not None:
+            usage.append('{} KiB peak RSS'.format(completed.max_rss))
+        subject = '{} {}'.format(name, file) if file else name
+        self._logger.debug('{}: {}'.format(subject, ', '.join(usage)))
+
+    def add_lock_cache_result(self, file, hit):
+        '''
+        Record whether a requirements file was restored from the lock cache
+        '''
+        with self._lock:
+            self.lock_cache[file] = 'hit' if hit else 'miss'
+
+    def add_file_result(self, file, changed):
+        '''
+        Record whether the content of a requirements file changed
+        '''
+        with self._lock:
+            self.files[file] = changed
+
+    def add_stem(self, stem, dependencies, urls):
+        '''
+        Record the size of the input of a stem
+
+        Parameters
+        ----------
+        stem : str
+            E.g. build_requirements.
+        dependencies : iterable(str)
+            Canonical names of its dependencies.
+        urls : int
+            Number of dependencies overridden by a url.
+        '''
+        with self._lock:
+            self.stems[stem] = {'dependencies': sorted(dependencies), 'urls': urls}
+
+    def changed_files(self):
+        '''
+        Get requirements files whose content changed, sorted
+        '''
+        with self._lock:
+            return sorted(file for file, changed in self.files.items() if changed)
+
+    def to_dict(self):
+        with self._lock:
+            hits = sum(1 for result in self.lock_cache.values() if result == 'hit')
+            return {
+                'start': self._start.isoformat(),
+                'seconds': time.perf_counter() - self._start_counter,
+                'failed': self.failed,
+                'phases': list(self.phases),
+                'processes': list(self.processes),
+                'lock_cache': {
+                    'files': dict(self.lock_cache),
+                    'hits': hits,
+                    'misses': len(self.lock_cache) - hits,
+                },
+                'files': {
+                    'changed': sorted(file for file, changed in self.files.items() if changed),
+                    'unchanged': sorted(file for file, changed in self.files.items() if not changed),
+                },
+                'stems': dict(self.stems),
+            }
+
+    def write(self, path):
+        '''
+        Write report as JSON file
+        '''
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
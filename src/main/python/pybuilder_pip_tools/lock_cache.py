@@ -0,0 +1,260 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Content-addressed cache of ``pip-compile`` output and cache maintenance
+'''
+
+from tempfile import NamedTemporaryFile
+from contextlib import contextmanager
+import hashlib
+import shutil
+import json
+import time
+import sys
+import os
+
+def default_cache_dir():
+    '''
+    Get the per-user cache directory of the plugin
+    '''
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'pybuilder_pip_tools')
+
+def pip_tools_version():
+    '''
+    Get version of the installed pip-tools, or None if not installed
+    '''
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        return version('pip-tools')
+    except PackageNotFoundError:
+        return None
+
+def lock_key(requirements_in, options, existing_output):
+    '''
+    Get cache key of a ``pip-compile`` run
+
+    pip-compile reuses the pins of an existing output file, so its content is
+    part of the key.
+
+    Parameters
+    ----------
+    requirements_in : [str]
+        Lines of the ``requirements.in`` file.
+    options : [str]
+        pip-compile options, excluding input and output file.
+    existing_output : str or None
+        Content of the output file before compiling, if it exists.
+
+    Returns
+    -------
+    str
+        Hex digest
+    '''
+    key = {
+        'requirements_in': list(requirements_in),
+        'options': list(options),
+        'existing_output': existing_output,
+        'interpreter': [sys.executable, sys.version],
+        'pip_tools': pip_tools_version(),
+    }
+    key = json.dumps(key, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(key).hexdigest()
+
+class LockCache(object):
+
+    '''
+    Size-capped LRU cache of ``pip-compile`` output files
+
+    Each entry is a file named by its key. Recency is tracked through the
+    modification time of the entry: a hit touches it and a store evicts the
+    least recently used entries over `max_entries`.
+
+    Parameters
+    ----------
+    directory : str
+        Directory to store entries in. Created if missing.
+    max_entries : int
+        Maximum number of entries to keep.
+    max_age : float or None
+        Maximum age in seconds of entries looked up with ``expires=True``,
+        or None for no limit.
+    '''
+
+    def __init__(self, directory, max_entries, max_age=None):
+        self._directory = directory
+        self._max_entries = max_entries
+        self._max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + '.txt')
+
+    @contextmanager
+    def lock(self, key):
+        '''
+        Hold an exclusive lock on an entry during the with statement
+
+        Lets concurrent runs, e.g. of other projects, which compile the same
+        inputs wait for the first one to store its output instead of
+        compiling it again. Locking is a no-op where ``fcntl`` is unavailable.
+
+        Entries share 256 lock files by the first two characters of their
+        key, so lock files need not be removed along with their entry, which
+        would race with other runs locking it. Entries which share a lock file
+        merely wait on each other.
+
+        Parameters
+        ----------
+        key : str
+        '''
+        try:
+            import fcntl
+        except ImportError:  # Windows
+            yield
+            return
+        with open(os.path.join(self._directory, key[:2] + '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, key, path, expires=False):
+        '''
+        Copy entry to file
+
+        Parameters
+        ----------
+        key : str
+        path : str
+            File to write the entry to.
+        expires : bool
+            If True, an entry stored more than `max_age` ago is a miss. A hit
+            does not touch the entry then, so it expires `max_age` after it
+            was stored, however often it is used.
+
+        Returns
+        -------
+        bool
+            True on hit, False on miss.
+        '''
+        entry = self._path(key)
+        if expires and self._max_age is not None:
+            try:
+                if time.time() - os.stat(entry).st_mtime > self._max_age:
+                    return False
+            except FileNotFoundError:
+                return False
+        try:
+            shutil.copyfile(entry, path)
+        except FileNotFoundError:
+            return False
+        if not expires:
+            os.utime(entry)
+        return True
+
+    def put(self, key, path):
+        '''
+        Store file as entry
+
+        Parameters
+        ----------
+        key : str
+        path : str
+            File to store.
+        '''
+        # Copy to a temporary file first so readers never see a partial entry
+        with NamedTemporaryFile(dir=self._directory, suffix='.tmp', delete=False) as f:
+            with open(path, 'rb') as source:
+                shutil.copyfileobj(source, f)
+        os.replace(f.name, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self._directory):
+            if not name.endswith('.txt'):
+                continue
+            path = os.path.join(self._directory, name)
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:
+                pass  # evicted concurrently
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self._max_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def prune(directory, max_age=None, max_size=None):
+    '''
+    Remove files from a cache directory
+
+    First removes files older than `max_age`, then removes the least recently
+    modified files until the total size is at most `max_size`. Directories
+    left empty are removed as well.
+
+    Parameters
+    ----------
+    directory : str
+    max_age : float or None
+        Maximum age in seconds, or None for no limit.
+    max_size : int or None
+        Maximum total size in bytes, or None for no limit.
+
+    Returns
+    -------
+    (int, int)
+        Number of files removed and number of bytes freed.
+    '''
+    files = []
+    for parent, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(parent, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+
+    now = time.time()
+    total_size = sum(size for _, size, _ in files)
+    removed = []
+    for mtime, size, path in files:
+        too_old = max_age is not None and now - mtime > max_age
+        too_big = max_size is not None and total_size > max_size
+        if not too_old and not too_big:
+            break  # sorted by mtime, so the newer files are in range as well
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+        removed.append(size)
+
+    # Remove empty directories
+    for parent, _, _ in sorted(os.walk(directory), reverse=True):
+        if parent != directory:
+            try:
+                os.rmdir(parent)
+            except OSError:
+                pass  # not empty
+    return len(removed), sum(removed)
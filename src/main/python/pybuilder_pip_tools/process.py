@@ -0,0 +1,261 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Running pip-tools commands in a subprocess
+'''
+
+from collections import deque
+import subprocess
+import threading
+import signal
+import time
+import sys
+import os
+
+TAIL_LINES = 200
+
+class ProcessFailed(Exception):
+
+    '''
+    Process exited with non-zero exit code
+
+    Attributes
+    ----------
+    command : [str]
+        Command line
+    returncode : int
+    stdout : str
+        Output, or its last lines when run with `run`.
+    stderr : str
+        Error output, or its last lines when run with `run`.
+    '''
+
+    def __init__(self, args, returncode, stdout, stderr):
+        super().__init__('Command {!r} exited with {}'.format(' '.join(args), returncode))
+        self.command = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+class TimedOut(ProcessFailed):
+
+    '''
+    Process was killed because it ran longer than its timeout
+
+    Attributes
+    ----------
+    timeout : float
+        Seconds.
+    '''
+
+    def __init__(self, args, returncode, stdout, stderr, timeout):
+        super().__init__(args, returncode, stdout, stderr)
+        self.timeout = timeout
+
+    def __str__(self):
+        return 'Command {!r} timed out after {:g}s'.format(' '.join(self.command), self.timeout)
+
+class Cancelled(Exception):
+
+    '''
+    Process was killed because it was cancelled
+    '''
+
+class Completed(object):
+
+    '''
+    Process which exited successfully
+
+    Attributes
+    ----------
+    command : [str]
+        Command line
+    stdout : str
+        Output, or its last lines when run with `run`.
+    stderr : str
+        Error output, or its last lines when run with `run`.
+    wall_time : float
+        Seconds from start to exit.
+    cpu_time : float or None
+        User and system CPU seconds used, if known.
+    max_rss : int or None
+        Peak resident set size in KiB, if known.
+    '''
+
+    def __init__(self, command, stdout, stderr, wall_time, cpu_time=None, max_rss=None):
+        self.command = command
+        self.stdout = stdout
+        self.stderr = stderr
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.max_rss = max_rss
+
+def run(args, cancel=None, env=None, timeout=None, on_line=None, tail_lines=TAIL_LINES):
+    '''
+    Run command and wait for it to finish
+
+    Output is read line by line as it is written, keeping only the last lines
+    in memory. On Unix, the process runs in its own process group such that
+    on timeout, cancellation or KeyboardInterrupt the whole process tree is
+    killed, e.g. the build backends pip starts as well.
+
+    Parameters
+    ----------
+    args : [str]
+        Command line.
+    cancel : threading.Event or None
+        When set, the process is killed and `Cancelled` is raised.
+    env : {str => str} or None
+        Environment variables to set in addition to those of the current
+        process.
+    timeout : float or None
+        Seconds after which the process is killed and `TimedOut` is raised.
+        No timeout if None.
+    on_line : callable or None
+        Called with each line of output and error output, without line
+        ending, as it is read. Called from other threads.
+    tail_lines : int
+        Number of last lines of output and of error output to keep.
+
+    Returns
+    -------
+    Completed
+
+    Raises
+    ------
+    ProcessFailed
+    TimedOut
+    Cancelled
+    '''
+    env = dict(os.environ, **env) if env else None  # an empty env would clear the environment
+    start = time.perf_counter()
+    deadline = None if timeout is None else start + timeout
+    process = subprocess.Popen(
+        args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, env=env,
+        start_new_session=os.name == 'posix',
+    )
+    with process:
+        stdout = _read_in_background(process.stdout, on_line, tail_lines)
+        stderr = _read_in_background(process.stderr, on_line, tail_lines)
+        try:
+            rusage = _wait(process, cancel, deadline)
+        except BaseException as ex:  # Cancelled, _Timeout, KeyboardInterrupt
+            _kill(process)
+            _wait(process)
+            if isinstance(ex, _Timeout):
+                raise TimedOut(args, process.returncode, stdout(), stderr(), timeout) from None
+            raise
+        finally:
+            _kill_group(process)  # background processes left behind would keep the pipes open
+        wall_time = time.perf_counter() - start
+        stdout = stdout()
+        stderr = stderr()
+    if process.returncode != 0:
+        raise ProcessFailed(args, process.returncode, stdout, stderr)
+    cpu_time = None
+    max_rss = None
+    if rusage is not None:
+        cpu_time = rusage.ru_utime + rusage.ru_stime
+        max_rss = rusage.ru_maxrss
+        if sys.platform == 'darwin':
+            max_rss //= 1024  # bytes instead of KiB
+    return Completed(args, stdout, stderr, wall_time, cpu_time, max_rss)
+
+class _Timeout(Exception):
+    pass
+
+def _read_in_background(pipe, on_line, tail_lines):
+    '''
+    Read pipe line by line till EOF in a thread
+
+    Returns a function which joins the thread and returns the last lines read.
+    '''
+    tail = deque(maxlen=tail_lines)
+    def read():
+        for line in pipe:
+            tail.append(line)
+            if on_line is not None:
+                on_line(line.rstrip('\r\n'))
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    def join():
+        thread.join()
+        return ''.join(tail)
+    return join
+
+def _kill(process):
+    '''
+    Kill process and, on Unix, its process group
+    '''
+    if os.name == 'posix':
+        _kill_group(process)
+    else:
+        try:
+            process.kill()
+        except OSError:
+            pass  # exited already
+
+def _kill_group(process):
+    if os.name != 'posix':
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)  # the group is led by the process, see start_new_session
+    except (ProcessLookupError, PermissionError):
+        pass  # the whole group exited already
+
+def _wait(process, cancel=None, deadline=None):
+    '''
+    Wait for process to exit
+
+    Parameters
+    ----------
+    deadline : float or None
+        `time.perf_counter` value after which to give up.
+
+    Returns
+    -------
+    resource.struct_rusage or None
+        Resource usage of the process, if supported by the OS.
+
+    Raises
+    ------
+    Cancelled
+        When cancel is set before the process exits.
+    _Timeout
+        When the deadline passes before the process exits.
+    '''
+    delay = 0.001
+    while True:
+        if hasattr(os, 'wait4'):
+            # Reap the process ourselves to get its resource usage. Popen
+            # does not wait once its returncode is set.
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                if os.WIFSIGNALED(status):
+                    process.returncode = -os.WTERMSIG(status)
+                else:
+                    process.returncode = os.WEXITSTATUS(status)
+                return rusage
+        elif process.poll() is not None:
+            return None
+        if cancel is not None and cancel.is_set():
+            raise Cancelled()
+        if deadline is not None and time.perf_counter() > deadline:
+            raise _Timeout()
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
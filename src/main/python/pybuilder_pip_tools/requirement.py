@@ -0,0 +1,325 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Requirements to compile, parsed from PyBuilder dependencies and urls
+
+Parsing is memoized, so repeated dependencies and urls, e.g. of the
+development and non-development file or of multiple runs, are parsed once.
+'''
+
+from pybuilder.errors import BuildFailedException
+from urllib.parse import urlparse, parse_qs
+from functools import lru_cache
+
+class Requirement(object):
+
+    '''
+    Requirement line of a requirements.in file
+
+    Attributes
+    ----------
+    name : str
+        Package name as given.
+    key : str
+        Canonical package name (PEP 503), to compare names by.
+    options : str or None
+        Extras, e.g. ``[extra1,extra2]``.
+    version : str or None
+        Version specifier, e.g. ``>=1.0``.
+    marker : str or None
+        Environment marker, e.g. ``python_version < "3.9"``.
+    url : str or None
+        Url overriding the requirement.
+    origins : tuple(str)
+        How the requirement was added, e.g. ``('depends_on',)``.
+    '''
+
+    __slots__ = ('name', 'key', 'options', 'version', 'marker', 'url', 'origins')
+
+    def __init__(self, name, key, options=None, version=None, marker=None, url=None, origins=()):
+        self.name = name
+        self.key = key
+        self.options = options
+        self.version = version
+        self.marker = marker
+        self.url = url
+        self.origins = origins
+
+    def line(self):
+        '''
+        Get requirement line, ignoring url
+        '''
+        line = self.name
+        if self.options:
+            line += self.options
+        if self.version:
+            line += self.version
+        if self.marker:
+            line += '; ' + self.marker
+        return line
+
+    def __repr__(self):
+        return 'Requirement({!r})'.format(self.line())
+
+def from_dependency(dependency):
+    '''
+    Get requirement of a PyBuilder dependency
+
+    Parameters
+    ----------
+    dependency : pybuilder.core.Dependency
+
+    Returns
+    -------
+    Requirement
+
+    Raises
+    ------
+    pybuilder.errors.BuildFailedException
+        If the dependency is not a valid requirement.
+    '''
+    name = dependency.name
+    extras = getattr(dependency, 'extras', None)  # PyBuilder>=0.12 splits extras off the name
+    if extras:
+        name += '[{}]'.format(','.join(extras))
+    return Requirement(*_parse(name, dependency.version, getattr(dependency, 'markers', None)))
+
+@lru_cache(maxsize=None)
+def _parse(name, version, marker):
+    from packaging.requirements import Requirement as Requirement_, InvalidRequirement
+    from packaging.utils import canonicalize_name
+    try:
+        requirement = Requirement_(name + (version or ''))
+    except InvalidRequirement:
+        try:
+            Requirement_(name)
+        except InvalidRequirement:
+            raise BuildFailedException(
+                'Invalid dependency name {!r}. '
+                'Examples of valid names: pkg, pkg[extra1,extra2].'
+                .format(name)
+            )
+        raise BuildFailedException(
+            'Invalid version specifier {!r} of dependency {!r}. '
+            'Examples of valid specifiers: ==1.0, >=1.0,<2, ~=1.2.'
+            .format(version, name)
+        )
+    options = '[{}]'.format(','.join(sorted(requirement.extras))) if requirement.extras else None
+    return requirement.name, canonicalize_name(requirement.name), options, version, marker
+
+def index(requirements):
+    '''
+    Get requirements by canonical name and environment marker
+
+    A package may be required once per marker, e.g. ``foo>=2;
+    python_version >= "3.10"`` and ``foo<2; python_version < "3.10"``.
+
+    Parameters
+    ----------
+    requirements : iterable(Requirement)
+
+    Returns
+    -------
+    {(str, str or None) => Requirement}
+        Requirements by `Requirement.key` and `Requirement.marker`, in the
+        given order. Of equal requirements, the first one is kept.
+
+    Raises
+    ------
+    pybuilder.errors.BuildFailedException
+        If a package is required twice with the same marker, differently.
+    '''
+    from packaging.specifiers import SpecifierSet
+    indexed = {}
+    for requirement in requirements:
+        key = (requirement.key, requirement.marker)
+        other = indexed.get(key)
+        if other is None:
+            indexed[key] = requirement
+        elif other.options != requirement.options or SpecifierSet(other.version or '') != SpecifierSet(requirement.version or ''):
+            raise BuildFailedException(
+                'Dependency {!r} is declared twice: {!r} and {!r}. '
+                'Declare it once, or with different environment markers.'
+                .format(requirement.name, other.line(), requirement.line())
+            )
+    return indexed
+
+@lru_cache(maxsize=None)
+def parse_url(url):
+    '''
+    Parse a ``*_urls`` entry
+
+    Parameters
+    ----------
+    url : str
+        Url, optionally prefixed with ``-e``, with an
+        ``#egg={pkg-name}-{version}`` fragment.
+
+    Returns
+    -------
+    (str, str)
+        Url without ``-e`` prefix and package name as given.
+
+    Raises
+    ------
+    pybuilder.errors.BuildFailedException
+        If the url is invalid.
+    '''
+    url = url.strip()
+
+    # Drop -e, it is added back when writing requirements.in
+    if url.startswith('-e'):
+        url = url[3:].strip()
+
+    # Split url
+    url_parts = urlparse(url)
+    if not url_parts.scheme:
+        raise BuildFailedException(
+            "Dependency url must start with '{{scheme}}://', got: {!r}."
+            .format(url)
+        )
+
+    # Get egg parameter from fragment
+    query_parameters = parse_qs(url_parts.fragment)
+    if not 'egg' in query_parameters:
+        raise BuildFailedException(
+            "Missing '#egg=pkg-name-version' fragment in url {!r}."
+            .format(url)
+        )
+    egg = query_parameters['egg'][0]
+
+    # Get name from egg parameter
+    parts = egg.split('-')
+    if len(parts) == 1:
+        raise BuildFailedException(
+            "Missing version in 'egg' parameter of url {!r}. "
+            "Please add version such that: 'egg={{pkg-name}}-{{version}}'."
+            .format(url)
+        )
+    return url, '-'.join(parts[:-1])
+
+def merge(requirement, other):
+    '''
+    Get requirement which satisfies both requirements
+
+    Extras are united and version specifiers are intersected. Requirements
+    with different environment markers apply to different environments and
+    must not be merged, keep them as separate lines instead.
+
+    Parameters
+    ----------
+    requirement : Requirement
+    other : Requirement
+        Requirement of the same package, with the same marker.
+
+    Returns
+    -------
+    Requirement
+        Requirement without url, named like `requirement`, with the origins
+        of both.
+    '''
+    from packaging.specifiers import SpecifierSet
+    extras = set()
+    for options in (requirement.options, other.options):
+        if options:
+            extras.update(options[1:-1].split(','))
+    options = '[{}]'.format(','.join(sorted(extras))) if extras else None
+    if requirement.version and other.version and requirement.version != other.version:
+        version = str(SpecifierSet(requirement.version) & SpecifierSet(other.version))
+    else:
+        version = requirement.version or other.version
+    origins = requirement.origins + tuple(origin for origin in other.origins if origin not in requirement.origins)
+    return Requirement(requirement.name, requirement.key, options, version, requirement.marker, origins=origins)
+
+def is_satisfiable(version):
+    '''
+    Get whether a version specifier can be satisfied
+
+    Only detects plain conflicts: a pinned version (``==1.0``) excluded by
+    another specifier, or bounds (``>=``, ``>``, ``<=``, ``<``, ``~=``,
+    ``==1.*``) which leave no room. Pre-release subtleties and ``===`` are
+    ignored; when unsure, the specifier is assumed satisfiable.
+
+    Parameters
+    ----------
+    version : str or None
+        Version specifier, e.g. ``>=1.0,<2``.
+
+    Returns
+    -------
+    bool
+    '''
+    from packaging.specifiers import SpecifierSet
+    from packaging.version import Version, InvalidVersion
+    if not version:
+        return True
+    specifiers = SpecifierSet(version)
+    lower = None  # (version, inclusive)
+    upper = None
+    excluded = set()
+    for specifier in specifiers:
+        operator = specifier.operator
+        wildcard = specifier.version.endswith('.*')
+        try:
+            bound = Version(specifier.version[:-2] if wildcard else specifier.version)
+        except InvalidVersion:
+            continue
+        if operator == '==' and not wildcard:
+            if not specifiers.contains(bound, prereleases=True):
+                return False
+            lower = _max_bound(lower, (bound, True))
+            upper = _min_bound(upper, (bound, True))
+        elif operator == '==':  # ==1.2.* matches >=1.2.dev0, <1.3.dev0
+            lower = _max_bound(lower, (_release_start(bound.epoch, bound.release), True))
+            upper = _min_bound(upper, (_release_start(bound.epoch, _bump(bound.release)), False))
+        elif operator == '~=':  # ~=1.2.3 matches >=1.2.3, <1.3.dev0
+            lower = _max_bound(lower, (bound, True))
+            upper = _min_bound(upper, (_release_start(bound.epoch, _bump(bound.release[:-1])), False))
+        elif operator in ('>=', '>'):
+            lower = _max_bound(lower, (bound, operator == '>='))
+        elif operator in ('<=', '<'):
+            upper = _min_bound(upper, (bound, operator == '<='))
+        elif operator == '!=' and not wildcard:
+            excluded.add(bound)
+    if lower is None or upper is None:
+        return True
+    if lower[0] > upper[0]:
+        return False
+    if lower[0] == upper[0]:
+        return lower[1] and upper[1] and lower[0] not in excluded
+    return True
+
+def _max_bound(bound, other):
+    if bound is None or other[0] > bound[0] or (other[0] == bound[0] and not other[1]):
+        return other
+    return bound
+
+def _min_bound(bound, other):
+    if bound is None or other[0] < bound[0] or (other[0] == bound[0] and not other[1]):
+        return other
+    return bound
+
+def _bump(release):
+    return release[:-1] + (release[-1] + 1,)
+
+def _release_start(epoch, release):
+    '''
+    Get lowest version of a release, e.g. 1.3.dev0 of 1.3
+    '''
+    from packaging.version import Version
+    return Version('{}!{}.dev0'.format(epoch, '.'.join(map(str, release))))
@@ -0,0 +1,357 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Comparing compiled requirements files to the current environment
+'''
+
+from urllib.parse import urlparse, parse_qs
+from collections import OrderedDict
+import sysconfig
+import hashlib
+import shutil
+import sys
+import os
+import re
+
+# Packages pip-sync never uninstalls, nor their dependencies
+PACKAGES_TO_IGNORE = {'-markerlib', 'pip', 'pip-tools', 'pip-review', 'pkg-resources', 'setuptools', 'wheel', 'distribute'}
+
+class LockFile(object):
+
+    '''
+    Requirements of compiled requirements files
+
+    Attributes
+    ----------
+    pins : {str => str}
+        Version of each pinned package, by canonical name.
+    editables : {str => str}
+        Requirement line of each url requirement, by canonical name.
+    unpinned : [str]
+        Requirement lines which are neither pinned nor a url.
+    options : [str]
+        Option lines, e.g. ``--index-url``, in order of first appearance.
+    hashes : {str => [str]}
+        ``--hash`` values of pins which have them, e.g. ``sha256:...``, by
+        canonical name.
+    '''
+
+    def __init__(self, pins, editables, unpinned, options=(), hashes=None):
+        self.pins = pins
+        self.editables = editables
+        self.unpinned = unpinned
+        self.options = list(options)
+        self.hashes = hashes or {}
+
+def read_lock_files(paths):
+    '''
+    Read requirements of compiled requirements files
+
+    Parameters
+    ----------
+    paths : [str]
+
+    Returns
+    -------
+    LockFile
+    '''
+    from packaging.utils import canonicalize_name
+    pins = {}
+    editables = {}
+    unpinned = []
+    options = []
+    hashes = {}
+    for path in paths:
+        for line in _lines(path):
+            hash_values = re.findall(r'\s--hash[=\s](\S+)', line)
+            line = _strip_hashes(line)
+            if line.startswith('-e'):
+                editables[canonicalize_name(egg_name(line))] = line
+                continue
+            if line.startswith('-') and not re.match(r'(-r|-c|--requirement|--constraint)\b', line):
+                if line not in options:
+                    options.append(line)
+                continue
+            match = re.fullmatch(r'([A-Za-z0-9._-]+)(\[[^]]*\])?==([^\s;]+)', line)
+            if match:
+                name = canonicalize_name(match.group(1))
+                pins[name] = match.group(3)
+                if hash_values:
+                    hashes[name] = hash_values
+            else:
+                unpinned.append(line)
+    return LockFile(pins, editables, unpinned, options, hashes)
+
+def requirement_lines(path):
+    '''
+    Get requirement lines of a requirements file
+
+    Comments, blank lines and ``--hash`` options are dropped and continued
+    lines are joined.
+    '''
+    return [_strip_hashes(line) for line in _lines(path)]
+
+def _lines(path):
+    '''
+    Get lines of a requirements file without comments, continued lines joined
+    '''
+    with open(path) as f:
+        content = f.read().replace('\\\n', ' ')
+    lines = []
+    for line in content.splitlines():
+        line = re.sub(r'(^|\s)#.*', '', line).strip()
+        if line:
+            lines.append(line)
+    return lines
+
+def _strip_hashes(line):
+    return re.sub(r'\s--hash[=\s]\S+', '', line).strip()
+
+def egg_name(line):
+    '''
+    Get package name from the ``#egg=`` fragment of a url requirement line
+    '''
+    url = line[2:].strip() if line.startswith('-e') else line
+    egg = parse_qs(urlparse(url).fragment).get('egg', [''])[0]
+    egg = re.split(r'[\[<>=!~;]', egg, 1)[0]  # drop options and version constraint appended to url
+    return egg.rsplit('-', 1)[0]
+
+def installed_distributions():
+    '''
+    Get distributions installed in the environment of the current interpreter
+
+    Only its site-packages directories are searched, and the user's when it
+    is not a virtual environment, as pip does. Other directories on
+    ``sys.path``, such as PyBuilder's plugin environment, are not part of the
+    environment pip-sync installs into.
+
+    Returns
+    -------
+    {str => importlib.metadata.Distribution}
+        Distributions by canonical name.
+    '''
+    from importlib.metadata import distributions
+    from packaging.utils import canonicalize_name
+    import site
+    paths = [sysconfig.get_path('purelib'), sysconfig.get_path('platlib')]
+    if sys.prefix == sys.base_prefix and site.ENABLE_USER_SITE:
+        paths.append(site.getusersitepackages())
+    paths = list(OrderedDict.fromkeys(os.path.normcase(os.path.abspath(path)) for path in paths))
+    installed = {}
+    for distribution in distributions(path=list(paths)):
+        # Finders of sys.meta_path may ignore or even extend the path, e.g.
+        # PyBuilder's for its vendored packages
+        location = os.path.normcase(os.path.abspath(str(distribution.locate_file(''))))
+        name = distribution.metadata['Name']
+        if name and location in paths:
+            installed.setdefault(canonicalize_name(name), distribution)  # first path wins
+    return installed
+
+def is_current_environment(script):
+    '''
+    Get whether a script on PATH runs in the environment of the current interpreter
+
+    It does when it is installed next to the current interpreter or in its
+    scripts directory, or when its shebang runs an interpreter there. Scripts
+    which run elsewhere, or which cannot be told apart, e.g. shims of pyenv,
+    are not.
+
+    Parameters
+    ----------
+    script : str
+        Name of the script, e.g. ``pip-sync``.
+
+    Returns
+    -------
+    bool
+    '''
+    path = shutil.which(script)
+    if path is None:
+        return False
+    directories = [os.path.dirname(path)]
+    try:
+        with open(path, 'rb') as f:
+            first_line = f.readline(1024)
+    except OSError:
+        first_line = b''
+    if first_line.startswith(b'#!'):
+        words = first_line[2:].decode(errors='replace').split()
+        if words and os.path.basename(words[0]) != 'env':  # env would run whichever python is on PATH
+            directories.append(os.path.dirname(words[0]))
+    environment = {os.path.dirname(sys.executable), sysconfig.get_path('scripts')}
+    for directory in directories:
+        for environment_directory in environment:
+            try:
+                if os.path.samefile(directory, environment_directory):
+                    return True
+            except OSError:
+                pass
+    return False
+
+def dependency_closure(names, installed):
+    '''
+    Get names of installed distributions and their installed dependencies
+
+    Parameters
+    ----------
+    names : iterable(str)
+        Canonical names.
+    installed : {str => importlib.metadata.Distribution}
+        As returned by `installed_distributions`.
+
+    Returns
+    -------
+    {str}
+        Canonical names.
+    '''
+    from packaging.requirements import Requirement, InvalidRequirement
+    from packaging.utils import canonicalize_name
+    closure = set()
+    todo = [name for name in names if name in installed]
+    while todo:
+        name = todo.pop()
+        if name in closure:
+            continue
+        closure.add(name)
+        for requirement in installed[name].requires or ():
+            try:
+                requirement = Requirement(requirement)
+            except InvalidRequirement:
+                continue
+            if requirement.marker is not None and not requirement.marker.evaluate({'extra': ''}):
+                continue
+            dependency = canonicalize_name(requirement.name)
+            if dependency in installed:
+                todo.append(dependency)
+    return closure
+
+def digest(paths):
+    '''
+    Get digest of the content of files
+    '''
+    hash_ = hashlib.sha256()
+    for path in paths:
+        hash_.update(path.encode('utf-8') + b'\0')
+        with open(path, 'rb') as f:
+            hash_.update(f.read())
+        hash_.update(b'\0')
+    return hash_.hexdigest()
+
+def is_in_sync(lock_file, installed, synced_digest, lock_digest):
+    '''
+    Get whether pip-sync would leave the environment unchanged
+
+    Url requirements cannot be compared to installed metadata. They are
+    considered in sync if the requirements files are unchanged since the last
+    pip-sync and their package is installed.
+
+    Parameters
+    ----------
+    lock_file : LockFile
+        Requirements to sync.
+    installed : {str => importlib.metadata.Distribution}
+        As returned by `installed_distributions`.
+    synced_digest : str or None
+        `digest` of the requirements files at the last successful pip-sync.
+    lock_digest : str
+        `digest` of the requirements files to sync.
+
+    Returns
+    -------
+    bool
+    '''
+    if lock_file.unpinned:
+        return False
+    if lock_file.editables and synced_digest != lock_digest:
+        return False
+    for name in lock_file.editables:
+        if name not in installed:
+            return False
+    for name, version in lock_file.pins.items():
+        if name not in installed or not _is_version(installed[name].version, version):
+            return False
+    return not _extraneous(lock_file, installed)
+
+class SyncPlan(object):
+
+    '''
+    Changes which make an environment match compiled requirements files
+
+    Attributes
+    ----------
+    uninstall : [str]
+        Canonical names of the distributions to uninstall.
+    install : [str]
+        Requirement lines to install: pins, with their ``--hash`` options, then
+        url requirements.
+    options : [str]
+        Option lines of the requirements files, to install with, e.g.
+        ``--index-url`` and ``--require-hashes``.
+    '''
+
+    def __init__(self, uninstall, install, options=()):
+        self.uninstall = uninstall
+        self.install = install
+        self.options = list(options)
+
+def plan(lock_file, installed):
+    '''
+    Get the changes pip-sync would make
+
+    Like pip-sync, distributions which are not required are uninstalled,
+    except `PACKAGES_TO_IGNORE` and their dependencies; pins which are not
+    installed with the pinned version are installed; and url requirements are
+    always reinstalled, as their content may have changed.
+
+    Parameters
+    ----------
+    lock_file : LockFile
+        Requirements to sync.
+    installed : {str => importlib.metadata.Distribution}
+        As returned by `installed_distributions`.
+
+    Returns
+    -------
+    SyncPlan or None
+        None if the plan cannot be determined, i.e. when the requirements
+        files contain lines other than pins, url requirements and options,
+        such as pins with environment markers.
+    '''
+    if lock_file.unpinned:
+        return None
+    install = [
+        ' '.join(['{}=={}'.format(name, version)] + ['--hash=' + value for value in lock_file.hashes.get(name, [])])
+        for name, version in sorted(lock_file.pins.items())
+        if name not in installed or not _is_version(installed[name].version, version)
+    ]
+    install.extend(line for _, line in sorted(lock_file.editables.items()))
+    return SyncPlan(sorted(_extraneous(lock_file, installed)), install, lock_file.options)
+
+def _is_version(installed_version, version):
+    from packaging.version import Version, InvalidVersion
+    try:
+        return Version(installed_version) == Version(version)
+    except InvalidVersion:
+        return installed_version == version
+
+def _extraneous(lock_file, installed):
+    '''
+    Get installed distributions pip-sync would uninstall
+    '''
+    expected = set(lock_file.pins) | set(lock_file.editables) | dependency_closure(PACKAGES_TO_IGNORE, installed)
+    return set(installed) - expected - PACKAGES_TO_IGNORE
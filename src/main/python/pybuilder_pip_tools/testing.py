@@ -0,0 +1,238 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+pytest fixtures for testing builds which use the plugin
+
+Template virtual environments and wheelhouses are created once and cached in
+``$XDG_CACHE_HOME/pybuilder_pip_tools``, keyed by their packages and the
+Python interpreter. Tests get a cheap clone of a template instead of creating
+and populating a virtual environment each time. Only the first run needs
+network access.
+
+Register the fixtures in the ``conftest.py`` at the root of your tests::
+
+    pytest_plugins = ['pybuilder_pip_tools.testing']
+
+The fixtures are only defined when pytest is installed, the plugin does not
+depend on it. The functions they use can be used without pytest.
+'''
+
+from pybuilder_pip_tools.lock_cache import default_cache_dir
+from pybuilder_pip_tools import process
+from contextlib import contextmanager
+import hashlib
+import shutil
+import json
+import sys
+import os
+
+# Packages installed in `pybuilder_venv` by default
+DEFAULT_PACKAGES = ('pip', 'setuptools', 'wheel', 'pybuilder', 'pytest-cov')
+
+_COMPLETE = '.pybuilder_pip_tools_complete'  # marks a fully created cache entry
+
+def template_venv(packages=DEFAULT_PACKAGES, cache_dir=None):
+    '''
+    Get virtual environment with packages installed, create it if missing
+
+    The virtual environment is created with the current Python interpreter.
+    Concurrent calls, e.g. by pytest-xdist workers, create it only once.
+
+    Parameters
+    ----------
+    packages : iterable(str)
+        Requirement specifiers to ``pip install``.
+    cache_dir : str or None
+        Directory to cache virtual environments in. Defaults to
+        ``$XDG_CACHE_HOME/pybuilder_pip_tools/venvs``.
+
+    Returns
+    -------
+    str
+        Path to the virtual environment. Do not modify it, use `clone_venv`
+        instead.
+    '''
+    cache_dir = cache_dir or os.path.join(default_cache_dir(), 'venvs')
+    path = os.path.join(cache_dir, _key(packages))
+    with _create_once(path):
+        process.run([sys.executable, '-m', 'venv', path])
+        process.run([os.path.join(path, 'bin', 'python'), '-m', 'pip', 'install', '-U'] + list(packages))
+    return path
+
+def clone_venv(template, destination):
+    '''
+    Copy a virtual environment
+
+    Files are hard linked instead of copied where possible, which is a lot
+    faster and takes little disk space. It falls back to copying, e.g. when
+    `destination` is on a different file system. Scripts in ``bin`` and
+    ``pyvenv.cfg`` refer to the path of the virtual environment; those are
+    copied with the path replaced.
+
+    Hard linked files are shared with the template, so they must not be
+    modified in place. pip and Python replace rather than modify files, so
+    installing and uninstalling packages in the clone is safe.
+
+    Parameters
+    ----------
+    template : str
+        Virtual environment to copy.
+    destination : str
+        Path of the clone. Must not exist.
+    '''
+    template = os.path.abspath(template)
+    destination = os.path.abspath(destination)
+    os.makedirs(destination)
+    for parent, directories, files in os.walk(template):
+        target_parent = os.path.join(destination, os.path.relpath(parent, template))
+        for name in directories + files:
+            source = os.path.join(parent, name)
+            target = os.path.join(target_parent, name)
+            if os.path.islink(source):  # e.g. bin/python, lib64
+                link = os.readlink(source)
+                if link == template or link.startswith(template + os.sep):
+                    link = destination + link[len(template):]
+                os.symlink(link, target)
+            elif name in directories:
+                os.mkdir(target)
+            elif name == _COMPLETE:
+                continue
+            elif parent == os.path.join(template, 'bin') or source == os.path.join(template, 'pyvenv.cfg'):
+                _copy_replacing(source, target, template, destination)
+            else:
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copy2(source, target)
+
+def wheelhouse(packages, cache_dir=None):
+    '''
+    Get directory of distributions of packages, download them if missing
+
+    Dependencies of the packages are downloaded as well. To compile
+    requirements with sdists offline, include their build requirements, e.g.
+    setuptools and wheel.
+
+    Parameters
+    ----------
+    packages : iterable(str)
+        Requirement specifiers to ``pip download``.
+    cache_dir : str or None
+        Directory to cache wheelhouses in. Defaults to
+        ``$XDG_CACHE_HOME/pybuilder_pip_tools/wheelhouses``.
+
+    Returns
+    -------
+    str
+        Path to the wheelhouse.
+    '''
+    cache_dir = cache_dir or os.path.join(default_cache_dir(), 'wheelhouses')
+    path = os.path.join(cache_dir, _key(packages))
+    with _create_once(path):
+        process.run([sys.executable, '-m', 'pip', 'download', '--dest', path] + list(packages))
+    return path
+
+def local_index_env(wheelhouse):
+    '''
+    Get environment variables which make pip use a wheelhouse instead of an index
+    '''
+    return {'PIP_NO_INDEX': '1', 'PIP_FIND_LINKS': os.path.abspath(wheelhouse)}
+
+def _key(packages):
+    key = json.dumps([sorted(packages), sys.executable, sys.version]).encode('utf-8')
+    return hashlib.sha256(key).hexdigest()
+
+@contextmanager
+def _create_once(path):
+    '''
+    Run body of with statement to create path, unless already created
+
+    The body is run while holding an exclusive lock on ``path + '.lock'``.
+    Leftovers of a previous failed or interrupted attempt are removed first.
+    '''
+    import fcntl
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(os.path.join(path, _COMPLETE)):
+            yield
+            return
+        shutil.rmtree(path, ignore_errors=True)
+        yield
+        open(os.path.join(path, _COMPLETE), 'w').close()
+
+def _copy_replacing(source, target, old, new):
+    with open(source, 'rb') as f:
+        content = f.read()
+    with open(target, 'wb') as f:
+        f.write(content.replace(old.encode('utf-8'), new.encode('utf-8')))
+    shutil.copymode(source, target)
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+if pytest is not None:
+    @pytest.fixture(scope='session')
+    def pybuilder_venv_packages():
+        '''
+        Packages to install in `pybuilder_venv`
+
+        Override this fixture to install other packages.
+        '''
+        return DEFAULT_PACKAGES
+
+    @pytest.fixture(scope='session')
+    def pybuilder_template_venv(pybuilder_venv_packages):
+        '''
+        Path to template virtual environment with `pybuilder_venv_packages`
+        '''
+        return template_venv(pybuilder_venv_packages)
+
+    @pytest.fixture
+    def pybuilder_venv(pybuilder_template_venv, tmpdir):
+        '''
+        Path to a clone of `pybuilder_template_venv` at ``tmpdir/venv``
+        '''
+        path = str(tmpdir.join('venv'))
+        clone_venv(pybuilder_template_venv, path)
+        return path
+
+    @pytest.fixture(scope='session')
+    def pybuilder_index_packages():
+        '''
+        Packages to provide in `pybuilder_local_index`
+
+        Override this fixture to provide other packages.
+        '''
+        return ('setuptools', 'wheel')
+
+    @pytest.fixture
+    def pybuilder_local_index(pybuilder_index_packages, monkeypatch):
+        '''
+        Make pip use a local wheelhouse of `pybuilder_index_packages` instead of an index
+
+        Sets ``$PIP_NO_INDEX`` and ``$PIP_FIND_LINKS`` during the test, which are
+        inherited by ``pip-compile`` and ``pip-sync``. Returns the path to the
+        wheelhouse.
+        '''
+        path = wheelhouse(pybuilder_index_packages)
+        for name, value in local_index_env(path).items():
+            monkeypatch.setenv(name, value)
+        return path
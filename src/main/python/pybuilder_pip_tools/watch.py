@@ -0,0 +1,101 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Waiting for files to change
+'''
+
+import time
+import os
+
+class Watcher(object):
+
+    '''
+    Waits for files to change
+
+    Uses inotify when the optional ``inotify_simple`` package is installed
+    (Linux only), else polls the files. Either way, a file is considered
+    changed when its modification time, size or inode changed, or when it was
+    created or removed.
+
+    Parameters
+    ----------
+    paths : [str]
+        Files to watch. Their directories must exist.
+    interval : float
+        Seconds between polls, when polling.
+    '''
+
+    def __init__(self, paths, interval=1.0):
+        self._paths = [os.path.abspath(path) for path in paths]
+        self._interval = interval
+        self._inotify = None
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            pass
+        else:
+            self._inotify = INotify()
+            for directory in sorted(set(map(os.path.dirname, self._paths))):
+                # Watch the directory, editors often replace files instead of writing to them
+                self._inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.DELETE)
+        self._stats = self._stat()
+
+    @property
+    def uses_inotify(self):
+        return self._inotify is not None
+
+    def wait(self):
+        '''
+        Block until a file changes
+
+        Returns
+        -------
+        [str]
+            Absolute paths of the changed files.
+        '''
+        while True:
+            if self._inotify:
+                self._inotify.read(read_delay=100)  # wait a bit to coalesce the events of a save
+            else:
+                time.sleep(self._interval)
+            stats = self._stat()
+            changed = [path for path in self._paths if stats[path] != self._stats[path]]
+            self._stats = stats
+            if changed:
+                return changed
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _stat(self):
+        stats = {}
+        for path in self._paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stats[path] = None
+            else:
+                stats[path] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        return stats
@@ -0,0 +1,212 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compiling the requirements files of many projects in one run
+
+Run it with::
+
+    pybuilder-pip-tools-workspace [directory ...]
+
+It finds the ``build.py`` files in the directories, loads each project and
+compiles its ``*requirements*.txt`` like ``pyb pip_sync`` would, without
+running ``prepare`` or syncing. Projects are compiled in parallel worker
+processes which share the lock cache, so projects with the same dependencies
+compile them once.
+'''
+
+from pybuilder.core import Logger
+from pybuilder.errors import BuildFailedException
+import multiprocessing
+import traceback
+import argparse
+import inspect
+import time
+import json
+import sys
+import os
+
+def find_projects(roots):
+    '''
+    Find PyBuilder projects
+
+    Hidden directories, ``target`` directories and virtual environments
+    (directories with a ``pyvenv.cfg`` and ``site-packages`` directories) are not
+    searched, as packages installed in them may contain a ``build.py`` too.
+
+    Parameters
+    ----------
+    roots : iterable(str)
+        Directories to search.
+
+    Returns
+    -------
+    [str]
+        Absolute paths of the directories containing a ``build.py``, sorted.
+    '''
+    projects = set()
+    for root in roots:
+        for directory, directories, files in os.walk(os.path.abspath(root)):
+            if 'pyvenv.cfg' in files:
+                directories[:] = []
+                continue
+            directories[:] = [
+                name for name in directories
+                if not name.startswith('.') and name not in ('target', 'site-packages')
+            ]
+            if 'build.py' in files:
+                projects.add(directory)
+    return sorted(projects)
+
+def run(directories, jobs, verbose=False):
+    '''
+    Compile the requirements files of projects
+
+    Parameters
+    ----------
+    directories : [str]
+        Project directories.
+    jobs : int
+        Number of projects to compile at the same time.
+    verbose : bool
+        If True, log info messages of projects, else only warnings and errors.
+
+    Yields
+    ------
+    dict
+        Result of each project, in order of completion: its ``directory``,
+        ``name``, ``seconds``, ``error`` (None if it succeeded) and ``report``
+        (`pybuilder_pip_tools.instrumentation.Report.to_dict`, None if the
+        project failed to load).
+    '''
+    level = Logger.INFO if verbose else Logger.WARN
+    with multiprocessing.Pool(jobs, maxtasksperchild=1) as pool:  # a fresh process per project, as loading build.py has side effects
+        for result in pool.imap_unordered(_run_project, [(directory, level) for directory in directories]):
+            yield result
+
+def _run_project(args):
+    '''
+    Load project and compile its requirements files, in a worker process
+    '''
+    directory, level = args
+    import pybuilder_pip_tools as plugin
+    start = time.perf_counter()
+    result = {'directory': directory, 'name': None, 'seconds': None, 'error': None, 'report': None}
+    logger = _Logger(os.path.basename(directory), level)
+    try:
+        os.chdir(directory)
+        project = _load_project(directory)
+        result['name'] = project.name
+        with plugin._reported(project, logger, 'pybuilder-pip-tools-workspace') as report:
+            try:
+                plugin._compile(project, logger, report)
+            finally:
+                result['report'] = report.to_dict()
+    except BuildFailedException as ex:
+        result['error'] = str(ex)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def _load_project(directory):
+    '''
+    Load build.py and run the initializers of the project and its plugins
+
+    Plugins are imported from the current environment rather than installed
+    into a plugin environment.
+
+    Returns
+    -------
+    pybuilder.core.Project
+    '''
+    from pybuilder.reactor import Reactor
+    from pybuilder.execution import ExecutionManager
+    logger = _Logger(os.path.basename(directory), Logger.ERROR)  # e.g. PyBuilder warns that venvs are disabled
+    reactor = Reactor(logger, ExecutionManager(logger))
+    if 'no_venvs' in inspect.signature(reactor.prepare_build).parameters:  # PyBuilder>=0.12
+        reactor.prepare_build(project_directory=directory, no_venvs=True)
+    else:
+        reactor.prepare_build(project_directory=directory)
+    reactor.execution_manager.execute_initializers([], logger=logger, project=reactor.project, reactor=reactor)
+    return reactor.project
+
+class _Logger(Logger):
+
+    '''
+    Logs to stderr, prefixed by project
+    '''
+
+    def __init__(self, name, level):
+        super().__init__(level)
+        self._name = name
+
+    def _do_log(self, level, message, *arguments):
+        print('[{}] {}'.format(self._name, self._format_message(message, *arguments)), file=sys.stderr, flush=True)
+
+def _format_result(result):
+    if result['error'] is not None:
+        return '{}: FAILED\n{}'.format(result['directory'], result['error'].rstrip())
+    report = result['report']
+    changed = report['files']['changed']
+    return '{}: {}, {} compiled, {} restored from lock cache, {:.2f}s'.format(
+        result['directory'],
+        'changed ' + ', '.join(changed) if changed else 'unchanged',
+        sum(1 for process in report['processes'] if process['name'] == 'pip-compile'),
+        report['lock_cache']['hits'],
+        result['seconds'],
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pybuilder-pip-tools-workspace',
+        description='Compile the *requirements*.txt files of all PyBuilder projects in the given directories.',
+    )
+    parser.add_argument('directories', nargs='*', default=['.'], help='Directories to search for build.py files. Default: .')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count() or 1,
+        help='Number of projects to compile at the same time. Default: %(default)s'
+    )
+    parser.add_argument('--report', help='Write the results of all projects to this JSON file')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log the info messages of each project')
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1, got: {}'.format(args.jobs))
+
+    directories = find_projects(args.directories)
+    if not directories:
+        parser.exit(1, 'No build.py found in {}\n'.format(', '.join(args.directories)))
+    print('Compiling {} projects'.format(len(directories)), file=sys.stderr)
+    start = time.perf_counter()
+    results = []
+    for result in run(directories, args.jobs, args.verbose):
+        print(_format_result(result), flush=True)
+        results.append(result)
+    results.sort(key=lambda result: result['directory'])
+    failed = [result['directory'] for result in results if result['error'] is not None]
+    print(
+        'Compiled {} projects in {:.2f}s, {} failed'.format(len(results), time.perf_counter() - start, len(failed)),
+        file=sys.stderr
+    )
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
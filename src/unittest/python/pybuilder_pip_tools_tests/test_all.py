@@ -20,15 +20,19 @@ Test everything
 '''
 
 import pytest
+import json
 import os
 import sys
 import plumbum as pb
+from glob import glob
 from textwrap import dedent, indent
 
+pytest_plugins = ['pybuilder_pip_tools.testing']
+
 ####################################
 # pybuilder test lib for Python>=2.6. Same stability as plugin.
 
-def pyb(init_body):
+def pyb(init_body, tasks=('pip_sync',)):
     '''
     Create build.py and call pyb
     '''
@@ -49,12 +53,11 @@ def pyb(init_body):
     )
     with open('build.py', 'w') as f:
         f.write(content)
-    pb.local['vex']('--path', 'venv', '-m', 'pip', 'install', '-U', 'pip', 'setuptools', 'wheel', 'pybuilder', 'pytest-cov')   #TODO does this use `which python` or some other Python version for the venv? It should match
-    pb.local['vex']('--path', 'venv', 'pyb', '-X', 'pip_sync')
+    return pb.local['vex']('--path', 'venv', 'pyb', '-X', *tasks)
     
-def assert_pyb_fails(init_body, failure_message):
+def assert_pyb_fails(init_body, failure_message, tasks=('pip_sync',)):
     with pytest.raises(pb.ProcessExecutionError) as ex:
-        pyb(init_body)
+        pyb(init_body, tasks)
     message = 'BUILD FAILED - ' + failure_message
     print(ex.value.stdout)
     print(ex.value.stderr, file=sys.stderr)
@@ -93,6 +96,17 @@ def use_temp_dir(tmpdir):  # Based on chicken_turtle_util.test.use_temp_dir
     yield tmpdir
     os.chdir(str(original_cwd))
     
+@pytest.fixture(autouse=True)
+def venv(pybuilder_venv):
+    '''
+    Clone of the template venv at ./venv, in which `pyb` runs
+    '''
+    return pybuilder_venv
+    
+@pytest.fixture(scope='session')
+def pybuilder_index_packages():
+    return ('six', 'pybuilder', 'setuptools', 'wheel')
+    
 def assert_text_contains(whole, part):  # From chicken_turtle_util.test.assert_text_contains
     '''
     Assert long string contains given string
@@ -199,6 +213,13 @@ class TestAll(object):
             )
         )
         
+    def test_url_name_normalized(self, depends_on, pybuilder_pip_tools_urls, requirements, requirements_development, depends_on_text):
+        '''
+        When url egg name differs from dependency name only in case, dashes, ..., match it anyway
+        '''
+        url = 'git+https://github.com/pybuilder/pybuilder.git#egg=PyBuilder-0'
+        self.assert_basic(depends_on, pybuilder_pip_tools_urls, requirements_development, 'pybuilder', url)
+        
     def assert_basic(self, depends_on, pybuilder_pip_tools_urls, requirements_development, name, url):
         pyb(
             init_body='''\
@@ -294,3 +315,289 @@ def test_sync():
     print(lines)
     assert any(line.startswith('PyBuilder==0.11.10.dev') for line in lines)
     assert 'cubicweb-celery==0.1' in lines
+    
+@pytest.mark.usefixtures('pybuilder_local_index')
+def test_lock_cache():
+    '''
+    When inputs are unchanged, restore requirements files from lock cache
+    '''
+    init_body = '''\
+        project.set_property('pybuilder_pip_tools_lock_cache_dir', 'lock_cache')
+        project.depends_on('six')
+        project.build_depends_on('pybuilder')  # keep pyb installed for the next run
+    '''
+    stdout = pyb(init_body)
+    assert 'Restored requirements.txt from lock cache' not in stdout
+    with open('requirements.txt') as f:
+        expected = f.read()
+    
+    # Second run reuses pins of first run, third has the same inputs as the second
+    pyb(init_body)
+    stdout = pyb(init_body)
+    assert 'Restored requirements.txt from lock cache' in stdout
+    with open('requirements.txt') as f:
+        assert f.read() == expected
+        
+def test_derive_requirements():
+    '''
+    When pybuilder_pip_tools_derive_requirements, derive requirements.txt from requirements_development.txt
+    '''
+    url = 'git+https://github.com/pybuilder/pybuilder.git#egg=pybuilder-0'
+    pyb(
+        init_body='''\
+            project.set_property('pybuilder_pip_tools_derive_requirements', True)
+            project.depends_on('six')
+            project.depends_on('pybuilder', '>0.9.0')
+            project.get_property('pybuilder_pip_tools_urls').append({url!r})
+        '''.format(url=url)
+    )
+    with open('requirements_development.txt') as f:
+        development_lines = f.read().splitlines()
+    with open('requirements.txt') as f:
+        lines = f.read().splitlines()
+    assert '-e ' + url + '>0.9.0' in development_lines
+    assert lines == ['pybuilder>0.9.0' if line.startswith('-e') else line for line in development_lines]
+    
+def test_sync_skipped():
+    '''
+    When environment matches `*requirements_development.txt`, skip pip-sync
+    '''
+    init_body = '''\
+        project.depends_on('six')
+        project.build_depends_on('pybuilder')
+    '''
+    stdout = pyb(init_body)
+    assert 'Skipped pip-sync' not in stdout
+    stdout = pyb(init_body)
+    assert 'Skipped pip-sync' in stdout
+    
+def test_in_process_engine():
+    '''
+    When in_process engine, output same as subprocess engine
+    '''
+    init_body = '''\
+        project.set_property('pybuilder_pip_tools_lock_cache_dir', None)
+        project.set_property('pybuilder_pip_tools_engine', {engine!r})
+        project.depends_on('six')
+        project.build_depends_on('pybuilder')
+    '''
+    pyb(init_body.format(engine='subprocess'))
+    expected = {}
+    for name in ('requirements.txt', 'build_requirements.txt'):
+        with open(name) as f:
+            expected[name] = f.read()
+        os.remove(name)
+    pyb(init_body.format(engine='in_process'))
+    for name, content in expected.items():
+        with open(name) as f:
+            assert f.read() == content
+            
+@pytest.mark.usefixtures('pybuilder_local_index')
+def test_report():
+    '''
+    Timings and lock cache results are written to the JSON report
+    '''
+    init_body = '''\
+        project.set_property('pybuilder_pip_tools_lock_cache_dir', 'lock_cache')
+        project.depends_on('six')
+    '''
+    stdout = pyb(init_body)
+    assert 'Compiling took' in stdout
+    with open('target/reports/pybuilder_pip_tools.json') as f:
+        report = json.load(f)
+    assert [phase['name'] for phase in report['phases']][-2:] == ['Compiling', 'Syncing']
+    assert {process['file'] for process in report['processes'] if process['name'] == 'pip-compile'} == {
+        'requirements.txt', 'requirements_development.txt', 'build_requirements.txt', 'build_requirements_development.txt'
+    }
+    assert report['lock_cache']['misses'] == 4
+    
+def test_constrain_build():
+    '''
+    When pybuilder_pip_tools_constrain_build, build requirements reuse the runtime pins
+    '''
+    pyb(
+        init_body='''\
+            project.set_property('pybuilder_pip_tools_constrain_build', True)
+            project.depends_on('six', '==1.15.0')
+            project.build_depends_on('pybuilder')
+            project.build_depends_on('six')
+        '''
+    )
+    for name in ('build_requirements.txt', 'build_requirements_development.txt'):
+        with open(name) as f:
+            assert 'six==1.15.0' in f.read().splitlines()
+            
+@pytest.mark.usefixtures('pybuilder_local_index')
+def test_minimal_sync():
+    '''
+    When pybuilder_pip_tools_sync_mode is minimal, install and uninstall only the changes
+    '''
+    init_body = '''\
+        project.set_property('pybuilder_pip_tools_sync_mode', 'minimal')
+        {}
+        project.build_depends_on('pybuilder')
+    '''
+    stdout = pyb(init_body.format("project.depends_on('six')"))
+    assert 'Syncing minimally' in stdout
+    assert any(line.startswith('six==') for line in pb.local['vex']('--path', 'venv', 'pip', 'freeze').splitlines())
+    stdout = pyb(init_body.format(''))
+    assert 'Syncing minimally: uninstalling 1 and installing 0 packages' in stdout
+    assert not any(line.startswith('six==') for line in pb.local['vex']('--path', 'venv', 'pip', 'freeze').splitlines())
+            
+@pytest.mark.usefixtures('pybuilder_local_index')
+def test_hashes():
+    '''
+    When pybuilder_pip_tools_hashes, pins have hashes and pip-sync checks them
+    '''
+    pyb(
+        init_body='''\
+            project.set_property('pybuilder_pip_tools_hashes', True)
+            project.set_property('pybuilder_pip_tools_hash_store', 'hashes.sqlite')
+            project.depends_on('six')
+            project.build_depends_on('pybuilder')
+        '''
+    )
+    for name in ('requirements.txt', 'requirements_development.txt'):
+        with open(name) as f:
+            content = f.read()
+        assert 'six==' in content
+        assert '--hash=sha256:' in content
+            
+@pytest.mark.usefixtures('pybuilder_local_index')
+def test_unchanged_files_kept():
+    '''
+    Requirements files whose content is unchanged are not rewritten
+    '''
+    init_body = '''\
+        project.depends_on('six')
+        project.build_depends_on('pybuilder')
+    '''
+    stdout = pyb(init_body)
+    assert 'Changed build_requirements.txt, build_requirements_development.txt, requirements.txt, requirements_development.txt' in stdout
+    mtimes = {name: os.stat(name).st_mtime_ns for name in glob('*requirements*.txt')}
+    stdout = pyb(init_body)
+    assert 'Requirements files unchanged' in stdout
+    assert {name: os.stat(name).st_mtime_ns for name in glob('*requirements*.txt')} == mtimes
+    with open('target/reports/pybuilder_pip_tools.json') as f:
+        assert json.load(f)['files']['changed'] == []
+        
+@pytest.mark.usefixtures('pybuilder_local_index')
+def test_graph():
+    '''
+    When pybuilder_pip_tools_graph, the resolved graph of each stem is
+    exported and the requirements files stay without annotations
+    '''
+    pyb(
+        init_body='''\
+            project.set_property('pybuilder_pip_tools_graph', True)
+            project.depends_on('six')
+            project.build_depends_on('pybuilder')
+        '''
+    )
+    for name in glob('*requirements*.txt'):
+        with open(name) as f:
+            assert '# via' not in f.read()
+    with open('target/reports/pybuilder_pip_tools_graph/requirements.json') as f:
+        graph = json.load(f)
+    assert sorted(graph['files']) == ['requirements.txt', 'requirements_development.txt']
+    nodes = {node['key']: node for node in graph['files']['requirements.txt']['nodes']}
+    assert nodes['six']['origin'] == ['depends_on']
+    assert nodes['six']['version']
+    with open('target/reports/pybuilder_pip_tools_graph/build_requirements.json') as f:
+        graph = json.load(f)
+    nodes = {node['key']: node for node in graph['files']['build_requirements.txt']['nodes']}
+    assert nodes['pybuilder']['origin'] == ['build_depends_on']
+    
+@pytest.mark.usefixtures('pybuilder_local_index')
+def test_compile_tasks():
+    '''
+    pip_compile* compile only their stems and skip stems which are up to date
+    '''
+    init_body = '''\
+        project.depends_on('six')
+        project.build_depends_on('pybuilder')
+    '''
+    pyb(init_body, tasks=('pip_compile_runtime',))
+    assert sorted(glob('*requirements*.txt')) == ['requirements.txt', 'requirements_development.txt']
+    stdout = pyb(init_body, tasks=('pip_compile',))
+    assert 'Skipped compiling requirements*.txt, it is up to date' in stdout
+    assert 'Changed build_requirements.txt, build_requirements_development.txt' in stdout
+    
+    # Modified outputs are compiled again
+    with open('requirements.txt', 'a') as f:
+        f.write('# modified\n')
+    stdout = pyb(init_body, tasks=('pip_compile', 'pip_sync_env'))
+    assert 'Skipped compiling build_requirements*.txt, it is up to date' in stdout
+    assert 'Changed requirements.txt' in stdout
+    assert any(line.startswith('six==') for line in pb.local['vex']('--path', 'venv', 'pip', 'freeze').splitlines())
+    
+@pytest.mark.usefixtures('pybuilder_local_index')
+def test_compile_tasks_constrained():
+    '''
+    With constrain_build, build requirements are compiled again when the runtime requirements files change
+    '''
+    init_body = '''\
+        project.set_property('pybuilder_pip_tools_constrain_build', True)
+        project.depends_on('six')
+        project.build_depends_on('pybuilder')
+    '''
+    pyb(init_body, tasks=('pip_compile',))
+    stdout = pyb(init_body, tasks=('pip_compile',))
+    assert 'Skipped compiling build_requirements*.txt, it is up to date' in stdout
+    
+    # Constraints modified since, e.g. by hand
+    with open('requirements_development.txt', 'a') as f:
+        f.write('# modified\n')
+    stdout = pyb(init_body, tasks=('pip_compile_build',))
+    assert 'Skipped compiling build_requirements*.txt' not in stdout
+    
+def test_compile_build_constraints_missing():
+    '''
+    When constrained, pip_compile_build requires the runtime requirements files
+    '''
+    assert_pyb_fails(
+        '''\
+            project.set_property('pybuilder_pip_tools_constrain_build', True)
+            project.build_depends_on('pybuilder')
+        ''',
+        'Cannot compile build_requirements*.txt, pybuilder_pip_tools_constrain_build requires '
+        'requirements_development.txt and requirements.txt which do not exist',
+        tasks=('pip_compile_build',)
+    )
+    
+@pytest.mark.usefixtures('pybuilder_local_index')
+def test_bundle():
+    '''
+    pip_bundle bundles the wheels of requirements.txt and build_requirements.txt,
+    installable without an index
+    '''
+    init_body = '''\
+        project.depends_on('six')
+        project.build_depends_on('wheel')
+    '''
+    stdout = pyb(init_body, tasks=('pip_sync', 'pip_bundle'))
+    assert 'Wrote ' in stdout
+    bundles = glob('target/pip_bundle/bundle-*.tar')
+    assert len(bundles) == 1
+    stdout = pyb(init_body, tasks=('pip_bundle',))
+    assert 'Unchanged {}'.format(os.path.abspath(bundles[0])) in stdout
+    assert 'wheels, 0 built' in stdout  # wheels are kept between runs
+    
+    pb.local['python']('-m', 'venv', 'installed')
+    vex = pb.local['vex'].with_env(PIP_FIND_LINKS='')  # only the wheels of the bundle
+    vex('--path', 'venv', 'python', '-m', 'pybuilder_pip_tools.bundle', 'install', bundles[0], '--python', 'installed/bin/python')
+    assert any(line.startswith('six==') for line in pb.local['installed/bin/pip']('freeze').splitlines())
+    
+@pytest.mark.usefixtures('pybuilder_local_index')
+def test_stats():
+    '''
+    Runs are appended to the history, pip_sync_stats summarizes them
+    '''
+    init_body = '''\
+        project.set_property('pybuilder_pip_tools_history', 'history.sqlite')
+        project.depends_on('six')
+    '''
+    pyb(init_body)
+    stdout = pyb(init_body, tasks=('pip_sync', 'pip_sync_stats'))
+    assert '2 runs from' in stdout
+    assert 'Stem, slowest first' in stdout
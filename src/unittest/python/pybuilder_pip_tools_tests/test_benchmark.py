@@ -0,0 +1,192 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmark the plugin's own overhead
+
+pip-compile and pip-sync are replaced by stand-ins which only record their
+arguments, so the timings exclude dependency resolution.
+
+Skipped unless $PYBUILDER_PIP_TOOLS_BENCHMARK is set to the file to write the
+results to, as JSON::
+
+    PYBUILDER_PIP_TOOLS_BENCHMARK=benchmark.json pyb run_unit_tests
+'''
+
+import pytest
+import platform
+import datetime
+import time
+import json
+import sys
+import os
+from pybuilder.core import Dependency
+from textwrap import dedent
+from types import SimpleNamespace
+import pybuilder_pip_tools as plugin
+
+output_file = os.environ.get('PYBUILDER_PIP_TOOLS_BENCHMARK')
+pytestmark = pytest.mark.skipif(not output_file, reason='$PYBUILDER_PIP_TOOLS_BENCHMARK not set')
+
+sizes = (10, 100, 1000, 10000)
+
+@pytest.fixture(scope='module')
+def results():
+    '''
+    Collect results, write them to the output file at the end
+    '''
+    results = []
+    yield results
+    with open(output_file, 'w') as f:
+        json.dump(
+            {
+                'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'python': sys.version,
+                'platform': platform.platform(),
+                'results': results,
+            },
+            f, indent=2, sort_keys=True
+        )
+
+@pytest.fixture
+def fake_pip_tools(tmpdir, monkeypatch):
+    '''
+    Put pip-compile and pip-sync stand-ins on PATH
+
+    Each records its arguments in ``{name}.log`` and pip-compile writes an
+    empty output file.
+    '''
+    bin_dir = tmpdir.mkdir('bin')
+    for name in ('pip-compile', 'pip-sync'):
+        path = bin_dir.join(name)
+        path.write(dedent('''\
+            #!{python}
+            import sys
+            with open({log!r}, 'a') as f:
+                f.write(repr(sys.argv) + '\\n')
+            if '-o' in sys.argv:
+                open(sys.argv[sys.argv.index('-o') + 1], 'w').close()
+            ''')
+            .format(python=sys.executable, log=str(tmpdir.join(name + '.log')))
+        )
+        path.chmod(0o755)
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ['PATH'])
+    return tmpdir
+
+def dependencies(size):
+    return [Dependency('pkg{}[extra1,extra2]'.format(i), '>=1.{}'.format(i)) for i in range(size)]
+
+def urls(size):
+    return ['git+https://example.com/pkg{0}.git#egg=pkg{0}-0'.format(i) for i in range(size)]
+
+def measure(results, name, size, func, repeat=3, setup=None, cache=None):
+    '''
+    Record best wall time of calling func
+
+    Parameters
+    ----------
+    setup : callable or None
+        Called before each call of func, not timed.
+    cache : str or None
+        State of the parse caches, ``cold`` or ``warm``, if func parses.
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    result = {'name': name, 'size': size, 'seconds': best}
+    if cache is not None:
+        result['cache'] = cache
+    results.append(result)
+
+def clear_caches():
+    plugin.requirement._parse.cache_clear()
+    plugin.requirement.parse_url.cache_clear()
+
+def measure_parsing(results, name, size, func):
+    '''
+    Record best wall time of func with cold and with warm parse caches
+
+    Parsing is memoized, so repeated calls only measure cache hits.
+    '''
+    measure(results, name, size, func, setup=clear_caches, cache='cold')
+    measure(results, name, size, func, cache='warm')
+
+@pytest.mark.parametrize('size', sizes)
+def test_from_dependency(results, size):
+    dependencies_ = dependencies(size)
+    measure_parsing(results, 'from_dependency', size, lambda: [plugin.requirement.from_dependency(dependency) for dependency in dependencies_])
+
+@pytest.mark.parametrize('size', sizes)
+def test_merge_urls(results, size):
+    dependencies_ = dependencies(size)
+    urls_ = urls(size)
+    def merge_urls():
+        requirements = plugin.requirement.index(map(plugin.requirement.from_dependency, dependencies_))
+        plugin._merge_urls(requirements, urls_, 'depends_on')
+    measure_parsing(results, 'merge_urls', size, merge_urls)
+
+@pytest.mark.parametrize('size', sizes)
+def test_merged_dependencies(results, size):
+    project = SimpleNamespace(
+        build_dependencies=dependencies(size),
+        plugin_dependencies=dependencies(size // 2) + [Dependency('plugin{}'.format(i)) for i in range(size // 2)],
+    )
+    measure_parsing(results, 'merged_dependencies', size, lambda: plugin._merged_dependencies(project))
+
+@pytest.mark.parametrize('size', sizes)
+def test_pip_compile(results, size):
+    dependencies_ = dependencies(size)
+    urls_ = urls(size)
+    measure_parsing(results, 'pip_compile', size, lambda: plugin._pip_compile(plugin._requirements(dependencies_, 'depends_on'), urls_, 'requirements', 'depends_on'))
+
+@pytest.mark.parametrize('size', sizes)
+def test_run_jobs(results, fake_pip_tools, size):
+    '''
+    Writing requirements.in files and running the stand-in pip-compile
+    '''
+    jobs = plugin._pip_compile(plugin._requirements(dependencies(size), 'depends_on'), urls(size), 'requirements', 'depends_on')
+    logger = SimpleNamespace(info=lambda *args: None, warn=lambda *args: None, debug=lambda *args: None)
+    def run_jobs():
+        compilation = plugin._Compilation(plugin.engine.create('subprocess'), None, logger, {})
+        plugin._run_jobs(jobs, 4, compilation)
+    with fake_pip_tools.as_cwd():
+        measure(results, 'run_jobs', size, run_jobs)
+
+@pytest.mark.parametrize('size', sizes)
+def test_sync_check(results, tmpdir, size):
+    '''
+    Checking whether the environment is in sync, which skips pip-sync
+    '''
+    requirements_txt = tmpdir.join('requirements_development.txt')
+    requirements_txt.write(''.join('pkg{0}==1.{0} \\\n    --hash=sha256:{1}\n'.format(i, 'a' * 64) for i in range(size)))
+    installed = {'pkg{}'.format(i): SimpleNamespace(version='1.{}'.format(i), requires=[]) for i in range(size)}
+    paths = [str(requirements_txt)]
+    def sync_check():
+        lock_digest = plugin.sync.digest(paths)
+        lock_file = plugin.sync.read_lock_files(paths)
+        assert plugin.sync.is_in_sync(lock_file, installed, lock_digest, lock_digest)
+    measure(results, 'sync_check', size, sync_check)
+
+def test_installed_distributions(results):
+    '''
+    Reading the installed distributions of the current environment, for the sync check
+    '''
+    measure(results, 'installed_distributions', len(plugin.sync.installed_distributions()), plugin.sync.installed_distributions)
@@ -0,0 +1,173 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test pybuilder_pip_tools.bundle
+'''
+
+import subprocess
+import pytest
+import tarfile
+import sys
+import io
+import os
+from textwrap import dedent
+from pybuilder_pip_tools import bundle
+
+def write(path, content):
+    with open(str(path), 'w') as f:
+        f.write(dedent(content))
+
+def test_read_requirements(tmpdir):
+    '''
+    Options are dropped and urls replaced by their name
+    '''
+    path = tmpdir.join('requirements.txt')
+    write(path, '''\
+        --find-links wheelhouse
+        six==1.17.0 \\
+            --hash=sha256:abc
+        -e git+https://example.com/pkg.git#egg=pkg-1.0
+        tomli==2.0 ; python_version < "3.0"
+    ''')
+    assert bundle.read_requirements(str(path)) == ['six==1.17.0', 'pkg', 'tomli==2.0 ; python_version < "3.0"']
+
+def test_read_build_requirements(tmpdir):
+    '''
+    Pins and other requirements are split, those not for this interpreter dropped
+    '''
+    path = tmpdir.join('requirements.txt')
+    write(path, '''\
+        --find-links wheelhouse
+        Six==1.17.0
+        tomli==2.0 ; python_version < "3.0"
+        zipp==3.0 ; python_version >= "3.0"
+        -e git+https://example.com/pkg.git#egg=pkg-1.0
+        other @ https://example.com/other.tar.gz
+    ''')
+    assert bundle.read_build_requirements([str(path)]) == (
+        {'six': '1.17.0', 'zipp': '3.0'},
+        ['git+https://example.com/pkg.git#egg=pkg-1.0', 'other @ https://example.com/other.tar.gz'],
+    )
+
+def test_find_wheels(tmpdir):
+    '''
+    Find compatible wheels by normalized name and version
+    '''
+    for name in ('Six-1.17-py2.py3-none-any.whl', 'a-1.0-cp27-cp27m-win32.whl', 'b.whl'):
+        tmpdir.join(name).ensure()
+    found, missing = bundle.find_wheels(str(tmpdir), {'six': '1.17.0', 'a': '1.0', 'c': '2'})
+    assert found == {'six': str(tmpdir.join('Six-1.17-py2.py3-none-any.whl'))}
+    assert missing == {'a': '1.0', 'c': '2'}
+
+def test_wheel_cache_key(tmpdir):
+    '''
+    Archive urls are keyed by their line, git urls by their commit, local paths are not cached
+    '''
+    archive = 'other @ https://example.com/other-1.0.tar.gz'
+    assert bundle.wheel_cache_key(archive) == bundle.wheel_cache_key(archive)
+    assert bundle.wheel_cache_key(archive) != bundle.wheel_cache_key('other @ https://example.com/other-2.0.tar.gz')
+    assert bundle.wheel_cache_key('other @ file:///src/other') is None
+    assert bundle.wheel_cache_key('/src/other') is None
+    assert bundle.wheel_cache_key('hg+https://example.com/pkg#egg=pkg-0') is None
+    assert bundle.wheel_cache_key('git+https://example.com/pkg.git@{}#egg=pkg-0'.format('a' * 40)) is not None
+    
+    repository = tmpdir.mkdir('repository')
+    def commit():
+        subprocess.run(
+            ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '-q', '--allow-empty', '-m', 'commit'],
+            cwd=str(repository), check=True,
+        )
+    subprocess.run(['git', 'init', '-q', str(repository)], check=True)
+    commit()
+    line = 'git+file://{}#egg=pkg-0'.format(repository)
+    key = bundle.wheel_cache_key(line)
+    assert key is not None
+    assert bundle.wheel_cache_key(line) == key
+    commit()
+    assert bundle.wheel_cache_key(line) not in (key, None)
+    assert bundle.wheel_cache_key('git+file://{}#egg=pkg-0'.format(tmpdir.join('missing'))) is None
+
+def create(tmpdir, content='wheel'):
+    wheel = tmpdir.join('six-1.17.0-py2.py3-none-any.whl')
+    wheel.write(content)
+    directory = tmpdir.join('bundles').ensure(dir=True)
+    return bundle.create(str(directory), [str(wheel)], {'requirements.txt': ['six==1.17.0']})
+
+def test_create_extract(tmpdir):
+    '''
+    Bundles are content-addressed and extracted after verification
+    '''
+    path, written = create(tmpdir)
+    assert written
+    assert os.path.basename(path).startswith('bundle-')
+    with open(path, 'rb') as f:
+        content = f.read()
+    os.remove(path)
+    assert create(tmpdir) == (path, True)
+    with open(path, 'rb') as f:
+        assert f.read() == content  # reproducible
+    assert create(tmpdir) == (path, False)
+    
+    manifest = bundle.extract(path, str(tmpdir.join('extracted')))
+    assert manifest['requirements'] == {'requirements.txt': ['six==1.17.0']}
+    assert tmpdir.join('extracted/wheels/six-1.17.0-py2.py3-none-any.whl').read() == 'wheel'
+    assert tmpdir.join('extracted/requirements/requirements.txt').read() == 'six==1.17.0\n'
+
+def test_create_supersedes(tmpdir):
+    '''
+    Writing a bundle removes the bundles it supersedes
+    '''
+    old_path, _ = create(tmpdir)
+    tmpdir.join('bundles/other.tar').ensure()
+    path, written = create(tmpdir, 'new wheel')
+    assert written and path != old_path
+    assert sorted(os.listdir(str(tmpdir.join('bundles')))) == [os.path.basename(path), 'other.tar']
+
+def test_extract_modified(tmpdir):
+    '''
+    A wheel which does not match the manifest is refused
+    '''
+    path, _ = create(tmpdir)
+    modified = str(tmpdir.join('modified.tar'))
+    with tarfile.open(path) as source, tarfile.open(modified, 'w') as tar:
+        for member in source.getmembers():
+            f = source.extractfile(member)
+            if member.name.startswith('wheels/'):
+                f = io.BytesIO(b'WHEEL')
+            tar.addfile(member, f)
+    with pytest.raises(bundle.InvalidBundle) as ex:
+        bundle.extract(modified, str(tmpdir.join('extracted')))
+    assert 'does not match the manifest' in str(ex.value)
+
+def test_installer(tmpdir):
+    '''
+    The installer in the bundle runs without pybuilder_pip_tools and PyBuilder
+    '''
+    path, _ = create(tmpdir)
+    with tarfile.open(path) as tar:
+        tmpdir.join('install.py').write_binary(tar.extractfile('install.py').read())
+    python = tmpdir.join('python')  # records the pip command instead of running it
+    python.write('#!/bin/sh\necho "$@" > {}\n'.format(tmpdir.join('args')))
+    python.chmod(0o755)
+    subprocess.check_call(
+        [sys.executable, '-I', '-S', str(tmpdir.join('install.py')), 'install', path, '--python', str(python), '--quiet'],
+        cwd=str(tmpdir)
+    )
+    args = tmpdir.join('args').read().split()
+    assert args[:5] == ['-m', 'pip', 'install', '--no-index', '--no-deps']
+    assert args[-1] == '--quiet'
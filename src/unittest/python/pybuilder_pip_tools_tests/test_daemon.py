@@ -0,0 +1,188 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test pybuilder_pip_tools.daemon
+'''
+
+from pybuilder_pip_tools import daemon, engine, process
+from types import SimpleNamespace
+import threading
+import socket
+import pytest
+import time
+import os
+
+class FakeEngine(object):
+
+    '''
+    Pins each requirement to 1.0, or fails on a 'fail' requirement
+    '''
+
+    def __init__(self):
+        self.running = False
+        self.calls = []
+
+    def compile(self, args, cancel=None, env=None):
+        assert not self.running, 'compilations overlap'
+        self.running = True
+        try:
+            time.sleep(0.01)
+            self.calls.append((args, env, os.getcwd()))
+            with open(args[0]) as f:
+                names = f.read().split()
+            if 'fail' in names:
+                raise process.ProcessFailed(['pip-compile'] + args, 2, 'out', 'no solution')
+            output = args[args.index('-o') + 1]
+            existing = ''
+            if os.path.exists(output):
+                with open(output) as f:
+                    existing = f.read()
+            with open(output, 'w') as f:
+                f.write(existing + ''.join('{}==1.0\n'.format(name) for name in names))
+            return process.Completed(['pip-compile'] + args, '', '', wall_time=0.01, cpu_time=0.01)
+        finally:
+            self.running = False
+
+@pytest.fixture
+def socket_path(tmpdir):
+    return str(tmpdir.join('daemon.sock'))
+
+@pytest.fixture
+def server(socket_path):
+    server = daemon.Server(socket_path, FakeEngine())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+def compile_(tmpdir, socket_path, names, name='requirements'):
+    requirements_in = tmpdir.join(name + '.in')
+    requirements_in.write(''.join(package + '\n' for package in names))
+    requirements_txt = tmpdir.join(name + '.txt')
+    daemon.compile_remote(socket_path, [str(requirements_in), '-o', str(requirements_txt), '--no-header'], {'PIP_NO_INDEX': '1'})
+    return requirements_txt.read()
+
+def test_compile(server, socket_path, tmpdir):
+    '''
+    The output is written to the client's output file, the existing output
+    and environment are passed to the engine
+    '''
+    tmpdir.join('requirements.txt').write('kept==2.0\n')
+    with tmpdir.as_cwd():
+        assert compile_(tmpdir, socket_path, ['pkg']) == 'kept==2.0\npkg==1.0\n'
+    args, env, cwd = server.engine.calls[0]
+    assert args[1:] == ['-o', args[2], '--no-header']
+    assert args[2] != str(tmpdir.join('requirements.txt'))  # the daemon's own copy
+    assert env == {'PIP_NO_INDEX': '1'}
+    assert cwd == str(tmpdir)
+    assert os.stat(socket_path).st_mode & 0o077 == 0
+
+def test_failed(server, socket_path, tmpdir):
+    '''
+    A failed compilation raises ProcessFailed with pip-compile's output
+    '''
+    with pytest.raises(process.ProcessFailed) as ex:
+        compile_(tmpdir, socket_path, ['fail'])
+    assert ex.value.returncode == 2
+    assert ex.value.stderr == 'no solution'
+
+def test_concurrent(server, socket_path, tmpdir):
+    '''
+    Concurrent requests are all served, one compilation at a time
+    '''
+    results = {}
+    def run(i):
+        results[i] = compile_(tmpdir, socket_path, ['pkg{}'.format(i)], 'requirements{}'.format(i))
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {i: 'pkg{}==1.0\n'.format(i) for i in range(8)}
+
+def test_unsupported_version(server, socket_path):
+    '''
+    Requests of another protocol version are refused
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(b'{"version": 0}\n')
+        assert b'Unsupported protocol version' in client.makefile('rb').readline()
+
+def test_unavailable(socket_path, tmpdir):
+    '''
+    When no daemon is listening, raise Unavailable
+    '''
+    with pytest.raises(daemon.Unavailable):
+        compile_(tmpdir, socket_path, ['pkg'])
+
+def test_fallback(socket_path, tmpdir):
+    '''
+    When no daemon is listening, the daemon engine runs pip-compile in a subprocess
+    '''
+    requirements_in = tmpdir.join('requirements.in')
+    requirements_in.write('')
+    requirements_txt = tmpdir.join('requirements.txt')
+    engine_ = engine.create('daemon', socket_path=socket_path)
+    engine_.compile([str(requirements_in), '-o', str(requirements_txt), '--no-header'])
+    assert not engine_.available
+    assert requirements_txt.check()
+
+def test_retry(socket_path, tmpdir, monkeypatch):
+    '''
+    After falling back, the daemon engine connects again once retry_interval has passed
+    '''
+    monkeypatch.setattr(engine.DaemonEngine, 'retry_interval', 0.2)
+    requirements_in = tmpdir.join('requirements.in')
+    requirements_in.write('pkg\n')
+    args = [str(requirements_in), '-o', str(tmpdir.join('requirements.txt')), '--no-header']
+    engine_ = engine.create('daemon', socket_path=socket_path)
+    fallback_calls = []
+    engine_._fallback = SimpleNamespace(compile=lambda *args: fallback_calls.append(args))
+    engine_.compile(args)
+    assert not engine_.available
+    server = daemon.Server(socket_path, FakeEngine())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        engine_.compile(args)
+        assert len(fallback_calls) == 2 and not server.engine.calls
+        time.sleep(0.2)
+        assert engine_.available
+        engine_.compile(args)
+        assert len(fallback_calls) == 2 and len(server.engine.calls) == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+def test_stale_socket(socket_path):
+    '''
+    serve removes the socket of a daemon which is no longer running
+    '''
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+    server = daemon.serve(socket_path)
+    try:
+        with pytest.raises(RuntimeError):
+            daemon.serve(socket_path)
+    finally:
+        server.server_close()
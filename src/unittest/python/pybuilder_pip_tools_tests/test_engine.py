@@ -0,0 +1,59 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test pybuilder_pip_tools.engine
+'''
+
+from pybuilder_pip_tools import engine
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import pytest
+import time
+import os
+
+def test_in_process_timeout():
+    '''
+    The in_process engine rejects a timeout it cannot enforce
+    '''
+    with pytest.raises(ValueError) as ex:
+        engine.create('in_process', timeout=10)
+    assert 'pybuilder_pip_tools_compile_timeout' in str(ex.value)
+    assert not engine.create('in_process').concurrent
+    
+def test_in_process_serialized(monkeypatch):
+    '''
+    In-process compilations of different engines run one at a time, each with its own environment and output
+    '''
+    running = []
+    overlaps = []
+    def main(cli, args):
+        running.append(args)
+        if len(running) > 1:
+            overlaps.append(list(running))
+        time.sleep(0.05)
+        print(os.environ['PYBUILDER_PIP_TOOLS_TEST'])
+        running.remove(args)
+        return 0
+    monkeypatch.setattr(engine, '_import_compile_module', lambda: SimpleNamespace(PyPIRepository=None, cli=None))
+    monkeypatch.setattr(engine, '_main', main)
+    engines = [engine.InProcessEngine({'PYBUILDER_PIP_TOOLS_TEST': str(i)}) for i in range(4)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        completed = list(executor.map(lambda i: engines[i].compile([str(i)]), range(4)))
+    assert not overlaps
+    assert [completed_.stdout for completed_ in completed] == ['0\n', '1\n', '2\n', '3\n']
+    assert 'PYBUILDER_PIP_TOOLS_TEST' not in os.environ
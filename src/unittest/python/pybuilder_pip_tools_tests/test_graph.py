@@ -0,0 +1,90 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test pybuilder_pip_tools.graph
+'''
+
+from pybuilder_pip_tools import graph, requirement
+
+annotated = '''\
+--extra-index-url file:///opt/wheels/simple
+
+-e git+https://example.com/url-pkg#egg=url-pkg-1.0
+    # via -r /tmp/requirements.in
+certifi==2026.7.22
+    # via
+    #   -c /tmp/constraints.txt
+    #   requests
+    #   url-pkg
+pytest[testing]==9.1.1
+    # via -r /tmp/requirements.in
+requests==2.34.2          # via -r /tmp/requirements.in, url-pkg
+
+# The following packages are considered to be unsafe in a requirements file:
+setuptools==80.0.0
+    # via pytest
+'''
+
+def test_parse():
+    '''
+    Annotations are stripped, both annotation styles are parsed
+    '''
+    content, nodes = graph.parse(annotated)
+    assert content == '''\
+--extra-index-url file:///opt/wheels/simple
+
+-e git+https://example.com/url-pkg#egg=url-pkg-1.0
+certifi==2026.7.22
+pytest[testing]==9.1.1
+requests==2.34.2
+
+# The following packages are considered to be unsafe in a requirements file:
+setuptools==80.0.0
+'''
+    assert sorted(nodes) == ['certifi', 'pytest', 'requests', 'setuptools', 'url-pkg']
+    assert nodes['url-pkg'] == {
+        'name': 'url-pkg', 'version': None, 'url': 'git+https://example.com/url-pkg#egg=url-pkg-1.0',
+        'extras': [], 'direct': True, 'parents': [],
+    }
+    assert nodes['certifi']['parents'] == ['requests', 'url-pkg']
+    assert not nodes['certifi']['direct']
+    assert nodes['pytest']['extras'] == ['testing']
+    assert nodes['requests']['direct']
+    assert nodes['requests']['parents'] == ['url-pkg']
+    assert nodes['setuptools']['parents'] == ['pytest']
+
+def test_to_dict():
+    '''
+    Direct dependencies get their origins, url overrides are marked
+    '''
+    requirements = {
+        'url-pkg': requirement.Requirement('url-pkg', 'url-pkg', origins=('depends_on',)),
+        'requests': requirement.Requirement('Requests', 'requests', '[socks]', origins=('build_depends_on', 'plugin_depends_on')),
+        'pytest': requirement.Requirement('pytest', 'pytest', origins=('depends_on',)),
+    }
+    graph_ = graph.to_dict(graph.parse(annotated)[1], requirements.values())
+    nodes = {node['key']: node for node in graph_['nodes']}
+    assert nodes['url-pkg']['origin'] == ['depends_on', 'url']
+    assert nodes['requests']['origin'] == ['build_depends_on', 'plugin_depends_on']
+    assert nodes['requests']['extras'] == ['socks']
+    assert nodes['pytest']['extras'] == ['testing']
+    assert nodes['certifi']['origin'] == []
+    assert {'from': 'url-pkg', 'to': 'certifi'} in graph_['edges']
+    derived = {node['key']: node for node in graph.without_urls(graph_)['nodes']}
+    assert derived['url-pkg']['origin'] == ['depends_on']
+    assert derived['url-pkg']['url'] is None
@@ -0,0 +1,131 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test pybuilder_pip_tools.hashes
+'''
+
+from pybuilder_pip_tools import hashes
+import hashlib
+import pytest
+
+def sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+@pytest.fixture
+def store(tmpdir):
+    return hashes.HashStore(str(tmpdir.join('store', 'hashes.sqlite')))
+
+def test_add_hashes(tmpdir, store):
+    '''
+    Pins get the hashes of all their files in find-links, other lines are kept
+    '''
+    wheelhouse = tmpdir.mkdir('wheelhouse')
+    wheelhouse.join('My_Pkg-1.0-py3-none-any.whl').write_binary(b'wheel')
+    wheelhouse.join('my-pkg-1.0.tar.gz').write_binary(b'sdist')
+    wheelhouse.join('my_pkg-1.1.tar.gz').write_binary(b'other version')
+    wheelhouse.join('other-1.0.tar.gz').write_binary(b'other package')
+    requirements_txt = tmpdir.join('requirements.txt')
+    requirements_txt.write(
+        '--find-links {}\n'
+        '\n'
+        'my.pkg[extra]==1.0 \\\n'
+        '    --hash=sha256:outdated\n'
+        '    # via -r requirements.in\n'
+        .format(wheelhouse)
+    )
+    expected = (
+        '--find-links {}\n'
+        '\n'
+        'my.pkg[extra]==1.0 \\\n'
+        '{}'
+        '    # via -r requirements.in\n'
+        .format(wheelhouse, ' \\\n'.join(
+            '    --hash=sha256:' + hash_ for hash_ in sorted([sha256(b'wheel'), sha256(b'sdist')])
+        ) + '\n')
+    )
+    assert hashes.add_hashes(str(requirements_txt), store, {'PIP_NO_INDEX': '1'}) == 1
+    assert requirements_txt.read() == expected
+
+    # Second time, hashes come from the store
+    wheelhouse.remove()
+    assert hashes.add_hashes(str(requirements_txt), store, {'PIP_NO_INDEX': '1'}) == 0
+    assert requirements_txt.read() == expected
+
+def test_refetch(tmpdir, store):
+    '''
+    Hashes are looked up again when a file is added or the sources change
+    '''
+    wheelhouse = tmpdir.mkdir('wheelhouse')
+    wheelhouse.join('pkg-1.0.tar.gz').write_binary(b'sdist')
+    requirements_txt = tmpdir.join('requirements.txt')
+    requirements_txt.write('--find-links {}\npkg==1.0\n'.format(wheelhouse))
+    assert hashes.add_hashes(str(requirements_txt), store, {'PIP_NO_INDEX': '1'}) == 1
+
+    # A wheel is added
+    wheelhouse.join('pkg-1.0-py3-none-any.whl').write_binary(b'wheel')
+    assert hashes.add_hashes(str(requirements_txt), store, {'PIP_NO_INDEX': '1'}) == 1
+    assert sha256(b'wheel') in requirements_txt.read()
+    assert hashes.add_hashes(str(requirements_txt), store, {'PIP_NO_INDEX': '1'}) == 0
+
+    # Another source is added
+    other = tmpdir.mkdir('other')
+    assert hashes.add_hashes(str(requirements_txt), store, {'PIP_NO_INDEX': '1', 'PIP_FIND_LINKS': str(other)}) == 1
+
+    # Stored hashes expire
+    assert store.get('pkg', '1.0', ['find-links ' + str(wheelhouse)]) is not None
+    assert store.get('pkg', '1.0', ['find-links ' + str(wheelhouse)], max_age=-1) is None
+
+def test_not_found(tmpdir, store):
+    '''
+    When no files are found, raise HashesNotFound
+    '''
+    requirements_txt = tmpdir.join('requirements.txt')
+    requirements_txt.write('pkg==1.0\n')
+    with pytest.raises(hashes.HashesNotFound):
+        hashes.add_hashes(str(requirements_txt), store, {'PIP_NO_INDEX': '1'})
+
+def test_configured_index(tmpdir, monkeypatch):
+    '''
+    When pip is configured with an index the requirements file does not name,
+    fail instead of looking up hashes on pypi.org
+    '''
+    config = tmpdir.join('pip.conf')
+    config.write('[global]\nindex-url = https://example.com/simple\n')
+    monkeypatch.setenv('PIP_CONFIG_FILE', str(config))
+    monkeypatch.delenv('PIP_INDEX_URL', raising=False)
+    with pytest.raises(hashes.HashesNotFound) as ex:
+        hashes._session([(True, hashes.DEFAULT_INDEX_URL)])
+    assert 'https://example.com/simple' in str(ex.value)
+    assert hashes._session([(True, 'https://example.com/simple')]) is not None
+
+def test_list_files(tmpdir):
+    '''
+    Files and their hashes are read from simple index pages
+    '''
+    page = tmpdir.join('index.html')
+    page.write(
+        '<html><body>'
+        '<a href="pkg-1.0.tar.gz#sha256={}">pkg-1.0.tar.gz</a>'
+        '<a href="https://example.com/pkg-1.0-py3-none-any.whl">pkg-1.0-py3-none-any.whl</a>'
+        '</body></html>'
+        .format('A' * 64)
+    )
+    assert hashes._list_files('file://' + str(page), hashes._session([])) == [
+        ('pkg-1.0.tar.gz', 'file://' + str(tmpdir.join('pkg-1.0.tar.gz')), 'a' * 64),
+        ('pkg-1.0-py3-none-any.whl', 'https://example.com/pkg-1.0-py3-none-any.whl', None),
+    ]
@@ -0,0 +1,136 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test pybuilder_pip_tools.history
+'''
+
+from pybuilder_pip_tools import history
+from pybuilder.errors import MissingPropertyException
+from unittest.mock import Mock
+import pybuilder_pip_tools as plugin
+import pytest
+
+def report(start, compile_seconds, dependencies, hits=0, misses=1, failed=False):
+    return {
+        'start': start,
+        'seconds': compile_seconds + 1,
+        'failed': failed,
+        'phases': [{'name': 'Compiling', 'seconds': compile_seconds}, {'name': 'Syncing', 'seconds': 1.0}],
+        'processes': [
+            {'name': 'pip-compile', 'file': 'requirements.txt', 'wall_seconds': compile_seconds, 'cpu_seconds': None, 'max_rss_kib': None},
+            {'name': 'pip-sync', 'file': None, 'wall_seconds': 1.0, 'cpu_seconds': 0.5, 'max_rss_kib': 1000},
+        ],
+        'lock_cache': {'files': {}, 'hits': hits, 'misses': misses},
+        'files': {'changed': [], 'unchanged': []},
+        'stems': {'requirements': {'dependencies': dependencies, 'urls': 0}},
+    }
+
+@pytest.fixture
+def history_(tmpdir):
+    return history.History(str(tmpdir.join('history', 'history.sqlite')))
+
+def test_add_runs(history_):
+    '''
+    Runs are returned per project, oldest first, since the given time
+    '''
+    history_.add('/a', 'pip_sync', report('2026-01-02T00:00:00+00:00', 2.0, ['six'], failed=True))
+    history_.add('/a', 'pip_compile', report('2026-01-01T00:00:00+00:00', 1.0, ['requests', 'six']))
+    history_.add('/b', 'pip_sync', report('2026-01-03T00:00:00+00:00', 3.0, []))
+    runs = history_.runs('/a')
+    assert [run['task'] for run in runs] == ['pip_compile', 'pip_sync']
+    assert runs[0]['stems'] == {'requirements': {'dependencies': ['requests', 'six'], 'urls': 0}}
+    assert runs[0]['phases'] == [{'name': 'Compiling', 'seconds': 1.0}, {'name': 'Syncing', 'seconds': 1.0}]
+    assert runs[0]['processes'][1] == {
+        'name': 'pip-sync', 'file': None, 'wall_seconds': 1.0, 'cpu_seconds': 0.5, 'max_rss_kib': 1000
+    }
+    assert runs[1]['failed'] is True
+    assert [run['task'] for run in history_.runs('/a', since='2026-01-02')] == ['pip_sync']
+
+def test_stats():
+    '''
+    Percentiles, trends and the dependencies added when compile time increased
+    '''
+    runs = [
+        dict(report('2026-01-0{}'.format(i), seconds, dependencies, hits=1, misses=0 if i % 2 else 1),
+             task='pip_sync', lock_cache_hits=1, lock_cache_misses=0 if i % 2 else 1)
+        for i, (seconds, dependencies) in enumerate(
+            [(1.0, ['six']), (1.0, ['six']), (3.0, ['six', 'pandas']), (3.0, ['pandas'])], 1
+        )
+    ]
+    stats = history.stats(runs)
+    assert stats['runs'] == 4
+    assert stats['lock_cache_hit_rate'] == 4 / 6
+    compiling = stats['phases'][0]
+    assert compiling['name'] == 'Compiling'
+    assert (compiling['p50'], compiling['max'], compiling['trend']) == (2.0, 3.0, 2.0)
+    assert stats['phases'][1]['trend'] == 0
+    assert stats['stems'][0]['dependencies'] == [1, 1]
+    assert stats['increases'] == [{
+        'stem': 'requirements', 'start': '2026-01-03', 'seconds': [1.0, 3.0], 'added': ['pandas'], 'removed': [],
+    }]
+    assert any('added: pandas' in line for line in history.format_stats(stats))
+
+@pytest.mark.parametrize('q, expected', ((0, 1), (50, 2.5), (90, 3.7), (100, 4)))
+def test_percentile(q, expected):
+    assert history.percentile([1, 2, 3, 4], q) == pytest.approx(expected)
+
+def test_prune(history_):
+    '''
+    Runs of all projects which started before the given time are removed with their rows
+    '''
+    history_.add('/a', 'pip_sync', report('2026-01-01T00:00:00+00:00', 1.0, ['six']))
+    history_.add('/b', 'pip_sync', report('2026-01-02T00:00:00+00:00', 1.0, ['six']))
+    history_.add('/a', 'pip_sync', report('2026-01-03T00:00:00+00:00', 3.0, ['requests']))
+    assert history_.prune('2026-01-03T00:00:00+00:00') == 2
+    assert history_.prune('2026-01-03T00:00:00+00:00') == 0
+    assert history_.runs('/b') == []
+    runs = history_.runs('/a')
+    assert [run['seconds'] for run in runs] == [4.0]
+    assert runs[0]['stems'] == {'requirements': {'dependencies': ['requests'], 'urls': 0}}
+    with history_._connection() as connection:
+        for table in history._RUN_TABLES:
+            assert connection.execute('SELECT COUNT(DISTINCT run) FROM {}'.format(table)).fetchone() == (1,)
+
+def test_reported_missing_property():
+    '''
+    A missing property is logged as well, it does not mask the exception of the run
+    '''
+    project = Mock(basedir='/a')
+    project.expand_path.side_effect = MissingPropertyException('dir_reports')
+    project.get_property.side_effect = MissingPropertyException('pybuilder_pip_tools_history')
+    logger = Mock()
+    with pytest.raises(ValueError, match='task failed'):
+        with plugin._reported(project, logger, 'pip_sync'):
+            raise ValueError('task failed')
+    assert logger.warn.call_count == 2
+
+def test_reported_unwritable(tmpdir):
+    '''
+    Failing to write the report or history is logged, it does not fail a run nor mask its exception
+    '''
+    tmpdir.join('file').write('')
+    project = Mock(basedir=str(tmpdir))
+    project.expand_path.return_value = str(tmpdir.join('file', 'pybuilder_pip_tools.json'))
+    project.get_property.return_value = str(tmpdir.join('file', 'history.sqlite'))
+    logger = Mock()
+    with plugin._reported(project, logger, 'pip_sync'):
+        pass
+    assert logger.warn.call_count == 2
+    with pytest.raises(ValueError, match='task failed'):
+        with plugin._reported(project, logger, 'pip_sync'):
+            raise ValueError('task failed')
@@ -0,0 +1,94 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test pybuilder_pip_tools.lock_cache
+'''
+
+from pybuilder_pip_tools.lock_cache import LockCache
+from pybuilder_pip_tools import process, requirement
+from unittest.mock import Mock
+import pybuilder_pip_tools as plugin
+import os
+import time
+
+def test_expires(tmpdir):
+    '''
+    Entries looked up with expires are misses after max_age, without it they never expire
+    '''
+    cache = LockCache(str(tmpdir.join('cache')), 10, max_age=60)
+    source = tmpdir.join('source.txt')
+    source.write('pkg==1.0\n')
+    cache.put('key', str(source))
+    output = str(tmpdir.join('output.txt'))
+    assert cache.get('key', output, expires=True)
+    
+    # Hits with expires do not refresh the entry
+    entry = str(tmpdir.join('cache', 'key.txt'))
+    stored = time.time() - 120
+    os.utime(entry, (stored, stored))
+    assert cache.get('key', output)
+    os.utime(entry, (stored, stored))
+    assert not cache.get('key', output, expires=True)
+    assert os.stat(entry).st_mtime == stored
+    
+    # Without max_age, entries do not expire
+    assert LockCache(str(tmpdir.join('cache')), 10).get('key', output, expires=True)
+
+def test_lock_files_bounded(tmpdir):
+    '''
+    Keys share lock files by prefix, so evicted entries leave no lock file behind
+    '''
+    cache = LockCache(str(tmpdir.join('cache')), 2)
+    source = tmpdir.join('source.txt')
+    source.write('pkg==1.0\n')
+    for i in range(10):
+        key = 'ab{:062x}'.format(i)
+        with cache.lock(key):
+            cache.put(key, str(source))
+    assert sorted(name for name in os.listdir(str(tmpdir.join('cache'))) if not name.endswith('.txt')) == ['ab.lock']
+
+class FakeEngine(object):
+    
+    concurrent = True
+    
+    def __init__(self, version):
+        self.version = version
+        self.compiled = 0
+    
+    def compile(self, args, cancel=None, on_line=None):
+        with open(args[args.index('-o') + 1], 'w') as f:
+            f.write('pkg=={}\n'.format(self.version))
+        self.compiled += 1
+        return process.Completed(['pip-compile'] + args, '', '', wall_time=0)
+    
+def test_upgrade_bypasses_cache(tmpdir):
+    '''
+    Compilations with --upgrade-package are neither restored from nor stored in the lock cache
+    '''
+    cache = LockCache(str(tmpdir.join('cache')), 10)
+    dependencies = {'pkg': requirement.Requirement('pkg', 'pkg')}
+    requirements_file = str(tmpdir.join('requirements.txt'))
+    tmpdir.join('requirements.txt').write('pkg==1.0\n')
+    for version in ('2.0', '3.0'):
+        engine = FakeEngine(version)
+        compilation = plugin._Compilation(engine, cache, Mock(), {}, upgrade_packages=['pkg'])
+        plugin._write_requirements_txt(dependencies, requirements_file, False, compilation)
+        assert engine.compiled == 1
+        assert tmpdir.join('requirements.txt').read() == 'pkg=={}\n'.format(version)
+        tmpdir.join('requirements.txt').write('pkg==1.0\n')
+    assert not tmpdir.join('cache').listdir()
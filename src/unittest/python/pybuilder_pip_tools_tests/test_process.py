@@ -0,0 +1,123 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test pybuilder_pip_tools.process
+'''
+
+from pybuilder_pip_tools import process
+from unittest.mock import Mock
+import pybuilder_pip_tools as plugin
+import threading
+import pytest
+import signal
+import time
+import sys
+import os
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+def test_run():
+    '''
+    Lines are passed on as they are read, only the last lines are kept
+    '''
+    lines = []
+    completed = process.run(
+        python('import sys\nfor i in range(1000): print(i)\nprint("error", file=sys.stderr)'),
+        on_line=lines.append, tail_lines=2,
+    )
+    assert completed.stdout == '998\n999\n'
+    assert completed.stderr == 'error\n'
+    assert sorted(lines) == sorted([str(i) for i in range(1000)] + ['error'])
+
+def test_failed():
+    '''
+    When the process fails, raise ProcessFailed with the last lines of output
+    '''
+    with pytest.raises(process.ProcessFailed) as ex:
+        process.run(python('import sys\nprint("out")\nsys.exit(3)'), env={'UNUSED': '1'})
+    assert ex.value.returncode == 3
+    assert ex.value.stdout == 'out\n'
+
+@pytest.mark.skipif(os.name != 'posix', reason='process groups are Unix only')
+def test_timeout(tmpdir):
+    '''
+    On timeout, kill the process and the processes it started
+    '''
+    pid_file = tmpdir.join('pid')
+    code = (
+        'import subprocess, sys, time\n'
+        'child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])\n'
+        'open({!r}, "w").write(str(child.pid))\n'
+        'print("started", flush=True)\n'
+        'time.sleep(60)\n'
+    ).format(str(pid_file))
+    start = time.perf_counter()
+    with pytest.raises(process.TimedOut) as ex:
+        process.run(python(code), timeout=1)
+    assert time.perf_counter() - start < 30
+    assert ex.value.stdout == 'started\n'
+    assert 'timed out after 1s' in str(ex.value)
+    child = int(pid_file.read())
+    for _ in range(100):
+        if not is_running(child):
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail('child process still running')
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().split(')')[-1].split()[0] != 'Z'  # zombies are dead, awaiting their parent
+    except FileNotFoundError:
+        return sys.platform != 'linux'  # no /proc, kill succeeded
+
+def test_cancel():
+    '''
+    When cancelled, kill the process and raise Cancelled
+    '''
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+    with pytest.raises(process.Cancelled):
+        process.run(python('import time; time.sleep(60)'), cancel)
+
+def test_run_jobs_interrupted():
+    '''
+    On KeyboardInterrupt, _run_jobs kills the processes of running jobs and re-raises
+    '''
+    started = threading.Event()
+    def job(compilation):
+        started.set()
+        process.run(python('import time; time.sleep(60)'), compilation.cancel)
+    compilation = plugin._Compilation(None, None, Mock(), {})
+    main_thread = threading.get_ident()
+    def interrupt():
+        started.wait()
+        time.sleep(0.5)
+        signal.pthread_kill(main_thread, signal.SIGINT)
+    threading.Thread(target=interrupt, daemon=True).start()
+    start = time.perf_counter()
+    with pytest.raises(KeyboardInterrupt):
+        plugin._run_jobs([job, job], 2, compilation)
+    assert compilation.cancel.is_set()
+    assert time.perf_counter() - start < 30
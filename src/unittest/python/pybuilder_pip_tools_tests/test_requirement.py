@@ -0,0 +1,140 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of PyBuilder Pip Tools.
+# 
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test pybuilder_pip_tools.requirement
+'''
+
+import pytest
+from pybuilder.core import Dependency
+from pybuilder.errors import BuildFailedException
+from types import SimpleNamespace
+from pybuilder_pip_tools import requirement
+import pybuilder_pip_tools as plugin
+
+@pytest.mark.parametrize('version, satisfiable', (
+    (None, True),
+    ('==1.0', True),
+    ('>1,<2', True),
+    ('>=1,<=1', True),
+    ('==1.*,>=1.5', True),
+    ('~=1.4,<1.9', True),
+    ('==1!1.0,>=2', True),
+    ('==1.0,>=2', False),
+    ('==1.0,==2.0', False),
+    ('==1.0,!=1.0', False),
+    ('>=2,<1', False),
+    ('>=1,<1', False),
+    ('>=1,<=1,!=1', False),
+    ('==1.*,>=2', False),
+    ('~=1.4,>=2', False),
+    ('~=1.4.2,>=1.5', False),
+))
+def test_is_satisfiable(version, satisfiable):
+    assert requirement.is_satisfiable(version) == satisfiable
+    
+def test_merged_dependencies():
+    '''
+    Build and plugin dependencies of the same package are merged
+    '''
+    project = SimpleNamespace(
+        build_dependencies=[Dependency('pytest', '>=7'), Dependency('a[x]'), Dependency('six')],
+        plugin_dependencies=[Dependency('PyTest', '<9'), Dependency('a[y]', '==1.0'), Dependency('b')],
+    )
+    merged = plugin._merged_dependencies(project)
+    assert {key: requirement.line() for key, requirement in merged.items()} == {
+        ('pytest', None): 'pytest<9,>=7',
+        ('a', None): 'a[x,y]==1.0',
+        ('six', None): 'six',
+        ('b', None): 'b',
+    }
+    assert merged['pytest', None].origins == ('build_depends_on', 'plugin_depends_on')
+    assert merged['b', None].origins == ('plugin_depends_on',)
+
+def test_merged_dependencies_markers():
+    '''
+    Dependencies with different markers are kept as separate lines, not intersected
+    '''
+    project = SimpleNamespace(
+        build_dependencies=[Dependency('foo; python_version >= "3.10"', '>=2'), Dependency('bar; os_name == "nt"', '>=1')],
+        plugin_dependencies=[Dependency('foo; python_version < "3.10"', '<2'), Dependency('bar', '<2')],
+    )
+    merged = plugin._merged_dependencies(project)
+    assert [requirement.line() for requirement in merged.values()] == [
+        'foo>=2; python_version >= "3.10"',
+        'bar>=1; os_name == "nt"',
+        'foo<2; python_version < "3.10"',
+        'bar<2',
+    ]
+
+def test_merged_dependencies_conflict():
+    '''
+    When build and plugin dependency plainly conflict, fail build
+    '''
+    project = SimpleNamespace(
+        build_dependencies=[Dependency('pytest', '==8.0')],
+        plugin_dependencies=[Dependency('pytest', '>=9')],
+    )
+    with pytest.raises(BuildFailedException) as ex:
+        plugin._merged_dependencies(project)
+    assert str(ex.value) == (
+        "Conflicting version constraints on 'pytest': build_depends_on requires 'pytest==8.0', "
+        "plugin_depends_on requires 'pytest>=9'. No version satisfies both."
+    )
+
+def test_index():
+    '''
+    A package may be required once per marker, equal duplicates are dropped
+    '''
+    requirements = requirement.index(map(requirement.from_dependency, [
+        SimpleNamespace(name='six', version='>=1.16', markers='python_version >= "3.10"'),
+        SimpleNamespace(name='six', version='<1.16', markers='python_version < "3.10"'),
+        SimpleNamespace(name='Six', version='>=1.16', markers='python_version >= "3.10"'),
+        SimpleNamespace(name='pytest', version='<9,>=7'),
+        SimpleNamespace(name='pytest', version='>=7,<9'),
+    ]))
+    assert [requirement.line() for requirement in requirements.values()] == [
+        'six>=1.16; python_version >= "3.10"',
+        'six<1.16; python_version < "3.10"',
+        'pytest<9,>=7',
+    ]
+
+def test_index_duplicate():
+    '''
+    When a package is required twice differently with the same marker, fail build
+    '''
+    with pytest.raises(BuildFailedException) as ex:
+        requirement.index(map(requirement.from_dependency, [
+            SimpleNamespace(name='pytest', version='>=7'),
+            SimpleNamespace(name='pytest', version='>=8'),
+        ]))
+    assert str(ex.value) == (
+        "Dependency 'pytest' is declared twice: 'pytest>=7' and 'pytest>=8'. "
+        "Declare it once, or with different environment markers."
+    )
+
+@pytest.mark.parametrize('name, version, message', (
+    ('pkg[', None, "Invalid dependency name 'pkg['."),
+    ('pkg', '>=1.0,<<2', "Invalid version specifier '>=1.0,<<2' of dependency 'pkg'."),
+))
+def test_invalid(name, version, message):
+    '''
+    Invalid names and version specifiers are quoted in the error
+    '''
+    with pytest.raises(BuildFailedException) as ex:
+        requirement.from_dependency(SimpleNamespace(name=name, version=version))
+    assert str(ex.value).startswith(message)
@@ -0,0 +1,118 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test pybuilder_pip_tools.sync
+'''
+
+from pybuilder_pip_tools import sync
+from types import SimpleNamespace
+from importlib.metadata import MetadataPathFinder
+import sys
+import os
+
+def distribution(version, *requires):
+    return SimpleNamespace(version=version, requires=list(requires))
+
+def test_plan():
+    '''
+    Plan only the changes, like pip-sync
+    '''
+    installed = {
+        'kept': distribution('1.0'),
+        'upgraded': distribution('1.0'),
+        'extraneous': distribution('1.0'),
+        'pip': distribution('20.0', 'pip-dependency'),
+        'pip-dependency': distribution('1.0'),
+        'url-pkg': distribution('1.0'),
+    }
+    lock_file = sync.LockFile(
+        pins={'kept': '1.0.0', 'upgraded': '2.0', 'new': '1.0'},
+        editables={'url-pkg': '-e git+https://example.com/url-pkg#egg=url-pkg-0'},
+        unpinned=[],
+    )
+    plan = sync.plan(lock_file, installed)
+    assert plan.uninstall == ['extraneous']
+    assert plan.install == ['new==1.0', 'upgraded==2.0', '-e git+https://example.com/url-pkg#egg=url-pkg-0']
+
+def test_plan_unpinned():
+    '''
+    When there are unpinned requirements, there is no plan
+    '''
+    lock_file = sync.LockFile(pins={}, editables={}, unpinned=['pkg==1.0; python_version < "3"'])
+    assert sync.plan(lock_file, {}) is None
+
+def test_plan_hashes(tmpdir):
+    '''
+    Options and hashes of the requirements files are kept in the plan
+    '''
+    requirements_txt = tmpdir.join('requirements_development.txt')
+    requirements_txt.write(
+        '--extra-index-url https://example.com/simple\n'
+        '--require-hashes\n'
+        '\n'
+        'pkg==1.0 \\\n'
+        '    --hash=sha256:aaa \\\n'
+        '    --hash=sha256:bbb\n'
+        '    # via -r requirements.in\n'
+    )
+    lock_file = sync.read_lock_files([str(requirements_txt)])
+    assert lock_file.unpinned == []
+    assert lock_file.options == ['--extra-index-url https://example.com/simple', '--require-hashes']
+    assert lock_file.hashes == {'pkg': ['sha256:aaa', 'sha256:bbb']}
+    plan = sync.plan(lock_file, {})
+    assert plan.install == ['pkg==1.0 --hash=sha256:aaa --hash=sha256:bbb']
+    assert plan.options == lock_file.options
+
+def test_is_current_environment(tmpdir, monkeypatch):
+    '''
+    A script runs in the current environment if it or its interpreter is installed in it
+    '''
+    python = os.path.dirname(sys.executable)
+    scripts = {
+        'here': '#!{}\n'.format(sys.executable),
+        'elsewhere': '#!{}\n'.format(tmpdir.join('venv', 'bin', 'python')),
+        'shim': '#!/usr/bin/env bash\n',
+    }
+    for name, shebang in scripts.items():
+        tmpdir.join('bin', name).write(shebang, ensure=True)
+        tmpdir.join('bin', name).chmod(0o755)
+    monkeypatch.setenv('PATH', '{}{}{}'.format(tmpdir.join('bin'), os.pathsep, python))
+    assert sync.is_current_environment('here')
+    assert not sync.is_current_environment('elsewhere')
+    assert not sync.is_current_environment('shim')
+    assert not sync.is_current_environment('missing')
+    assert sync.is_current_environment(os.path.basename(sys.executable))  # installed next to the interpreter
+
+def test_installed_distributions(tmpdir, monkeypatch):
+    '''
+    Only the site-packages of the environment are searched, not all of sys.path
+    '''
+    tmpdir.join('elsewhere-1.0.dist-info', 'METADATA').write('Metadata-Version: 2.1\nName: elsewhere\nVersion: 1.0\n', ensure=True)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    class Finder(object):  # like PyBuilder's finder of its vendored packages
+        @staticmethod
+        def find_spec(*args):
+            return None
+        @staticmethod
+        def find_distributions(context):
+            context.path.insert(0, str(tmpdir))
+            return MetadataPathFinder.find_distributions(context)
+    monkeypatch.setattr(sys, 'meta_path', [Finder] + sys.meta_path)
+    installed = sync.installed_distributions()
+    assert 'elsewhere' not in installed
+    assert 'pytest' in installed
@@ -0,0 +1,57 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of PyBuilder Pip Tools.
+# 
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test pybuilder_pip_tools.testing
+'''
+
+import subprocess
+import sys
+import os
+from pybuilder_pip_tools.testing import clone_venv
+
+def test_clone_venv(tmpdir):
+    '''
+    Files are hard linked, except those referring to the venv path
+    '''
+    template = tmpdir.mkdir('template')
+    template.join('pyvenv.cfg').write('command = python -m venv {}\n'.format(template))
+    template.mkdir('bin').join('pip').write('#!{}/bin/python\n'.format(template))
+    template.join('bin', 'pip').chmod(0o755)
+    os.symlink('/usr/bin/python3', str(template.join('bin', 'python')))
+    template.mkdir('lib').join('module.py').write('x = 1\n')
+    os.symlink('lib', str(template.join('lib64')))
+    
+    clone = tmpdir.join('clone')
+    clone_venv(str(template), str(clone))
+    
+    assert clone.join('pyvenv.cfg').read() == 'command = python -m venv {}\n'.format(clone)
+    assert clone.join('bin', 'pip').read() == '#!{}/bin/python\n'.format(clone)
+    assert os.access(str(clone.join('bin', 'pip')), os.X_OK)
+    assert os.readlink(str(clone.join('bin', 'python'))) == '/usr/bin/python3'
+    assert os.readlink(str(clone.join('lib64'))) == 'lib'
+    assert clone.join('lib', 'module.py').stat().ino == template.join('lib', 'module.py').stat().ino
+
+def test_import_without_pytest():
+    '''
+    The module can be imported without pytest, only its fixtures need it
+    '''
+    subprocess.check_call([
+        sys.executable, '-c',
+        "import sys; sys.modules['pytest'] = None; "
+        "from pybuilder_pip_tools import testing; assert not hasattr(testing, 'pybuilder_venv')"
+    ], env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
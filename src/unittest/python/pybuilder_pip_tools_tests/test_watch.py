@@ -0,0 +1,45 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of PyBuilder Pip Tools.
+# 
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test pybuilder_pip_tools.watch
+'''
+
+import threading
+import pytest
+import time
+import os
+from pybuilder_pip_tools.watch import Watcher
+
+@pytest.mark.timeout(10)
+def test_replaced_file(tmpdir):
+    '''
+    When a watched file is replaced, like editors save files, wait returns it
+    '''
+    watched = tmpdir.join('build.py')
+    watched.write('a')
+    tmpdir.join('other.py').write('a')
+    def edit():
+        time.sleep(0.2)
+        tmpdir.join('other.py').write('bb')
+        tmpdir.join('build.py.new').write('bb')
+        os.replace(str(tmpdir.join('build.py.new')), str(watched))
+    with Watcher([str(watched)], interval=0.05) as watcher:
+        thread = threading.Thread(target=edit)
+        thread.start()
+        assert watcher.wait() == [str(watched)]
+        thread.join()
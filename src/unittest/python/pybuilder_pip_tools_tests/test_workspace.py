@@ -0,0 +1,58 @@
+# Copyright (C) 2016 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of PyBuilder Pip Tools.
+#
+# PyBuilder Pip Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBuilder Pip Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PyBuilder Pip Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test pybuilder_pip_tools.workspace
+'''
+
+from pybuilder_pip_tools import workspace
+from pybuilder_pip_tools.lock_cache import LockCache
+import threading
+import time
+
+def test_find_projects(tmpdir):
+    '''
+    Find directories with a build.py, skipping hidden and target directories and virtual environments
+    '''
+    for path in (
+        'a/build.py', 'a/nested/build.py', 'b/c/build.py', 'a/target/x/build.py', '.hidden/build.py', 'd/setup.py',
+        'a/venv/pyvenv.cfg', 'a/venv/lib/python3.11/site-packages/piptools/build.py', 'a/venv/build.py',
+        'e/lib/python2.7/site-packages/setuptools/command/build.py',
+    ):
+        tmpdir.join(path).ensure()
+    assert workspace.find_projects([str(tmpdir), str(tmpdir.join('a'))]) == [
+        str(tmpdir.join('a')), str(tmpdir.join('a/nested')), str(tmpdir.join('b/c')),
+    ]
+
+def test_lock_cache_lock(tmpdir):
+    '''
+    A second holder of the lock on an entry waits for the first
+    '''
+    cache = LockCache(str(tmpdir), 10)
+    events = []
+    def hold():
+        with cache.lock('key'):
+            events.append('first')
+            time.sleep(0.2)
+            events.append('first done')
+    thread = threading.Thread(target=hold)
+    thread.start()
+    time.sleep(0.05)
+    with cache.lock('key'):
+        events.append('second')
+    thread.join()
+    assert events == ['first', 'first done', 'second']